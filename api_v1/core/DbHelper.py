@@ -1,16 +1,132 @@
+import functools
+import time
 from asyncio import current_task
+from contextvars import ContextVar
+from uuid import uuid4
 
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, async_scoped_session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from .config import settings
+from .metrics import registry
+
+SQL_SECONDS = registry.histogram("db_query_duration_seconds", "Время выполнения SQL-запроса по функциям crud",
+                                 ("function",))
+POOL_CHECKOUT_SECONDS = registry.histogram("db_pool_checkout_seconds", "Время получения соединения из пула")
+
+# Функция crud, от имени которой сейчас выполняются запросы (метка db_query_duration_seconds)
+sql_scope: ContextVar[str] = ContextVar("sql_scope", default="other")
+
+
+# Помечает запросы асинхронной функции её именем; вложенная помеченная функция перекрывает внешнюю
+def sql_timed(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = sql_scope.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            sql_scope.reset(token)
+
+    return wrapper
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    SQL_SECONDS.observe(time.perf_counter() - conn.info["query_started"].pop(), sql_scope.get())
+
+
+# При ошибке запроса after_cursor_execute не вызывается - убираем его время начала
+def handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+# Пул соединений со статистикой выдачи: сколько запросов ждут соединение и сколько длится ожидание.
+# Счётчики живут в экземпляре пула, поэтому после engine.dispose() начинаются заново.
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+
+    def connect(self):
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        elapsed = time.perf_counter() - started
+        POOL_CHECKOUT_SECONDS.observe(elapsed)
+        self.checkouts += 1
+        self.checkout_time_total += elapsed
+        self.checkout_time_max = max(self.checkout_time_max, elapsed)
+        return connection
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.size(),
+            # overflow() отрицателен, пока открыто меньше pool_size соединений
+            "connections": self.size() + self.overflow(),
+            "overflow": max(self.overflow(), 0),
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "checkout_time_avg": self.checkout_time_total / self.checkouts if self.checkouts else None,
+            "checkout_time_max": self.checkout_time_max,
+        }
 
 
 class DatabaseHelper:
-    def __init__(self, url: str = settings.db_url, echo: bool = False):
+    def __init__(
+            self,
+            url: str = settings.db_url,
+            echo: bool = False,
+            pool_size: int = settings.db_pool_size,
+            max_overflow: int = settings.db_max_overflow,
+            pool_timeout: float = settings.db_pool_timeout,
+            pool_pre_ping: bool = settings.db_pool_pre_ping,
+            pool_recycle: int = settings.db_pool_recycle,
+            statement_cache_size: int = settings.db_statement_cache_size,
+    ):
+        connect_args = {
+            # Кэш SQLAlchemy над asyncpg и собственный кэш asyncpg
+            "prepared_statement_cache_size": statement_cache_size,
+            "statement_cache_size": statement_cache_size,
+        }
+        if not statement_cache_size:
+            # За пулером в режиме транзакций имена подготовленных запросов разных клиентов не должны совпадать
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
         self.engine = create_async_engine(
             url=url,
             echo=echo,
+            poolclass=InstrumentedPool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_pre_ping=pool_pre_ping,
+            pool_recycle=pool_recycle,
+            connect_args=connect_args,
         )
+        event.listen(self.engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(self.engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(self.engine.sync_engine, "handle_error", handle_error)
         self.session_factory = async_sessionmaker(
             bind=self.engine,
             autoflush=False,
@@ -28,5 +144,24 @@ class DatabaseHelper:
         async with self.session_factory() as session:
             yield session
 
+    def pool_stats(self) -> dict:
+        return self.engine.pool.stats()
+
+
+db_helper = DatabaseHelper(url=settings.db_url, echo=settings.echo)
+
+
+def collect_db_pool():
+    stats = db_helper.pool_stats()
+    return [
+        (f"db_pool_{name}", "gauge", description, [({}, stats[name])])
+        for name, description in (
+            ("connections", "Открытых соединений с БД"),
+            ("in_use", "Соединений, выданных запросам"),
+            ("idle", "Свободных соединений в пуле"),
+            ("waiting", "Запросов, ожидающих соединение"),
+        )
+    ] + [("db_pool_timeouts_total", "counter", "Таймаутов ожидания соединения", [({}, stats["timeouts"])])]
+
 
-db_helper = DatabaseHelper(url=settings.db_url, echo=True)
+registry.add_collector(collect_db_pool)
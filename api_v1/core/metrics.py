@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# Наблюдение - поиск бакета и два сложения под блокировкой; текст собирается только при GET /metrics,
+# а значения из чужих статистик (кэши, пулы) читаются коллекторами тоже только в этот момент.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Гистограмма с метками; значения меток передаются позиционно в порядке labelnames
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [счётчики по бакетам (последний - +Inf, не накопленные), сумма]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    # Забирает накопленное и обнуляет - так наблюдения процессов пула переносятся в основной процесс
+    def drain(self) -> dict:
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series: dict) -> None:
+        with self._lock:
+            for labelvalues, (counts, total) in series.items():
+                current = self._series.get(labelvalues)
+                if current is None:
+                    current = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in sorted(series):
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for le, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels({**labels, 'le': format_value(float(le))})} {cumulative}"
+            yield f"{self.name}_sum{format_labels(labels)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(labels)} {cumulative}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {format_value(self.value)}"
+
+
+# Коллектор возвращает [(имя, тип, описание, [(метки, значение), ...]), ...] и вызывается только при сборе
+Collector = Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Histogram | Gauge] = {}
+        self._collectors: list[Collector] = [self._collect_caches]
+        self._caches: dict[str, Callable[[], dict]] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    # Кэш со статистикой вида {"size", "hits", "misses", ...}; все кэши идут в одни семейства с меткой cache
+    def add_cache(self, name: str, stats: Callable[[], dict]) -> None:
+        self._caches[name] = stats
+
+    def cache_stats(self) -> dict[str, dict]:
+        return {name: get_stats() for name, get_stats in self._caches.items()}
+
+    def _collect_caches(self):
+        stats = self.cache_stats()
+        ratios = {name: s["hits"] / (s["hits"] + s["misses"]) for name, s in stats.items() if s["hits"] + s["misses"]}
+        return [
+            ("cache_hits_total", "counter", "Попадания в кэш",
+             [({"cache": name}, s["hits"]) for name, s in stats.items()]),
+            ("cache_misses_total", "counter", "Промахи кэша",
+             [({"cache": name}, s["misses"]) for name, s in stats.items()]),
+            ("cache_hit_ratio", "gauge", "Доля попаданий в кэш с момента старта",
+             [({"cache": name}, ratio) for name, ratio in ratios.items()]),
+            ("cache_entries", "gauge", "Записей в кэше",
+             [({"cache": name}, s["size"]) for name, s in stats.items()]),
+        ]
+
+    def drain(self) -> dict:
+        return {
+            name: series
+            for name, metric in self._metrics.items()
+            if isinstance(metric, Histogram) and (series := metric.drain())
+        }
+
+    def merge(self, drained: dict) -> None:
+        for name, series in drained.items():
+            self._metrics[name].merge(series)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# Выполняется в процессе пула: результат возвращается вместе с наблюдениями, накопленными в процессе,
+# и текущей статистикой его кэшей
+def call_with_metrics(fn, *args):
+    return fn(*args), registry.drain(), (os.getpid(), registry.cache_stats())
+
+
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                                          ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP-запросов в обработке")
+
+
+# ASGI-мидлвэр без BaseHTTPMiddleware: не буферизует тело и не создаёт лишних задач.
+# Метка route - шаблон пути маршрута (FastAPI кладёт маршрут в scope), поэтому id и даты не плодят серии.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"],
+                                         getattr(route, "path", "unmatched"), str(status))
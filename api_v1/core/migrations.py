@@ -0,0 +1,51 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from api_v1.core.config import settings
+from api_v1.core.models.Base import Base
+
+# create_all создаёт только отсутствующие таблицы, поэтому новые колонки и индексы
+# для уже существующих таблиц добавляются здесь идемпотентными DDL-командами
+MIGRATIONS = [
+    "ALTER TABLE energy ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64)",
+    "ALTER TABLE energy ADD COLUMN IF NOT EXISTS site_id VARCHAR(64) NOT NULL DEFAULT ''",
+    "ALTER TABLE energy ADD COLUMN IF NOT EXISTS device_id VARCHAR(64) NOT NULL DEFAULT ''",
+    # Postgres проверяет уникальный индекс секционированной таблицы раньше IF NOT EXISTS, поэтому через to_regclass;
+    # у секционированной energy в уникальный индекс входит ещё и created_at
+    """DO $$ BEGIN
+        IF to_regclass('ix_energy_device_idempotency_key') IS NULL THEN
+            IF (SELECT relkind FROM pg_class WHERE oid = 'energy'::regclass) = 'p' THEN
+                CREATE UNIQUE INDEX ix_energy_device_idempotency_key ON energy (device_id, idempotency_key, created_at);
+            ELSE
+                CREATE UNIQUE INDEX ix_energy_device_idempotency_key ON energy (device_id, idempotency_key);
+            END IF;
+        END IF;
+    END $$""",
+    "DROP INDEX IF EXISTS ix_energy_idempotency_key",
+    "CREATE INDEX IF NOT EXISTS ix_energy_created_at_type ON energy (created_at, type) INCLUDE (value)",
+    "CREATE INDEX IF NOT EXISTS ix_energy_device_created_at ON energy (device_id, created_at) INCLUDE (type, value)",
+    "CREATE INDEX IF NOT EXISTS ix_energy_site_created_at ON energy (site_id, created_at) INCLUDE (type, value)",
+    # Старые роллапы становятся общим срезом (site_id = device_id = '')
+    "ALTER TABLE energy_rollup ADD COLUMN IF NOT EXISTS site_id VARCHAR(64) NOT NULL DEFAULT ''",
+    "ALTER TABLE energy_rollup ADD COLUMN IF NOT EXISTS device_id VARCHAR(64) NOT NULL DEFAULT ''",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_energy_rollup_device_key "
+    "ON energy_rollup (device_id, granularity, bucket, type, site_id)",
+    "CREATE INDEX IF NOT EXISTS ix_energy_rollup_site ON energy_rollup (site_id, granularity, bucket) "
+    "INCLUDE (type, value) WHERE device_id = ''",
+    "DROP INDEX IF EXISTS ix_energy_rollup_granularity_bucket_type",
+]
+
+
+async def apply_migrations(conn: AsyncConnection) -> None:
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+
+
+# Схема целиком: секционированная energy (если включено), остальные таблицы и миграции
+async def create_schema(conn: AsyncConnection) -> None:
+    if settings.energy_partitioning:
+        from api_v1.energy.partitions import create_partitioned_energy
+
+        await create_partitioned_energy(conn)
+    await conn.run_sync(Base.metadata.create_all)
+    await apply_migrations(conn)
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Integer, DateTime, func
+from sqlalchemy import Index, Integer, DateTime, String, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from api_v1.core.models.Base import Base
@@ -11,3 +11,20 @@ class Energy(Base):
     type: Mapped[int] = mapped_column(Integer, nullable=False)
     value: Mapped[int] = mapped_column(Integer, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    # Объект и счётчик показания, пустая строка - не указаны
+    site_id: Mapped[str] = mapped_column(String(64), nullable=False, default="", server_default="")
+    device_id: Mapped[str] = mapped_column(String(64), nullable=False, default="", server_default="")
+    # Ключ идемпотентности пакетной загрузки: повтор той же записи не создаёт дубликат
+    idempotency_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Ключи идемпотентности у каждого счётчика свои (seq у разных счётчиков совпадает)
+        Index("ix_energy_device_idempotency_key", "device_id", "idempotency_key", unique=True),
+        # Покрывающий индекс для отчётов по диапазону времени: index-only scan без чтения таблицы
+        Index("ix_energy_created_at_type", "created_at", "type", postgresql_include=["value"]),
+        # То же для отчётов одного счётчика или объекта: читаются только их строки
+        Index("ix_energy_device_created_at", "device_id", "created_at", postgresql_include=["type", "value"]),
+        Index("ix_energy_site_created_at", "site_id", "created_at", postgresql_include=["type", "value"]),
+    )
+    # created_at вычисляется в БД, забираем его через RETURNING вместо отдельного SELECT
+    __mapper_args__ = {"eager_defaults": True}
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Index, Integer, String, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from api_v1.core.models.Base import Base
+
+
+# Суммы показаний по часам/дням/месяцам, обновляются при каждой вставке в energy.
+# Каждое показание попадает в три среза: общий (site_id = device_id = ''), объекта (device_id = '')
+# и счётчика (device_id - счётчик, site_id - его объект)
+class EnergyRollup(Base):
+    __tablename__ = "energy_rollup"
+    granularity: Mapped[str] = mapped_column(String(8), nullable=False)
+    bucket: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    type: Mapped[int] = mapped_column(Integer, nullable=False)
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    site_id: Mapped[str] = mapped_column(String(64), nullable=False, default="", server_default="")
+    device_id: Mapped[str] = mapped_column(String(64), nullable=False, default="", server_default="")
+
+    __table_args__ = (
+        # Ключ upsert и поиск по счётчику
+        Index("ix_energy_rollup_device_key", "device_id", "granularity", "bucket", "type", "site_id", unique=True),
+        # Общий срез и срезы объектов
+        Index("ix_energy_rollup_site", "site_id", "granularity", "bucket", postgresql_include=["type", "value"],
+              postgresql_where=text("device_id = ''")),
+    )
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Awaitable
+
+
+# Состояние прогрева компонентов после старта процесса: приложение принимает запросы сразу,
+# а долгие шаги (обучение недостающих моделей, запуск процессов прогнозов) идут в фоне
+class Readiness:
+    def __init__(self):
+        self.started_at = time.time()
+        self._components: dict[str, dict] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, name: str, awaitable: Awaitable) -> asyncio.Task:
+        self._components[name] = {"status": "pending"}
+        task = asyncio.create_task(self._run(name, awaitable))
+        # Держим ссылку, иначе задачу может собрать сборщик мусора
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, name: str, awaitable: Awaitable) -> None:
+        started = time.perf_counter()
+        try:
+            await awaitable
+        except Exception as e:
+            self._components[name] = {"status": "failed", "error": repr(e)}
+        else:
+            self._components[name] = {"status": "ready"}
+        self._components[name]["seconds"] = round(time.perf_counter() - started, 3)
+
+    def mark_ready(self, name: str, seconds: float | None = None) -> None:
+        self._components[name] = {"status": "ready", "seconds": round(seconds, 3) if seconds is not None else None}
+
+    @property
+    def ready(self) -> bool:
+        return all(component["status"] == "ready" for component in self._components.values())
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime": round(time.time() - self.started_at, 3),
+            "components": {name: dict(component) for name, component in self._components.items()},
+        }
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+
+readiness = Readiness()
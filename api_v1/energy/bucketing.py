@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple
+
+from sqlalchemy import func, literal_column
+
+# Защита от отчётов на сотни тысяч периодов (например, 15min за несколько лет)
+MAX_BUCKETS = 50000
+
+
+class Granularity(NamedTuple):
+    name: str
+    label_format: str
+    # Выражение начала бакета в SQL: группировка по timestamp, а не по тексту
+    sql: Callable
+    floor: Callable[[datetime], datetime]
+    step: Callable[[datetime], datetime]
+    # Уровни роллапов, бакеты которых целиком лежат внутри одного бакета этой гранулярности
+    rollup_levels: tuple[str, ...]
+
+
+def _date_trunc(unit: str) -> Callable:
+    return lambda column: func.date_trunc(unit, column)
+
+
+def _date_bin(stride: str) -> Callable:
+    return lambda column: func.date_bin(
+        literal_column(f"interval '{stride}'"), column, literal_column("timestamp '2000-01-01'")
+    )
+
+
+def _floor_minutes(value: datetime, minutes: int) -> datetime:
+    return value.replace(minute=value.minute - value.minute % minutes, second=0, microsecond=0)
+
+
+def _floor_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(value: datetime) -> datetime:
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+GRANULARITIES: dict[str, Granularity] = {
+    granularity.name: granularity for granularity in (
+        Granularity(
+            name="15min",
+            label_format="%d.%m.%Y %H:%M",
+            sql=_date_bin("15 minutes"),
+            floor=lambda value: _floor_minutes(value, 15),
+            step=lambda bucket: bucket + timedelta(minutes=15),
+            rollup_levels=(),
+        ),
+        Granularity(
+            name="hour",
+            label_format="%d.%m.%Y %H:00",
+            sql=_date_trunc("hour"),
+            floor=lambda value: value.replace(minute=0, second=0, microsecond=0),
+            step=lambda bucket: bucket + timedelta(hours=1),
+            rollup_levels=("hour",),
+        ),
+        Granularity(
+            name="day",
+            label_format="%d.%m.%Y",
+            sql=_date_trunc("day"),
+            floor=_floor_day,
+            step=lambda bucket: bucket + timedelta(days=1),
+            rollup_levels=("day", "hour"),
+        ),
+        Granularity(
+            name="week",
+            label_format="%G-W%V",
+            sql=_date_trunc("week"),
+            floor=lambda value: _floor_day(value) - timedelta(days=value.weekday()),
+            step=lambda bucket: bucket + timedelta(days=7),
+            rollup_levels=("day", "hour"),
+        ),
+        Granularity(
+            name="month",
+            label_format="%m.%Y",
+            sql=_date_trunc("month"),
+            floor=lambda value: _floor_day(value).replace(day=1),
+            step=_next_month,
+            rollup_levels=("month", "day", "hour"),
+        ),
+        Granularity(
+            name="year",
+            label_format="%Y",
+            sql=_date_trunc("year"),
+            floor=lambda value: _floor_day(value).replace(month=1, day=1),
+            step=lambda bucket: bucket.replace(year=bucket.year + 1),
+            rollup_levels=("month", "day", "hour"),
+        ),
+    )
+}
+
+
+def get_granularity(group_by: str) -> Granularity:
+    granularity = GRANULARITIES.get(group_by)
+    if granularity is None:
+        raise ValueError("Некорректное значение group_by")
+    return granularity
+
+
+def ceil(value: datetime, granularity: Granularity) -> datetime:
+    bucket = granularity.floor(value)
+    return bucket if bucket == value else granularity.step(bucket)
+
+
+# Бакеты, пересекающиеся с [start, end] (обе границы включены): (начало бакета, начало следующего)
+def iter_buckets(start: datetime, end: datetime, granularity: Granularity):
+    bucket = granularity.floor(start)
+    count = 0
+    while bucket <= end:
+        count += 1
+        if count > MAX_BUCKETS:
+            raise ValueError(f"Слишком много периодов, максимум {MAX_BUCKETS}")
+        next_bucket = granularity.step(bucket)
+        yield bucket, next_bucket
+        bucket = next_bucket
+
+
+def label(bucket: datetime, granularity: Granularity) -> str:
+    return bucket.strftime(granularity.label_format)
@@ -0,0 +1,82 @@
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from api_v1.core.config import settings
+from api_v1.energy.model_registry import model_registry
+
+
+class City(NamedTuple):
+    longitude: float
+    latitude: float
+    name: str
+
+
+def to_unit_vectors(longitudes, latitudes) -> np.ndarray:
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+# Неизменяемый каталог городов с поиском ближайшего по расстоянию на сфере.
+# Точки хранятся единичными векторами: ближайший по дуге большого круга город - это город
+# с максимальным скалярным произведением, поэтому долгота через ±180° и сжатие градуса
+# долготы к полюсам учитываются автоматически.
+class CityIndex:
+    def __init__(self, cities: Iterable):
+        self.cities: tuple[City, ...] = tuple(City(*city) for city in cities)
+        self.by_name: dict[str, City] = {city.name: city for city in self.cities}
+        points = to_unit_vectors([c.longitude for c in self.cities], [c.latitude for c in self.cities])
+        points.setflags(write=False)
+        self._points = points
+        self._nearest_index = lru_cache(maxsize=4096)(self._nearest_index)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def _nearest_index(self, longitude: float, latitude: float) -> int:
+        return int(np.argmax(self._points @ to_unit_vectors(longitude, latitude)))
+
+    def nearest(self, longitude: float, latitude: float) -> City | None:
+        if not self.cities:
+            return None
+        return self.cities[self._nearest_index(float(longitude), float(latitude))]
+
+    def nearest_many(self, coordinates: Iterable[tuple[float, float]]) -> list[City]:
+        coordinates = np.asarray(list(coordinates), dtype=np.float64).reshape(-1, 2)
+        if not self.cities or not len(coordinates):
+            return []
+        indexes = np.argmax(to_unit_vectors(coordinates[:, 0], coordinates[:, 1]) @ self._points.T, axis=1)
+        return [self.cities[i] for i in indexes]
+
+    def distance_km(self, city: City, longitude: float, latitude: float) -> float:
+        cos_angle = float(np.clip(to_unit_vectors(city.longitude, city.latitude) @ to_unit_vectors(longitude, latitude),
+                                  -1.0, 1.0))
+        return float(np.degrees(np.arccos(cos_angle)) * 111.195)
+
+    def cache_info(self):
+        return self._nearest_index.cache_info()
+
+
+# Каталог из настроек плюс города из реестра моделей (версия из реестра задаёт координаты)
+def build_city_index() -> CityIndex:
+    cities = {city[2]: City(*city) for city in settings.cities}
+    for entry in model_registry.entries():
+        cities[entry.city] = City(entry.longitude, entry.latitude, entry.city)
+    return CityIndex(cities.values())
+
+
+_current: tuple[int, CityIndex] | None = None
+
+
+# Индекс пересобирается, только когда изменился реестр; замена - одно присваивание ссылки
+def current_city_index() -> CityIndex:
+    global _current
+    generation = model_registry.refresh()
+    current = _current
+    if current is None or current[0] != generation:
+        current = (generation, build_city_index())
+        _current = current
+    return current[1]
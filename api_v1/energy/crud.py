@@ -1,34 +1,231 @@
-import calendar
+import asyncio
+import base64
+import json
+import os
 import pickle
-from datetime import datetime, timedelta
-from sqlalchemy import func
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from api_v1.core.DbHelper import sql_timed
 from api_v1.core.config import settings
+from api_v1.core.metrics import registry
 from api_v1.core.models.Energy import Energy
-from api_v1.energy.schemas import EnergyResponse
-import prophet
-import pandas as pd
+from api_v1.energy import bucketing, partitions, rollups
+from api_v1.energy.cities import City, current_city_index
+from api_v1.energy.forecast_pool import forecast_pool
+from api_v1.energy.forecast_store import open_forecast_store
+from api_v1.energy.live_totals import live_totals
+from api_v1.energy.model_cache import ModelCache, merge_stats
+from api_v1.energy.model_registry import ModelEntry, file_checksum, model_registry
+from api_v1.energy.prophet_params import ProphetParams, get_params_filename, load_prophet_params
+from api_v1.energy.report_cache import report_cache
+from api_v1.energy.schemas import CreateEnergyBatchItem, EnergyResponse
+from api_v1.energy.training_jobs import training_jobs
 
 
 # 1 - потрачено, 2 - получено 3 -в сеть 4 - из сети
 
+@sql_timed
 async def create_energy(session: AsyncSession, energy_data) -> Energy:
-    energy = Energy(**energy_data.dict())
+    energy = Energy(**{**energy_data.dict(), "site_id": energy_data.site_id or "",
+                       "device_id": energy_data.device_id or ""})
     session.add(energy)
+    await session.flush()
+    await rollups.apply_rollups(session, [
+        (energy.type, energy.value, energy.created_at, energy.site_id, energy.device_id)
+    ])
     await session.commit()
-    await session.refresh(energy)
+    report_cache.invalidate(energy.created_at, energy.created_at)
+    live_totals.add([(energy.type, energy.value, energy.site_id, energy.device_id)])
     return energy
 
 
-async def get_energy_list(session: AsyncSession) -> list:
-    query = select(Energy)
+# Не больше 6 параметров на строку, лимит asyncpg - 32767 параметров на запрос
+BATCH_INSERT_CHUNK = 5000
+
+
+@sql_timed
+async def create_energy_batch(session: AsyncSession, items: list[CreateEnergyBatchItem]) -> dict:
+    cutoff = partitions.retention_cutoff()
+    if cutoff is not None:
+        # Такое показание ушло бы в архив при ближайшем обслуживании вместе с ключом идемпотентности,
+        # и повтор пакета записал бы его в роллапы второй раз
+        for i, item in enumerate(items):
+            if item.created_at is not None and item.created_at < cutoff:
+                raise ValueError(f"items[{i}]: показание старше срока хранения ({cutoff:%Y-%m-%d})")
+    statuses: list[dict] = [{"index": i, "status": "created"} for i in range(len(items))]
+    rows = []
+    row_indexes = []
+    seen_keys = set()
+    for i, item in enumerate(items):
+        key = item.key
+        device_id = item.device_id or ""
+        if key is not None:
+            # Повтор внутри одного пакета; ключи у каждого счётчика свои
+            if (device_id, key) in seen_keys:
+                statuses[i]["status"] = "duplicate"
+                continue
+            seen_keys.add((device_id, key))
+        rows.append({
+            "type": item.type,
+            "value": item.value,
+            "created_at": item.created_at if item.created_at is not None else func.now(),
+            "idempotency_key": key,
+            "site_id": item.site_id or "",
+            "device_id": device_id,
+        })
+        row_indexes.append(i)
+
+    if settings.energy_partitioning and seen_keys:
+        # В секционированной таблице ключ уникален только вместе с created_at: повтор с другим временем
+        # (или без него - тогда время ставит база) ON CONFLICT не поймает, поэтому ключи проверяются заранее
+        existing = set((await session.execute(
+            select(Energy.device_id, Energy.idempotency_key).where(
+                tuple_(Energy.device_id, Energy.idempotency_key).in_(seen_keys)
+            )
+        )).tuples())
+        kept = []
+        for row, i in zip(rows, row_indexes):
+            if (row["device_id"], row["idempotency_key"]) in existing:
+                statuses[i]["status"] = "duplicate"
+            else:
+                kept.append((row, i))
+        rows, row_indexes = [row for row, _ in kept], [i for _, i in kept]
+    conflict_target = [Energy.device_id, Energy.idempotency_key]
+    if settings.energy_partitioning:
+        conflict_target.append(Energy.created_at)
+    if rows:
+        # id выдаётся заранее из последовательности таблицы: порядок строк RETURNING не гарантирован,
+        # и записанные строки сопоставляются с элементами пакета по id, а не по позиции
+        ids = (await session.scalars(
+            select(func.nextval(func.pg_get_serial_sequence(Energy.__tablename__, "id")))
+            .select_from(func.generate_series(1, len(rows)))
+        )).all()
+        for row, energy_id in zip(rows, ids):
+            row["id"] = energy_id
+
+    written_from = written_to = None
+    written = []
+    for chunk_start in range(0, len(rows), BATCH_INSERT_CHUNK):
+        chunk = rows[chunk_start:chunk_start + BATCH_INSERT_CHUNK]
+        chunk_indexes = row_indexes[chunk_start:chunk_start + BATCH_INSERT_CHUNK]
+        query = pg_insert(Energy).values(chunk).on_conflict_do_nothing(
+            index_elements=conflict_target
+        ).returning(Energy.id, Energy.idempotency_key, Energy.type, Energy.value, Energy.created_at,
+                    Energy.site_id, Energy.device_id)
+        result = await session.execute(query)
+        inserted = result.all()
+        await rollups.apply_rollups(session, [
+            (row.type, row.value, row.created_at, row.site_id, row.device_id) for row in inserted
+        ])
+        written.extend((row.type, row.value, row.site_id, row.device_id) for row in inserted)
+        for row in inserted:
+            if written_from is None or row.created_at < written_from:
+                written_from = row.created_at
+            if written_to is None or row.created_at > written_to:
+                written_to = row.created_at
+        # Строки без ключа вставляются всегда; строка с ключом, не вернувшаяся из RETURNING, - повтор
+        inserted_ids = {row.id for row in inserted}
+        for row, i in zip(chunk, chunk_indexes):
+            if row["id"] in inserted_ids:
+                statuses[i]["id"] = row["id"]
+            else:
+                statuses[i]["status"] = "duplicate"
+    await session.commit()
+    if written_from is not None:
+        report_cache.invalidate(written_from, written_to)
+    live_totals.add(written)
+
+    created = sum(1 for status in statuses if status["status"] == "created")
+    return {
+        "created": created,
+        "duplicates": len(statuses) - created,
+        "items": statuses,
+    }
+
+
+def encode_cursor(created_at: datetime, energy_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{energy_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, energy_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(energy_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Некорректный курсор")
+
+
+# Строки читаются кортежами Core в порядке (created_at, id), без ORM-объектов
+def energy_list_query(energy_type: int | None = None, start_date: datetime | None = None,
+                      end_date: datetime | None = None, cursor: str | None = None,
+                      scope: rollups.Scope = rollups.ALL):
+    query = select(Energy.id, Energy.type, Energy.value, Energy.created_at, Energy.site_id, Energy.device_id)
+    query = query.where(*scope.energy_conditions())
+    if energy_type is not None:
+        query = query.where(Energy.type == energy_type)
+    if start_date is not None:
+        query = query.where(Energy.created_at >= start_date)
+    if end_date is not None:
+        query = query.where(Energy.created_at <= end_date)
+    if cursor is not None:
+        after_created_at, after_id = decode_cursor(cursor)
+        # Отдельное условие по created_at нужно планировщику, чтобы отбросить секции раньше курсора
+        query = query.where(Energy.created_at >= after_created_at,
+                            tuple_(Energy.created_at, Energy.id) > tuple_(after_created_at, after_id))
+    return query.order_by(Energy.created_at, Energy.id)
+
+
+def energy_row_to_dict(row) -> dict:
+    energy_id, energy_type, value, created_at, site_id, device_id = row
+    return {
+        "id": energy_id,
+        "type": energy_type,
+        "value": float(value),
+        "created_at": created_at.strftime("%d.%m.%Y in %H.%M.%S"),
+        "site_id": site_id,
+        "device_id": device_id,
+    }
+
+
+@sql_timed
+async def get_energy_list(session: AsyncSession, limit: int, cursor: str | None = None,
+                          energy_type: int | None = None, start_date: datetime | None = None,
+                          end_date: datetime | None = None,
+                          scope: rollups.Scope = rollups.ALL) -> tuple[list, str | None]:
+    query = energy_list_query(energy_type, start_date, end_date, cursor, scope).limit(limit + 1)
     result = await session.execute(query)
-    energy_list = result.scalars().all()
-    return [EnergyResponse(**e.__dict__) for e in energy_list]
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [energy_row_to_dict(row) for row in rows], next_cursor
+
+
+# NDJSON через серверный курсор: в памяти одновременно не больше chunk_size строк.
+# Сессия открывается внутри генератора, потому что зависимость закрывает свою до отправки тела ответа
+async def stream_energy_list(session_factory, chunk_size: int = 5000, cursor: str | None = None,
+                             energy_type: int | None = None, start_date: datetime | None = None,
+                             end_date: datetime | None = None, scope: rollups.Scope = rollups.ALL):
+    query = energy_list_query(energy_type, start_date, end_date, cursor, scope).execution_options(
+        yield_per=chunk_size
+    )
+    async with session_factory() as session:
+        result = await session.stream(query)
+        async for rows in result.partitions(chunk_size):
+            yield "".join(json.dumps(energy_row_to_dict(row)) + "\n" for row in rows).encode()
 
 
+@sql_timed
 async def get_energy(session: AsyncSession, energy_id: int) -> EnergyResponse | None:
     query = select(Energy).where(Energy.id == energy_id)
     result = await session.execute(query)
@@ -40,13 +237,37 @@ async def get_energy(session: AsyncSession, energy_id: int) -> EnergyResponse |
     return None
 
 
-async def report(session: AsyncSession):
-    query = select(
-        func.sum(Energy.value).filter(Energy.type == 1),
-        func.sum(Energy.value).filter(Energy.type == 2)
-    )
+async def fetch_type_sums(session: AsyncSession, query) -> tuple[int, int]:
+    if query is None:
+        return 0, 0
     result = await session.execute(query)
-    sum_type_1, sum_type_2 = result.fetchone()
+    sums = {energy_type: int(value) for energy_type, value in result.all()}
+    return sums.get(1, 0), sums.get(2, 0)
+
+
+async def fetch_period_sums(session: AsyncSession, query) -> dict:
+    periods = {}
+    if query is None:
+        return periods
+    result = await session.execute(query)
+    for period, energy_type, value in result.all():
+        sums = periods.setdefault(period, [0, 0])
+        if energy_type in (1, 2):
+            sums[energy_type - 1] += int(value)
+    return {
+        period: {
+            "1": consumption,
+            "2": production,
+            "3": max(consumption - production, 0),
+            "4": max(production - consumption, 0),
+        }
+        for period, (consumption, production) in periods.items()
+    }
+
+
+@sql_timed
+async def report(session: AsyncSession, scope: rollups.Scope = rollups.ALL):
+    sum_type_1, sum_type_2 = await fetch_type_sums(session, rollups.total_sums_query(scope))
 
     return {
         "1": sum_type_1,
@@ -56,16 +277,13 @@ async def report(session: AsyncSession):
     }
 
 
-async def get_report_by_range(session: AsyncSession, start_date: datetime, end_date: datetime):
-    query = select(
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 1), 0),
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 2), 0)
-    ).where(Energy.created_at.between(start_date, end_date))
+@sql_timed
+async def get_report_by_range(session: AsyncSession, start_date: datetime, end_date: datetime,
+                              scope: rollups.Scope = rollups.ALL):
+    query = rollups.range_sums_query(start_date, rollups.inclusive_end(end_date), scope)
     session.expire_all()
 
-    result = await session.execute(query)
-
-    sum_type_1, sum_type_2 = result.one()
+    sum_type_1, sum_type_2 = await fetch_type_sums(session, query)
 
     return {
         "1": sum_type_1,
@@ -75,100 +293,291 @@ async def get_report_by_range(session: AsyncSession, start_date: datetime, end_d
     }
 
 
-async def get_report_by_date(session: AsyncSession, start_date: datetime, end_date: datetime, group_by: str):
-    if group_by == "day":
-        date_format_sql = "DD.MM.YYYY"
-        date_format_py = "%d.%m.%Y"
-        period_step = timedelta(days=1)
-    elif group_by == "month":
-        date_format_sql = "MM.YYYY"
-        date_format_py = "%m.%Y"
-        period_step = timedelta(days=31)  # Берём 31 день, чтобы двигаться по месяцам
-    elif group_by == "year":
-        date_format_sql = "YYYY"
-        date_format_py = "%Y"
-        period_step = timedelta(days=365)
-    else:
-        raise ValueError("Некорректное значение group_by")
-
-    group_by_expr = func.to_char(Energy.created_at, date_format_sql)
-
-    query = select(
-        group_by_expr.label("period"),
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 1), 0).label("consumption"),
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 2), 0).label("production"),
-    ).where(
-        Energy.created_at.between(start_date, end_date)
-    ).group_by(
-        group_by_expr
-    ).order_by(
-        group_by_expr
-    )
-
-    result = await session.execute(query)
+@sql_timed
+async def get_report_by_date(session: AsyncSession, start_date: datetime, end_date: datetime, group_by: str,
+                             scope: rollups.Scope = rollups.ALL):
+    granularity = bucketing.get_granularity(group_by)
+    query = rollups.grouped_sums_query(start_date, rollups.inclusive_end(end_date), granularity, scope)
+    existing_periods = await fetch_period_sums(session, query)
 
-    existing_periods = {
-        period: {
-            "1": consumption,
-            "2": production,
-            "3": max(consumption - production, 0),
-            "4": max(production - consumption, 0),
-        }
-        for period, consumption, production in result.all()
+    # Заполняем отсутствующие периоды нулями, подписи периодов формируются только здесь
+    report = {
+        bucketing.label(bucket, granularity): existing_periods.get(bucket, {"1": 0, "2": 0, "3": 0, "4": 0})
+        for bucket, _ in bucketing.iter_buckets(start_date, end_date, granularity)
     }
 
-    def generate_periods(start_date, end_date, period_step, date_format_py):
-        periods = []
-        current_date = start_date.replace(day=1) if group_by == "month" else start_date
-        while current_date <= end_date:
-            period = current_date.strftime(date_format_py)
-            periods.append(period)
-            if group_by == "month":
-                next_month = current_date.month % 12 + 1
-                next_year = current_date.year + (1 if next_month == 1 else 0)
-                current_date = current_date.replace(year=next_year, month=next_month, day=1)
-            elif group_by == "year":
-                current_date = current_date.replace(year=current_date.year + 1, month=1, day=1)
-            else:
-                current_date += period_step
-        return periods
+    return report
 
-    all_periods = generate_periods(start_date, end_date, period_step, date_format_py)
 
-    # Заполняем отсутствующие периоды нулями
-    report = {
-        period: existing_periods.get(period, {"1": 0, "2": 0, "3": 0, "4": 0})
-        for period in all_periods
-    }
+@sql_timed
+async def rebuild_rollups(session: AsyncSession) -> None:
+    await rollups.rebuild_rollups(await session.connection())
+    await session.commit()
 
-    return report
 
+def get_nearest_city(longitude: float, latitude: float) -> City | None:
+    return current_city_index().nearest(longitude, latitude)
 
-# мб города из енва получать, хотя так пизже выглядит
-def get_nearest_city(longitude: float, latitude: float, cities_list: list = settings.cities):
-    best = None
-    best_diff = float('inf')
-    for city in cities_list:
-        city_lon, city_lat, city_name = city
-        diff = abs(city_lat - latitude) + abs(city_lon - longitude)
-        if diff < best_diff:
-            best_diff = diff
-            best = (city_lon, city_lat, city_name)
-    return best
 
+def get_nearest_cities(coordinates: list[tuple[float, float]]) -> list[City]:
+    return current_city_index().nearest_many(coordinates)
 
-def get_model(longitude, latitude):
+
+# Модель города не загружается (файл, контрольная сумма, пустой каталог городов) - ошибка сервера, не запроса
+class ModelLoadError(RuntimeError):
+    pass
+
+
+model_cache = ModelCache(max_size=settings.model_cache_size)
+
+
+# При FORECAST_WORKERS > 0 модели загружаются только в процессах пула, их статистика приходит с результатами
+def model_cache_stats() -> dict:
+    if forecast_pool.uses_processes:
+        return merge_stats(forecast_pool.worker_cache_stats("model"))
+    return model_cache.stats()
+
+
+registry.add_cache("model", model_cache_stats)
+
+# Наблюдения из процессов пула прогнозов переносятся в основной процесс вместе с результатом
+MODEL_LOAD_SECONDS = registry.histogram("model_load_duration_seconds", "Время загрузки модели города", ("city",))
+FORECAST_SECONDS = registry.histogram("forecast_duration_seconds", "Время вычисления прогноза города",
+                                      ("city", "kind"))
+PREDICT_PHASE_SECONDS = registry.histogram("predict_phase_duration_seconds",
+                                           "Время фаз прогнозного отчёта (db - прошлое, forecast - прогноз)",
+                                           ("phase",))
+
+
+# Модель есть, если лежит pickle Prophet или выгруженные параметры (в образе без Prophet - только они)
+def model_exists(model_filename: str) -> bool:
+    return os.path.exists(model_filename) or os.path.exists(get_params_filename(model_filename))
+
+
+# Текущая версия модели города из реестра (None - исходные файлы) и имя её pickle
+def resolve_model(city_lon, city_lat, city_name) -> tuple[ModelEntry | None, str]:
+    entry = model_registry.get(city_name)
+    if entry is not None:
+        return entry, model_registry.model_filename(entry)
+    filename = f'api_v1/energy/ml_models/{round(city_lon, 2)}-{round(city_lat, 2)}-{city_name}_prophet_model.pkl'
+    # Часть моделей обучалась до округления координат в имени файла
+    legacy_filename = f'api_v1/energy/ml_models/{city_lon}-{city_lat}-{city_name}_prophet_model.pkl'
+    if not model_exists(filename) and model_exists(legacy_filename):
+        return None, legacy_filename
+    return None, filename
+
+
+def get_model_filename(city_lon, city_lat, city_name) -> str:
+    return resolve_model(city_lon, city_lat, city_name)[1]
+
+
+# Загружает ProphetParams, если параметры выгружены (ml_training.ExportParams), иначе pickle Prophet.
+# Версии кэшируются под своими ключами: запрос, начатый до переключения, дорабатывает на старой модели.
+def load_city_model(city_info):
+    city_lon, city_lat, city_name = city_info
+    entry, model_filename = resolve_model(city_lon, city_lat, city_name)
+
+    @MODEL_LOAD_SECONDS.time(city_name)
+    def loader():
+        params_filename = get_params_filename(model_filename)
+        filename, kind = (params_filename, "params") if os.path.exists(params_filename) else (model_filename, "model")
+        try:
+            if entry is not None and kind in entry.checksums and file_checksum(filename) != entry.checksums[kind]:
+                raise ModelLoadError(f"контрольная сумма {filename} не совпадает с реестром")
+            if kind == "params":
+                return load_prophet_params(filename)
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            raise ModelLoadError(f"Ошибка загрузки модели для города {city_name}: {e}")
+
+    key = city_name if entry is None else f"{city_name}@v{entry.version}"
+    return model_cache.get(key, loader)
+
+
+def require_nearest_city(longitude: float, latitude: float) -> City:
     city_info = get_nearest_city(longitude, latitude)
     if city_info is None:
-        raise ValueError("Не удалось определить ближайший город.")
-    city_lon, city_lat, city_name = city_info
-    model_filename = f'api_v1/energy/ml_models/{round(city_lon, 2)}-{round(city_lat, 2)}-{city_name}_prophet_model.pkl'
+        raise ModelLoadError("Не удалось определить ближайший город.")
+    return city_info
+
+
+def get_model(longitude, latitude):
+    return load_city_model(require_nearest_city(longitude, latitude))
+
+
+# Выполняется в процессе пула прогнозов
+def predict_days(city_info, days: np.ndarray) -> np.ndarray:
+    model = load_city_model(city_info)
+    with FORECAST_SECONDS.time(city_info.name, "yhat"):
+        return predict_model_days(model, days)
+
+
+def predict_model_days(model, days: np.ndarray) -> np.ndarray:
+    if isinstance(model, ProphetParams):
+        return model.predict(days)
+    import pandas as pd
+
+    # Отчёты суммируют только yhat: без сэмплирования интервалов predict в разы быстрее
+    uncertainty_samples = model.uncertainty_samples
+    model.uncertainty_samples = 0
     try:
-        with open(model_filename, 'rb') as f:
-            model = pickle.load(f)
-    except Exception as e:
-        raise ValueError(f"Ошибка загрузки модели для города {city_name}: {e}")
-    return model
+        forecast = model.predict(pd.DataFrame({'ds': pd.DatetimeIndex(days)}))
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+    return forecast['yhat'].to_numpy()
+
+
+# Выполняется в процессе пула прогнозов. Сэмплы yhat (дни x n_samples) для интервалов
+def sample_days(city_info, days: np.ndarray, n_samples: int, seed: int) -> np.ndarray:
+    model = load_city_model(city_info)
+    with FORECAST_SECONDS.time(city_info.name, "samples"):
+        return sample_model_days(model, days, n_samples, seed)
+
+
+def sample_model_days(model, days: np.ndarray, n_samples: int, seed: int) -> np.ndarray:
+    if isinstance(model, ProphetParams):
+        return model.sample(days, n_samples, np.random.default_rng(seed)).astype(np.float32)
+    import pandas as pd
+
+    np.random.seed(seed)
+    uncertainty_samples = model.uncertainty_samples
+    model.uncertainty_samples = n_samples
+    try:
+        samples = model.predictive_samples(pd.DataFrame({'ds': pd.DatetimeIndex(days)}))['yhat']
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+    return samples.astype(np.float32)
+
+
+band_cache = ModelCache(max_size=settings.forecast_band_cache_size)
+registry.add_cache("forecast_band", band_cache.stats)
+
+
+# Сэмплы считаются один раз на город и диапазон; seed зависит только от них, поэтому интервалы
+# в повторных ответах совпадают
+async def forecast_samples(city_info, start_date: date, end_date: date) -> np.ndarray:
+    n_samples = settings.forecast_band_samples
+    key = (city_info.name, model_registry.version(city_info.name), start_date.isoformat(), end_date.isoformat(),
+           n_samples)
+    seed = zlib.crc32("|".join(map(str, key)).encode())
+    return await band_cache.get_async(key, lambda: forecast_pool.run(
+        sample_days, city_info, days_range(start_date, end_date), n_samples, seed
+    ))
+
+
+# Нижняя и верхняя границы интервала по сэмплам сумм (строки - периоды, столбцы - сэмплы)
+def band_bounds(sums: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    width = settings.forecast_interval_width
+    lower, upper = np.percentile(sums, [100 * (1 - width) / 2, 100 * (1 + width) / 2], axis=1)
+    return lower, upper
+
+
+# Дневной yhat города за [start_date, end_date]: берётся из материализованного прогноза,
+# Prophet вызывается только для дней за пределами его горизонта
+async def forecast_daily(city_info, start_date: date, end_date: date) -> np.ndarray:
+    n_days = (end_date - start_date).days + 1
+    if n_days <= 0:
+        return np.zeros(0)
+    yhat = np.full(n_days, np.nan)
+    store = open_forecast_store(get_model_filename(*city_info))
+    if store is not None:
+        offset, values = store.slice(start_date, n_days)
+        yhat[offset:offset + len(values)] = values
+    missing = np.isnan(yhat)
+    if missing.any():
+        days = days_range(start_date, end_date)[missing]
+        yhat[missing] = await forecast_pool.run(predict_days, city_info, days)
+    return yhat
+
+
+def days_range(start_date: date, end_date: date) -> np.ndarray:
+    return np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1)
+
+
+def consumption_by_day(days: np.ndarray, average_consumption_by_months: dict) -> np.ndarray:
+    by_month = np.array([average_consumption_by_months.get(month, 500) for month in range(1, 13)])
+    return by_month[days.astype('datetime64[M]').astype(int) % 12]
+
+
+# Суммы значений по полуинтервалам [starts[i], ends[i]); для матрицы сэмплов - по каждому столбцу
+def period_sums(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    cumulative = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0, dtype=np.float64)))
+    return cumulative[ends] - cumulative[starts]
+
+
+def preload_models(city_names: list[str]) -> list[str]:
+    loaded = []
+    for city in current_city_index().cities:
+        if city.name in city_names:
+            try:
+                load_city_model(city)
+            except ModelLoadError as e:
+                print(e)
+                continue
+            loaded.append(city.name)
+    return loaded
+
+
+# Ставит в фоновое обучение города каталога, для которых ещё нет модели (например, ADDITIONAL_CITY),
+# и ждёт их; новые версии попадают в реестр моделей
+async def train_missing_models() -> list[str]:
+    jobs = [
+        training_jobs.submit(city.longitude, city.latitude, city.name)
+        for city in current_city_index().cities
+        if not model_exists(get_model_filename(*city))
+    ]
+    results = [await training_jobs.wait(job["id"]) for job in jobs]
+    failed = [job for job in results if job["status"] != "done"]
+    if failed:
+        raise RuntimeError("; ".join(f"{job['city']}: {job['error']}" for job in failed))
+    return [job["city"] for job in results]
+
+
+# Города каталога с текущими версиями моделей
+def list_models() -> list[dict]:
+    models = []
+    for city in current_city_index().cities:
+        entry, model_filename = resolve_model(*city)
+        models.append({
+            "city": city.name,
+            "longitude": city.longitude,
+            "latitude": city.latitude,
+            "version": entry.version if entry is not None else 0,
+            "trained_at": entry.trained_at if entry is not None else None,
+            "checksums": entry.checksums if entry is not None else {},
+            "model": model_filename,
+            "available": model_exists(model_filename),
+        })
+    return models
+
+
+def init_forecast_worker(city_names: list[str]) -> None:
+    preload_models(city_names)
+
+
+forecast_pool.configure(init_forecast_worker, (settings.preload_cities,))
+
+
+# Замеряет длительность фазы в миллисекундах; фазы прогноза идут параллельно, поэтому их время не складывается
+async def timed(timings: dict | None, phase: str, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        elapsed = time.perf_counter() - started
+        PREDICT_PHASE_SECONDS.observe(elapsed, phase)
+        if timings is not None:
+            timings[phase] = elapsed * 1000
+
+
+# Прошедшая часть прогноза за диапазон: суммы по типам за [start_date, past_end_date]
+@sql_timed
+async def past_range_sums(session: AsyncSession, start_date: datetime, past_end_date: datetime,
+                          scope: rollups.Scope = rollups.ALL) -> tuple[int, int]:
+    query = rollups.range_sums_query(start_date, rollups.inclusive_end(past_end_date), scope)
+    session.expire_all()
+    return await fetch_type_sums(session, query)
 
 
 async def predict_report_by_range(
@@ -178,7 +587,12 @@ async def predict_report_by_range(
         solar_coefficient: float,
         average_consumption_by_months: dict,
         longitude: float,
-        latitude: float
+        latitude: float,
+        timings: dict | None = None,
+        intervals: bool = False,
+        scope: rollups.Scope = rollups.ALL,
+        daily=forecast_daily,
+        sampler=forecast_samples
 ) -> dict:
     now_date = datetime.now().date()
 
@@ -186,108 +600,60 @@ async def predict_report_by_range(
     past_end_date = min(end_date, datetime.combine(now_date, datetime.min.time()))
     future_start_date = max(start_date, datetime.combine(now_date + timedelta(days=1), datetime.min.time()))
 
-    query = select(
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 1), 0),
-        func.coalesce(func.sum(Energy.value).filter(Energy.type == 2), 0)
-    ).where(
-        Energy.created_at.between(start_date, past_end_date)
+    async def future_sums():
+        # Если будущих дат нет
+        if future_start_date > end_date:
+            return 0, 0, (0, 0)
+        city_info = require_nearest_city(longitude, latitude)
+        yhat = await daily(city_info, future_start_date.date(), end_date.date())
+        future_days = days_range(future_start_date.date(), end_date.date())
+        band = None
+        if intervals:
+            samples = await sampler(city_info, future_start_date.date(), end_date.date())
+            lower, upper = band_bounds(samples.sum(axis=0, dtype=np.float64)[None, :] * solar_coefficient)
+            band = (lower[0], upper[0])
+        return (yhat.sum() * solar_coefficient,
+                int(consumption_by_day(future_days, average_consumption_by_months).sum()),
+                band)
+
+    # Агрегат из БД и прогноз в пуле не зависят друг от друга
+    (past_consumption, past_production), (future_consumption, future_production, band) = await asyncio.gather(
+        timed(timings, "db", past_range_sums(session, start_date, past_end_date, scope)),
+        timed(timings, "forecast", future_sums()),
     )
-    session.expire_all()
-    result = await session.execute(query)
-    past_consumption, past_production = result.one()
-
-    future_consumption = 0
-    future_production = 0
-
-    # Если есть будущие даты
-    if future_start_date <= end_date:
-        future_days = []
-        current = future_start_date
-        while current <= end_date:
-            future_days.append(current)
-            current += timedelta(days=1)
-
-        model = get_model(longitude=longitude, latitude=latitude)
-
-        future_df = pd.DataFrame({'ds': future_days})
-        forecast_future = model.predict(future_df)
-        future_consumption = forecast_future['yhat'].sum() * solar_coefficient
-        future_production = sum(average_consumption_by_months.get(day.month, 500) for day in future_days)
 
     total_consumption = int(past_consumption + future_consumption)
     total_production = int(past_production + future_production)
 
-    return {
+    result = {
         "1": total_consumption,
         "2": total_production,
         "3": max(int(total_consumption - total_production), 0),
         "4": max(int(total_production - total_consumption), 0),
     }
+    if intervals:
+        # Прогноз солнечной выработки в этом отчёте попадает в ключ "1"
+        result["bands"] = {"1": {"lower": int(past_consumption + band[0]), "upper": int(past_consumption + band[1])}}
+    return result
 
 
 def generate_period_ranges(start_date: datetime, end_date: datetime, group_by: str):
+    granularity = bucketing.get_granularity(group_by)
     ranges = []
-    if group_by == "day":
-        current = start_date.date()
-        while current <= end_date.date():
-            period_start = datetime.combine(current, datetime.min.time())
-            period_end = datetime.combine(current, datetime.max.time())
-            # Корректируем границы, если они выходят за запрошенный диапазон
-            if period_start < start_date:
-                period_start = start_date
-            if period_end > end_date:
-                period_end = end_date
-            label = current.strftime("%d.%m.%Y")
-            ranges.append((label, period_start, period_end))
-            current += timedelta(days=1)
-    elif group_by == "month":
-        current = start_date.replace(day=1)
-        while current <= end_date:
-            year = current.year
-            month = current.month
-            last_day = calendar.monthrange(year, month)[1]
-            full_start = current
-            full_end = current.replace(day=last_day, hour=23, minute=59, second=59)
-            period_start = full_start if full_start >= start_date else start_date
-            period_end = full_end if full_end <= end_date else end_date
-            label = current.strftime("%m.%Y")
-            ranges.append((label, period_start, period_end))
-            if month == 12:
-                current = current.replace(year=year + 1, month=1, day=1)
-            else:
-                current = current.replace(month=month + 1, day=1)
-    elif group_by == "year":
-        # Начинаем с 1 января запрашиваемого года
-        current = start_date.replace(month=1, day=1)
-        while current <= end_date:
-            year = current.year
-            full_start = current
-            full_end = current.replace(month=12, day=31, hour=23, minute=59, second=59)
-            period_start = full_start if full_start >= start_date else start_date
-            period_end = full_end if full_end <= end_date else end_date
-            label = current.strftime("%Y")
-            ranges.append((label, period_start, period_end))
-            current = current.replace(year=year + 1, month=1, day=1)
-    else:
-        raise ValueError("Некорректное значение group_by")
+    for bucket, next_bucket in bucketing.iter_buckets(start_date, end_date, granularity):
+        # Корректируем границы, если они выходят за запрошенный диапазон
+        period_start = max(bucket, start_date)
+        period_end = min(next_bucket - timedelta(microseconds=1), end_date)
+        ranges.append((bucketing.label(bucket, granularity), period_start, period_end))
     return ranges
 
 
-async def predict_report_by_date(
-        session: AsyncSession,
-        start_date: datetime,
-        end_date: datetime,
-        group_by: str,
-        solar_coefficient: float,
-        average_consumption_by_months: dict,
-        longitude: float,
-        latitude: float
-) -> dict:
-    now_date = datetime.now().date()
+PREDICT_GROUP_BY = ("day", "week", "month", "year")
 
-    period_ranges = generate_period_ranges(start_date, end_date, group_by)
 
-    # Разбиваем периоды на прошедшие и будущие (или смешанные)
+# Делит периоды на прошедшую часть (по сегодняшний день включительно) и будущую;
+# период, содержащий сегодняшний день, попадает в обе части со своими границами
+def split_period_ranges(period_ranges, now_date: date):
     past_periods = []
     future_periods = []
     for label, p_start, p_end in period_ranges:
@@ -296,64 +662,88 @@ async def predict_report_by_date(
         elif p_start.date() > now_date:
             future_periods.append((label, p_start, p_end))
         else:
-            # Если период пересекается с текущей датой:
             past_periods.append((label, p_start, datetime.combine(now_date, datetime.max.time())))
             future_periods.append((label, datetime.combine(now_date + timedelta(days=1), datetime.min.time()), p_end))
+    return past_periods, future_periods
+
+
+@sql_timed
+async def past_period_sums(session: AsyncSession, past_periods, group_by: str,
+                           scope: rollups.Scope = rollups.ALL) -> dict:
+    if not past_periods:
+        return {}
+    granularity = bucketing.get_granularity(group_by)
+    query = rollups.grouped_sums_query(past_periods[0][1], rollups.inclusive_end(past_periods[-1][2]), granularity,
+                                       scope)
+    return {
+        bucketing.label(bucket, granularity): sums
+        for bucket, sums in (await fetch_period_sums(session, query)).items()
+    }
 
-    past_data = {}
-    if past_periods:
-        past_start = min(p[1] for p in past_periods)
-        past_end = max(p[2] for p in past_periods)
-
-        if group_by == "day":
-            date_format_sql = "DD.MM.YYYY"
-        elif group_by == "month":
-            date_format_sql = "MM.YYYY"
-        elif group_by == "year":
-            date_format_sql = "YYYY"
-        # Для группировки одно и то же выражение:
-        expr = func.to_char(Energy.created_at, date_format_sql)
-        query = select(
-            expr.label("period"),
-            func.coalesce(func.sum(Energy.value).filter(Energy.type == 1), 0).label("consumption"),
-            func.coalesce(func.sum(Energy.value).filter(Energy.type == 2), 0).label("production"),
-        ).where(
-            Energy.created_at.between(past_start, past_end)
-        ).group_by(
-            expr
-        ).order_by(
-            expr
-        )
-        result = await session.execute(query)
-        past_data = {
-            period: {
-                "1": consumption,
-                "2": production,
-                "3": max(consumption - production, 0),
-                "4": max(production - consumption, 0)
-            }
-            for period, consumption, production in result.all()
-        }
+
+async def future_period_sums(future_periods, solar_coefficient: float, average_consumption_by_months: dict,
+                             longitude: float, latitude: float, intervals: bool = False,
+                             daily=forecast_daily, sampler=forecast_samples) -> dict:
+    if not future_periods:
+        return {}
+    # Один прогноз на весь будущий отрезок, дальше суммы по периодам через префиксные суммы
+    first_day = future_periods[0][1].date()
+    last_day = future_periods[-1][2].date()
+    city_info = require_nearest_city(longitude, latitude)
+    yhat = await daily(city_info, first_day, last_day)
+    consumption = consumption_by_day(days_range(first_day, last_day), average_consumption_by_months)
+
+    starts = np.array([(p_start.date() - first_day).days for _, p_start, _ in future_periods])
+    ends = np.maximum(np.array([(p_end.date() - first_day).days + 1 for _, _, p_end in future_periods]), starts)
+    production_sums = period_sums(yhat, starts, ends) * solar_coefficient
+    consumption_sums = period_sums(consumption, starts, ends)
+    if intervals:
+        samples = await sampler(city_info, first_day, last_day)
+        lower, upper = band_bounds(period_sums(samples, starts, ends) * solar_coefficient)
 
     future_data = {}
-    if future_periods:
-        model = get_model(longitude, latitude)
-        for label, p_start, p_end in future_periods:
-            future_days = pd.date_range(start=p_start, end=p_end, freq='D')
-            if len(future_days) == 0:
-                future_production = 0
-                future_consumption = 0
-            else:
-                future_df = pd.DataFrame({'ds': future_days})
-                forecast = model.predict(future_df)
-                future_production = forecast['yhat'].sum() * solar_coefficient
-                future_consumption = sum(average_consumption_by_months.get(day.month, 500) for day in future_days)
-            future_data[label] = {
-                "1": future_consumption,
-                "2": int(future_production),
-                "3": max(future_consumption - int(future_production), 0),
-                "4": max(int(future_production) - future_consumption, 0)
-            }
+    for (label, _, _), future_production, future_consumption in zip(future_periods, production_sums,
+                                                                     consumption_sums):
+        future_consumption = int(future_consumption)
+        future_data[label] = {
+            "1": future_consumption,
+            "2": int(future_production),
+            "3": max(future_consumption - int(future_production), 0),
+            "4": max(int(future_production) - future_consumption, 0)
+        }
+    if intervals:
+        for (label, _, _), period_lower, period_upper in zip(future_periods, lower, upper):
+            future_data[label]["bands"] = {"2": {"lower": int(period_lower), "upper": int(period_upper)}}
+    return future_data
+
+
+async def predict_report_by_date(
+        session: AsyncSession,
+        start_date: datetime,
+        end_date: datetime,
+        group_by: str,
+        solar_coefficient: float,
+        average_consumption_by_months: dict,
+        longitude: float,
+        latitude: float,
+        timings: dict | None = None,
+        intervals: bool = False,
+        scope: rollups.Scope = rollups.ALL,
+        daily=forecast_daily,
+        sampler=forecast_samples
+) -> dict:
+    if group_by not in PREDICT_GROUP_BY:
+        raise ValueError("Прогноз строится по дням, group_by должен быть day, week, month или year")
+
+    period_ranges = generate_period_ranges(start_date, end_date, group_by)
+    past_periods, future_periods = split_period_ranges(period_ranges, datetime.now().date())
+
+    past_data, future_data = await asyncio.gather(
+        timed(timings, "db", past_period_sums(session, past_periods, group_by, scope)),
+        timed(timings, "forecast", future_period_sums(future_periods, solar_coefficient,
+                                                      average_consumption_by_months, longitude, latitude,
+                                                      intervals, daily, sampler)),
+    )
 
     result_dict = {}
     for label, _, _ in period_ranges:
@@ -374,8 +764,107 @@ async def predict_report_by_date(
             "3": max(consumption - production, 0),
             "4": max(production - consumption, 0)
         }
+        if intervals:
+            # У прошедшей части неопределённости нет, интервал сдвигается на её значение
+            past_production = past_data.get(label, {}).get("2", 0)
+            future_band = future_data.get(label, {}).get("bands", {}).get("2")
+            result_dict[label]["bands"] = {"2": {
+                "lower": past_production + future_band["lower"] if future_band else production,
+                "upper": past_production + future_band["upper"] if future_band else production,
+            }}
     return result_dict
 
+
+# Прогноз города за общий диапазон дней нескольких запросов; запросы получают из него срезы
+class CityForecast(NamedTuple):
+    first_day: date
+    yhat: np.ndarray
+    samples: np.ndarray | None
+
+    async def daily(self, city_info, start_date: date, end_date: date) -> np.ndarray:
+        offset = (start_date - self.first_day).days
+        return self.yhat[offset:offset + (end_date - start_date).days + 1]
+
+    async def sampler(self, city_info, start_date: date, end_date: date) -> np.ndarray:
+        offset = (start_date - self.first_day).days
+        return self.samples[offset:offset + (end_date - start_date).days + 1]
+
+
+async def city_forecast(city_info, first_day: date, last_day: date, intervals: bool) -> CityForecast:
+    yhat = await forecast_daily(city_info, first_day, last_day)
+    samples = await forecast_samples(city_info, first_day, last_day) if intervals else None
+    return CityForecast(first_day, yhat, samples)
+
+
+# Прогнозы городов пакета. Пул отклоняет задачи сверх FORECAST_WORKERS + FORECAST_QUEUE_SIZE, поэтому
+# одновременно идёт не больше прогнозов, чем у пула исполнителей; при ошибке остальные не запускаются
+async def city_forecasts(windows: dict) -> list[CityForecast]:
+    limit = asyncio.Semaphore(max(forecast_pool.workers, 1))
+
+    async def limited(city_info, window):
+        async with limit:
+            return await city_forecast(city_info, *window)
+
+    tasks = [asyncio.create_task(limited(city_info, window)) for city_info, window in windows.items()]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+# Пакет прогнозов: запросы группируются по ближайшему городу, на город - один прогноз за объединение
+# будущих дней его запросов, дальше каждый запрос считается на срезах этого прогноза.
+# items - (start_date, end_date, group_by, longitude, latitude, intervals, scope)
+async def predict_report_batch(
+        session: AsyncSession,
+        items: list,
+        solar_coefficient: float,
+        average_consumption_by_months: dict,
+        timings: dict | None = None
+) -> list[dict]:
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    windows = {}
+    cities = []
+    for start_date, end_date, group_by, longitude, latitude, intervals, scope in items:
+        city_info = require_nearest_city(longitude, latitude)
+        cities.append(city_info)
+        first_day = max(start_date.date(), tomorrow)
+        if first_day > end_date.date():
+            continue
+        window = windows.get(city_info)
+        if window is None:
+            windows[city_info] = [first_day, end_date.date(), intervals]
+        else:
+            window[0] = min(window[0], first_day)
+            window[1] = max(window[1], end_date.date())
+            window[2] = window[2] or intervals
+
+    forecasts = dict(zip(windows, await timed(timings, "forecast", city_forecasts(windows))))
+
+    results = []
+    started = time.perf_counter()
+    for (start_date, end_date, group_by, longitude, latitude, intervals, scope), city_info in zip(items, cities):
+        forecast = forecasts.get(city_info)
+        forecast_args = {"daily": forecast.daily, "sampler": forecast.sampler} if forecast is not None else {}
+        if group_by is None:
+            result = await predict_report_by_range(session=session, start_date=start_date, end_date=end_date,
+                                                   solar_coefficient=solar_coefficient,
+                                                   average_consumption_by_months=average_consumption_by_months,
+                                                   longitude=longitude, latitude=latitude, intervals=intervals,
+                                                   scope=scope, **forecast_args)
+        else:
+            result = await predict_report_by_date(session=session, start_date=start_date, end_date=end_date,
+                                                  group_by=group_by, solar_coefficient=solar_coefficient,
+                                                  average_consumption_by_months=average_consumption_by_months,
+                                                  longitude=longitude, latitude=latitude, intervals=intervals,
+                                                  scope=scope, **forecast_args)
+        results.append(result)
+    if timings is not None:
+        timings["db"] = (time.perf_counter() - started) * 1000
+    return results
+
 # if __name__ == "__main__":
 #     future_start_date = "2025-01-01"
 #     end_date = "2026-01-01"
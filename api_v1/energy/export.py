@@ -0,0 +1,144 @@
+import csv
+import io
+from datetime import datetime
+
+from api_v1.energy import bucketing, crud, rollups
+
+# pyarrow нужен только для Parquet и Arrow, CSV выгружается без него
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+RAW_COLUMNS = ("id", "type", "value", "created_at", "site_id", "device_id")
+BUCKET_COLUMNS = ("bucket", "type", "value")
+
+
+def arrow_schema(bucket: str | None):
+    if bucket is None:
+        return pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("type", pyarrow.int16()),
+            ("value", pyarrow.int64()),
+            ("created_at", pyarrow.timestamp("us")),
+            ("site_id", pyarrow.string()),
+            ("device_id", pyarrow.string()),
+        ])
+    return pyarrow.schema([
+        ("bucket", pyarrow.timestamp("us")),
+        ("type", pyarrow.int16()),
+        ("value", pyarrow.int64()),
+    ])
+
+
+def check_format(export_format: str) -> None:
+    if export_format != "csv" and pyarrow is None:
+        raise ValueError(f"Формат {export_format} недоступен: не установлен pyarrow")
+
+
+# Сырые показания в порядке (created_at, id) или суммы по бакетам гранулярности и типам в порядке (bucket, type)
+def export_query(start_date: datetime | None, end_date: datetime | None, energy_type: int | None,
+                 bucket: str | None, scope: rollups.Scope):
+    if bucket is None:
+        return crud.energy_list_query(energy_type, start_date, end_date, scope=scope)
+    granularity = bucketing.get_granularity(bucket)
+    if start_date is None or end_date is None:
+        raise ValueError("Для выгрузки по бакетам нужны start_date и end_date")
+    query = rollups.grouped_sums_query(start_date, rollups.inclusive_end(end_date), granularity, scope)
+    if query is None:
+        return None
+    sums = query.subquery()
+    query = sums.select()
+    if energy_type is not None:
+        query = query.where(sums.c.type == energy_type)
+    return query.order_by(sums.c.period, sums.c.type)
+
+
+# Буфер, который ParquetWriter и писатель Arrow IPC заполняют между выдачами очередного куска
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def csv_chunk(rows, header: tuple[str, ...] | None = None) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header is not None:
+        writer.writerow(header)
+    # Время в ISO 8601, чтобы pandas.read_csv(parse_dates=...) читал его без формата
+    writer.writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+    )
+    return buffer.getvalue().encode()
+
+
+def record_batch(rows, schema):
+    columns = list(zip(*rows))
+    return pyarrow.record_batch(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+# Выгрузка через серверный курсор: в памяти одновременно один кусок из chunk_size строк,
+# в Parquet каждый кусок - отдельная группа строк
+async def stream_export(session_factory, query, export_format: str, bucket: str | None = None,
+                        chunk_size: int = 50000):
+    header = RAW_COLUMNS if bucket is None else BUCKET_COLUMNS
+    if export_format == "csv":
+        yield csv_chunk([], header)
+    else:
+        schema = arrow_schema(bucket)
+        sink = ChunkSink()
+        if export_format == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        else:
+            writer = pyarrow.ipc.new_stream(sink, schema)
+    if query is not None:
+        async with session_factory() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for rows in result.partitions(chunk_size):
+                if export_format == "csv":
+                    yield csv_chunk(rows)
+                    continue
+                writer.write_batch(record_batch(rows, schema))
+                yield sink.drain()
+    if export_format != "csv":
+        writer.close()
+        yield sink.drain()
+
+
+def export_filename(export_format: str, start_date: datetime | None, end_date: datetime | None,
+                    bucket: str | None) -> str:
+    parts = ["energy"]
+    if bucket is not None:
+        parts.append(bucket)
+    if start_date is not None:
+        parts.append(start_date.strftime("%Y-%m-%d"))
+    if end_date is not None:
+        parts.append(end_date.strftime("%Y-%m-%d"))
+    return "_".join(parts) + "." + FORMATS[export_format][1]
@@ -0,0 +1,158 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from api_v1.core.config import settings
+from api_v1.core.metrics import call_with_metrics, registry
+
+
+class ForecastOverloadedError(RuntimeError):
+    pass
+
+
+class ForecastTimeoutError(RuntimeError):
+    pass
+
+
+# Пул процессов для Prophet: прогноз не блокирует event loop, в каждом процессе свой кэш моделей.
+# Очередь ограничена: если задач больше чем workers + queue_size, запрос сразу получает отказ.
+class ForecastPool:
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor: Executor | None = None
+        self._initializer = None
+        self._initargs: tuple = ()
+        self._warm_up: list[Future] = []
+        self._lock = threading.Lock()
+        # pid процесса пула -> статистика его кэшей на момент последнего ответа
+        self._worker_caches: dict[int, dict] = {}
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    # Прогнозы считаются в процессах пула этого процесса; в самих процессах пула пул не запущен
+    @property
+    def uses_processes(self) -> bool:
+        return self.workers > 0 and self._executor is not None
+
+    @property
+    def capacity(self) -> int:
+        return max(self.workers, 1) + self.queue_size
+
+    # Initializer задаётся заранее, чтобы его выполнили и процессы, запущенные лениво первым прогнозом
+    # (вне lifespan или до него), иначе они остались бы без предзагрузки моделей
+    def configure(self, initializer, initargs=()) -> None:
+        self._initializer = initializer
+        self._initargs = initargs
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        if self.workers > 0:
+            # spawn, а не fork: в родителе уже работают event loop и потоки драйвера БД
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self._initializer,
+                initargs=self._initargs,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1, initializer=self._initializer,
+                                                initargs=self._initargs)
+        # Поднимаем исполнителей сразу, чтобы первый прогноз не ждал импорт Prophet и загрузку моделей
+        self._warm_up = [self._submit(_noop) for _ in range(max(self.workers, 1))]
+
+    # Ждёт, пока все процессы запустятся и выполнят initializer
+    async def wait_warm(self) -> None:
+        for result in await asyncio.gather(*(asyncio.wrap_future(future) for future in self._warm_up)):
+            self._unwrap(result)
+
+    def _submit(self, fn, *args) -> Future:
+        if self.workers > 0:
+            return self._executor.submit(call_with_metrics, fn, *args)
+        return self._executor.submit(fn, *args)
+
+    # Процесс пула возвращает вместе с результатом свои наблюдения метрик и статистику кэшей
+    def _unwrap(self, result):
+        if self.workers == 0:
+            return result
+        result, observations, (pid, caches) = result
+        registry.merge(observations)
+        with self._lock:
+            self._worker_caches[pid] = caches
+        return result
+
+    # Статистика кэша name в каждом процессе пула (без процессов - пустой список)
+    def worker_cache_stats(self, name: str) -> list[dict]:
+        with self._lock:
+            return [caches[name] for _, caches in sorted(self._worker_caches.items()) if name in caches]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args):
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise ForecastOverloadedError("Сервис прогнозов перегружен, повторите запрос позже")
+            self._in_flight += 1
+        # Слот освобождается, когда задача реально завершилась в процессе, а не когда истёк таймаут
+        future = self._submit(fn, *args)
+        future.add_done_callback(self._release)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise ForecastTimeoutError(f"Прогноз не уложился в {self.timeout} с")
+        return self._unwrap(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+def _noop():
+    return None
+
+
+forecast_pool = ForecastPool(
+    workers=settings.forecast_workers,
+    queue_size=settings.forecast_queue_size,
+    timeout=settings.forecast_timeout,
+)
+
+
+def collect_forecast_pool():
+    stats = forecast_pool.stats()
+    return [
+        ("forecast_pool_in_flight", "gauge", "Прогнозов в работе и в очереди", [({}, stats["in_flight"])]),
+        ("forecast_pool_capacity", "gauge", "Предел прогнозов в работе и в очереди", [({}, stats["capacity"])]),
+        ("forecast_pool_rejected_total", "counter", "Прогнозов, отклонённых из-за перегрузки",
+         [({}, stats["rejected"])]),
+        ("forecast_pool_timed_out_total", "counter", "Прогнозов, не уложившихся в таймаут",
+         [({}, stats["timed_out"])]),
+    ]
+
+
+registry.add_collector(collect_forecast_pool)
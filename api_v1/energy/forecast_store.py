@@ -0,0 +1,80 @@
+import os
+import threading
+from datetime import date
+
+import numpy as np
+
+# Дневной прогноз города: непрерывный ряд дат и значений yhat
+FORECAST_DTYPE = np.dtype([("ds", "datetime64[D]"), ("yhat", "<f4")])
+
+
+def get_forecast_filename(model_filename: str) -> str:
+    return model_filename.removesuffix("_prophet_model.pkl") + "_forecast.npy"
+
+
+def write_forecast_store(filename: str, days, yhat) -> str:
+    data = np.empty(len(days), dtype=FORECAST_DTYPE)
+    data["ds"] = np.asarray(days, dtype="datetime64[D]")
+    data["yhat"] = np.asarray(yhat, dtype=np.float32)
+    if len(data) > 1 and np.any(np.diff(data["ds"]) != np.timedelta64(1, "D")):
+        raise ValueError("Прогноз должен идти по дням без пропусков")
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+class ForecastStore:
+    def __init__(self, filename: str, signature: tuple = ()):
+        self.filename = filename
+        # (inode, mtime, размер) открытого файла: os.replace при перематериализации меняет их
+        self.signature = signature
+        data = np.load(filename, mmap_mode="r")
+        self.yhat = data["yhat"]
+        self.first_day = data["ds"][0] if len(data) else None
+
+    def __len__(self):
+        return len(self.yhat)
+
+    # Возвращает (смещение в запрошенном диапазоне, значения) для пересечения с горизонтом
+    def slice(self, start: date, n_days: int) -> tuple[int, np.ndarray]:
+        if self.first_day is None:
+            return 0, self.yhat[:0]
+        offset = int((np.datetime64(start, "D") - self.first_day).astype(int))
+        lo = max(0, -offset)
+        hi = min(n_days, len(self.yhat) - offset)
+        if lo >= hi:
+            return 0, self.yhat[:0]
+        return lo, self.yhat[offset + lo:offset + hi]
+
+
+_stores: dict[str, ForecastStore] = {}
+_stores_lock = threading.Lock()
+
+
+def file_signature(filename: str) -> tuple | None:
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# Файл проверяется при каждом обращении (один stat): после ml_training.Materialize или TrainAll
+# процессы API и пула прогнозов открывают новый прогноз без перезапуска
+def open_forecast_store(model_filename: str) -> ForecastStore | None:
+    filename = get_forecast_filename(model_filename)
+    signature = file_signature(filename)
+    store = _stores.get(filename)
+    if store is not None and store.signature == signature:
+        return store
+    with _stores_lock:
+        if signature is None:
+            _stores.pop(filename, None)
+            return None
+        store = _stores.get(filename)
+        if store is None or store.signature != signature:
+            store = ForecastStore(filename, signature)
+            _stores[filename] = store
+    return store
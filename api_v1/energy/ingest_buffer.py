@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import IO
+
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.core.config import settings
+from api_v1.core.metrics import registry
+from api_v1.energy import crud
+from api_v1.energy.schemas import CreateEnergy, CreateEnergyBatchItem
+
+
+# Показания, которые база отвергает сами по себе, откладываются сюда (не *.jsonl - повтор их не подберёт)
+DEAD_LETTER_FILENAME = "dead_letter.ndjson"
+
+
+class IngestOverloadedError(RuntimeError):
+    pass
+
+
+# Ошибка самих показаний (значение вне диапазона колонки, срок хранения), а не недоступность БД:
+# повтор того же пакета не поможет. Ошибки соединения приходят как OSError/asyncpg или с connection_invalidated
+def is_permanent(error: Exception) -> bool:
+    if isinstance(error, ValueError):
+        return True
+    return (isinstance(error, DBAPIError) and not error.connection_invalidated
+            and not isinstance(error, (OperationalError, InterfaceError)))
+
+
+# Сегмент журнала: файл держится открытым под flock, пока его показания не записаны в БД,
+# поэтому соседний воркер не подберёт при старте чужой живой сегмент
+class Segment:
+    def __init__(self, path: str, file: IO):
+        self.path = path
+        self.file = file
+
+    def close(self, remove: bool) -> None:
+        if remove:
+            os.unlink(self.path)
+        self.file.close()
+
+
+# Отложенная запись одиночных показаний (INGEST_BUFFER=true): показание дописывается в локальный журнал,
+# запрос сразу получает 202, а в Postgres показания уходят пакетом по размеру или по времени.
+# Каждое показание получает время приёма и ключ идемпотентности, поэтому повтор журнала после падения
+# не создаёт дубликатов, даже если пакет успел записаться до удаления сегмента.
+class IngestBuffer:
+    def __init__(self, directory: str, flush_size: int, flush_interval: float, max_pending: int, fsync: bool):
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+        # Показания текущего сегмента и запечатанных, ещё не записанных в БД
+        self._items: list[CreateEnergyBatchItem] = []
+        self._segment: Segment | None = None
+        self._sealed_items: list[CreateEnergyBatchItem] = []
+        self._sealed_segments: list[Segment] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sync: asyncio.Future | None = None
+        self._flush_lock = asyncio.Lock()
+        self.accepted = 0
+        self.replayed = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._items) + len(self._sealed_items)
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._replay()
+        self._segment = self._open_segment()
+        self._task = asyncio.create_task(self._run())
+        if self._sealed_items:
+            self._wakeup.set()
+
+    # Остаток дописывается в БД при остановке; если БД недоступна, он останется в журнале до следующего старта
+    async def stop(self) -> None:
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        try:
+            await self.flush()
+        except Exception as e:
+            print(e)
+        for segment in self._sealed_segments:
+            segment.close(remove=False)
+        if self._segment is not None:
+            self._segment.close(remove=not self._items)
+            self._segment = None
+
+    async def append(self, energy_data: CreateEnergy) -> CreateEnergyBatchItem:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise IngestOverloadedError("База не успевает принимать показания, повторите запрос позже")
+        # Время приёма в UTC; валидатор схемы приводит его к naive UTC, как в колонке и у пакетной записи
+        item = CreateEnergyBatchItem(
+            **energy_data.model_dump(),
+            created_at=datetime.now(timezone.utc),
+            idempotency_key=f"wb:{uuid.uuid4().hex}",
+        )
+        file = self._segment.file
+        file.write(item.model_dump_json(exclude_none=True) + "\n")
+        file.flush()
+        self._items.append(item)
+        self.accepted += 1
+        if len(self._items) >= self.flush_size:
+            self._wakeup.set()
+        if self.fsync:
+            await self._group_fsync()
+        return item
+
+    # Один fsync на все показания, дописанные за время предыдущего: подтверждение ждёт записи на диск
+    async def _group_fsync(self) -> None:
+        if self._sync is None:
+            self._sync = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._fsync(self._sync, self._segment.file))
+        await asyncio.shield(self._sync)
+
+    async def _fsync(self, future: asyncio.Future, file: IO) -> None:
+        await asyncio.sleep(0)
+        self._sync = None
+        try:
+            # Сегмент, закрытый при запечатывании, уже сброшен на диск
+            if not file.closed:
+                await asyncio.to_thread(os.fsync, file.fileno())
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+
+    def _open_segment(self) -> Segment:
+        path = os.path.join(self.directory, f"{time.time_ns()}-{os.getpid()}.jsonl")
+        file = open(path, "a", encoding="utf-8")
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return Segment(path, file)
+
+    # Подбирает сегменты, оставшиеся от остановленных процессов (сегменты живых процессов заняты flock)
+    def _replay(self) -> None:
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.directory, name)
+            file = open(path, "r+", encoding="utf-8")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            items = []
+            for line in file:
+                try:
+                    items.append(CreateEnergyBatchItem.model_validate_json(line))
+                except ValidationError as e:
+                    # Строка, недописанная при падении, или показание, которое теперь не проходит проверку
+                    print(f"Пропущена повреждённая строка журнала {path}")
+                    self._dead_letter(line.rstrip("\n"), e)
+            if not items:
+                Segment(path, file).close(remove=True)
+                continue
+            self._sealed_items.extend(items)
+            self._sealed_segments.append(Segment(path, file))
+        self.replayed += len(self._sealed_items)
+
+    # Запечатывает текущий сегмент и пишет все накопленные показания одним пакетом
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if self._items:
+                segment = self._segment
+                segment.file.flush()
+                if self.fsync:
+                    os.fsync(segment.file.fileno())
+                self._sealed_items.extend(self._items)
+                self._sealed_segments.append(segment)
+                self._items = []
+                self._segment = self._open_segment() if self._task is not None else None
+            if not self._sealed_items:
+                return
+            started = time.perf_counter()
+            dead_lettered = self.dead_lettered
+            await self._write(self._sealed_items)
+            self.last_flush_seconds = time.perf_counter() - started
+            self.flushed += len(self._sealed_items) - (self.dead_lettered - dead_lettered)
+            self.flushes += 1
+            for segment in self._sealed_segments:
+                segment.close(remove=True)
+            self._sealed_items = []
+            self._sealed_segments = []
+
+    # Если пакет отвергает сама база, он делится пополам, пока отвергнутые показания не останутся по одному:
+    # они уходят в dead_letter.ndjson, остальные записываются (повтор записанных половин гасят ключи
+    # идемпотентности). Ошибки доступа к БД пробрасываются, и весь пакет повторяется позже
+    async def _write(self, items: list[CreateEnergyBatchItem]) -> None:
+        try:
+            async with db_helper.session_factory() as session:
+                await crud.create_energy_batch(session, items)
+        except Exception as e:
+            if not is_permanent(e):
+                raise
+            if len(items) == 1:
+                self._dead_letter(items[0].model_dump_json(exclude_none=True), e)
+                return
+            middle = len(items) // 2
+            await self._write(items[:middle])
+            await self._write(items[middle:])
+
+    def _dead_letter(self, line: str, error: Exception) -> None:
+        record = {"line": line, "error": str(error).splitlines()[0] if str(error) else repr(error),
+                  "at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+        with open(os.path.join(self.directory, DEAD_LETTER_FILENAME), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.dead_lettered += 1
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                failures = 0
+            except Exception as e:
+                # Показания остаются в журнале и в памяти, повтор с растущей паузой; пока БД недоступна,
+                # очередь растёт до INGEST_MAX_PENDING, дальше приём отвечает 503
+                self.failures += 1
+                failures += 1
+                print(e)
+                await asyncio.sleep(min(self.flush_interval * 2 ** failures, 30.0))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "segments": len(self._sealed_segments) + (self._segment is not None),
+            "accepted": self.accepted,
+            "replayed": self.replayed,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+
+ingest_buffer = IngestBuffer(
+    directory=settings.ingest_buffer_dir,
+    flush_size=settings.ingest_flush_size,
+    flush_interval=settings.ingest_flush_interval,
+    max_pending=settings.ingest_max_pending,
+    fsync=settings.ingest_fsync,
+)
+
+
+def collect_ingest_buffer():
+    stats = ingest_buffer.stats()
+    return [
+        ("ingest_buffer_pending", "gauge", "Принятых показаний, ещё не записанных в БД", [({}, stats["pending"])]),
+        ("ingest_buffer_flushed_total", "counter", "Показаний, записанных в БД из буфера", [({}, stats["flushed"])]),
+        ("ingest_buffer_rejected_total", "counter", "Показаний, отклонённых из-за переполнения буфера",
+         [({}, stats["rejected"])]),
+        ("ingest_buffer_flush_failures_total", "counter", "Неудачных записей буфера в БД", [({}, stats["failures"])]),
+        ("ingest_buffer_dead_lettered_total", "counter", "Показаний, отвергнутых БД и отложенных в dead_letter.ndjson",
+         [({}, stats["dead_lettered"])]),
+    ]
+
+
+registry.add_collector(collect_ingest_buffer)
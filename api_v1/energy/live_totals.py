@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.core.config import settings
+from api_v1.core.metrics import registry
+from api_v1.energy import rollups
+
+# Комментарий SSE, чтобы прокси не закрывали молчащее соединение
+HEARTBEAT = 15.0
+
+
+class ScopeTotals:
+    def __init__(self):
+        self.sums = [0, 0]
+        # Показания, записанные во время сверки с БД: прибавляются к её результату
+        self.delta = [0, 0]
+        self.seeding = False
+        self.seeded = asyncio.Event()
+        self.error: Exception | None = None
+        self.subscribers = 0
+        self.version = 0
+        self.message = b""
+
+    def render(self) -> None:
+        consumption, production = self.sums
+        self.version += 1
+        payload = json.dumps({
+            "1": consumption,
+            "2": production,
+            "3": max(consumption - production, 0),
+            "4": max(production - consumption, 0),
+        }, separators=(",", ":"))
+        self.message = f"id: {self.version}\nevent: totals\ndata: {payload}\n\n".encode()
+
+
+# Итоги /report/ для подписчиков SSE. Счётчики среза заводятся при первой подписке (одна сумма месячных
+# роллапов), дальше к ним прибавляется каждая запись показаний. Раз в LIVE_TOTALS_INTERVAL секунд
+# изменившиеся срезы сериализуются один раз и будят всех подписчиков, медленный подписчик получает
+# только последнее значение. Записи других воркеров видны после сверки раз в LIVE_TOTALS_RESYNC секунд;
+# она же исправляет показание, закоммиченное в момент загрузки итогов и учтённое дважды.
+class LiveTotals:
+    def __init__(self, interval: float, resync_interval: float):
+        self.interval = interval
+        self.resync_interval = resync_interval
+        self._scopes: dict[rollups.Scope, ScopeTotals] = {}
+        self._dirty: set[rollups.Scope] = set()
+        self._tick = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.broadcasts = 0
+
+    # rows - (type, value, site_id, device_id) записанных показаний, вызывается после commit
+    def add(self, rows) -> None:
+        if not self._scopes:
+            return
+        for energy_type, value, site_id, device_id in rows:
+            if energy_type not in (1, 2):
+                continue
+            for scope in rollups.row_scopes(site_id, device_id):
+                state = self._scopes.get(scope)
+                if state is None:
+                    continue
+                (state.delta if state.seeding else state.sums)[energy_type - 1] += value
+                self._dirty.add(scope)
+
+    # Загружает итоги среза из БД; True, если они отличаются от счётчиков
+    async def _seed(self, scope: rollups.Scope, state: ScopeTotals) -> bool:
+        state.seeding = True
+        state.delta = [0, 0]
+        try:
+            async with db_helper.session_factory() as session:
+                result = await session.execute(rollups.total_sums_query(scope))
+                sums = {energy_type: int(value) for energy_type, value in result.all()}
+            sums = [sums.get(1, 0) + state.delta[0], sums.get(2, 0) + state.delta[1]]
+        finally:
+            state.seeding = False
+            state.delta = [0, 0]
+        changed, state.sums = sums != state.sums, sums
+        return changed
+
+    async def subscribe(self, scope: rollups.Scope):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        state = self._scopes.get(scope)
+        if state is None:
+            state = self._scopes[scope] = ScopeTotals()
+            first = True
+        else:
+            first = False
+        state.subscribers += 1
+        try:
+            if first:
+                try:
+                    await self._seed(scope, state)
+                    state.render()
+                    state.seeded.set()
+                except Exception as e:
+                    # Подписчики, ждущие этот срез, получат ту же ошибку
+                    state.error = e
+                    state.seeded.set()
+                    raise
+            await state.seeded.wait()
+            if state.error is not None:
+                raise state.error
+            version = state.version
+            yield state.message
+            while True:
+                # Версия сверяется перед каждым ожиданием: рассылка, прошедшая, пока подписчик стоял
+                # на yield, уже сменила _tick и второй раз его не разбудит
+                if state.version != version:
+                    version = state.version
+                    yield state.message
+                    continue
+                tick = self._tick
+                try:
+                    await asyncio.wait_for(tick.wait(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            state.subscribers -= 1
+            if state.subscribers == 0 and self._scopes.get(scope) is state:
+                del self._scopes[scope]
+                self._dirty.discard(scope)
+
+    async def _run(self) -> None:
+        resynced_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.monotonic() - resynced_at >= self.resync_interval:
+                resynced_at = time.monotonic()
+                for scope, state in list(self._scopes.items()):
+                    if not state.seeded.is_set() or state.error is not None:
+                        continue
+                    try:
+                        if await self._seed(scope, state):
+                            self._dirty.add(scope)
+                    except Exception as e:
+                        print(e)
+            if not self._dirty:
+                continue
+            for scope in self._dirty:
+                state = self._scopes.get(scope)
+                if state is not None and state.seeded.is_set() and state.error is None:
+                    state.render()
+            self._dirty.clear()
+            tick, self._tick = self._tick, asyncio.Event()
+            tick.set()
+            self.broadcasts += 1
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "scopes": len(self._scopes),
+            "subscribers": sum(state.subscribers for state in self._scopes.values()),
+            "broadcasts": self.broadcasts,
+        }
+
+
+live_totals = LiveTotals(interval=settings.live_totals_interval, resync_interval=settings.live_totals_resync)
+
+
+def collect_live_totals():
+    stats = live_totals.stats()
+    return [
+        ("live_totals_subscribers", "gauge", "Подписчиков на итоги /report/live/", [({}, stats["subscribers"])]),
+        ("live_totals_broadcasts_total", "counter", "Рассылок изменившихся итогов", [({}, stats["broadcasts"])]),
+    ]
+
+
+registry.add_collector(collect_live_totals)
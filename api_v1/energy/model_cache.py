@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+# LRU-кэш загруженных моделей в памяти процесса, ключ - название города.
+# Тот же кэш хранит сэмплы интервалов прогноза (ключ - город и диапазон дат).
+class ModelCache:
+    def __init__(self, max_size: int):
+        self.max_size = max(max_size, 1)
+        self._models: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_time = 0.0
+
+    def _lookup(self, key: Hashable) -> Any:
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+            self.misses += 1
+            return None
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        model = self._lookup(key)
+        if model is not None:
+            return model
+
+        # Загружаем вне блокировки, чтобы не держать остальные города
+        started = time.perf_counter()
+        model = loader()
+        self._store(key, model, time.perf_counter() - started)
+        return model
+
+    async def get_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        model = self._lookup(key)
+        if model is not None:
+            return model
+        started = time.perf_counter()
+        model = await loader()
+        self._store(key, model, time.perf_counter() - started)
+        return model
+
+    def _store(self, key: Hashable, model: Any, elapsed: float) -> None:
+        with self._lock:
+            self.loads += 1
+            self.load_time += elapsed
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._models),
+                "max_size": self.max_size,
+                "cities": list(self._models),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "loads": self.loads,
+                "load_time_total": round(self.load_time, 4),
+                "load_time_avg": round(self.load_time / self.loads, 4) if self.loads else None,
+            }
+
+
+# Сумма статистик кэшей нескольких процессов; cities - объединение, per_process - исходные статистики
+def merge_stats(stats: list[dict]) -> dict:
+    hits = sum(s["hits"] for s in stats)
+    misses = sum(s["misses"] for s in stats)
+    loads = sum(s["loads"] for s in stats)
+    load_time = sum(s["load_time_total"] for s in stats)
+    return {
+        "size": sum(s["size"] for s in stats),
+        "max_size": sum(s["max_size"] for s in stats),
+        "cities": sorted({city for s in stats for city in s["cities"]}),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        "evictions": sum(s["evictions"] for s in stats),
+        "loads": loads,
+        "load_time_total": round(load_time, 4),
+        "load_time_avg": round(load_time / loads, 4) if loads else None,
+        "per_process": stats,
+    }
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+from api_v1.energy.forecast_store import get_forecast_filename
+from api_v1.energy.prophet_params import get_params_filename
+
+MODELS_DIR = 'api_v1/energy/ml_models'
+REGISTRY_FILENAME = 'registry.json'
+
+
+class ModelEntry(NamedTuple):
+    city: str
+    longitude: float
+    latitude: float
+    version: int
+    # sha256 файлов версии: model (pickle Prophet), params, forecast - те, что есть
+    checksums: dict
+    trained_at: str
+    # Имя pickle версии; params и forecast получаются из него заменой суффикса
+    model: str
+
+
+def file_checksum(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Реестр версий моделей: registry.json рядом с моделями, пишется атомарно.
+# Каждый процесс (и воркеры пула прогнозов) перечитывает его, когда файл изменился, поэтому
+# новая версия подхватывается без перезапуска. Города без записи используют исходные файлы (версия 0).
+class ModelRegistry:
+    def __init__(self, models_dir: str = MODELS_DIR):
+        self.models_dir = models_dir
+        self.path = os.path.join(models_dir, REGISTRY_FILENAME)
+        self._entries: dict[str, ModelEntry] = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+        # Растёт при каждом перечитывании - по нему пересобирается каталог городов
+        self.generation = 0
+
+    def _read_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> dict[str, ModelEntry]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return {city: ModelEntry(**entry) for city, entry in json.load(f)["models"].items()}
+        except FileNotFoundError:
+            return {}
+
+    # Перечитывает манифест, если он изменился (одного stat на вызов достаточно); возвращает поколение
+    def refresh(self) -> int:
+        stamp = self._read_stamp()
+        if stamp == self._stamp:
+            return self.generation
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries = self._load()
+                self._stamp = stamp
+                self.generation += 1
+        return self.generation
+
+    def get(self, city: str) -> ModelEntry | None:
+        self.refresh()
+        return self._entries.get(city)
+
+    def entries(self) -> list[ModelEntry]:
+        self.refresh()
+        return list(self._entries.values())
+
+    def version(self, city: str) -> int:
+        entry = self.get(city)
+        return entry.version if entry is not None else 0
+
+    def model_filename(self, entry: ModelEntry) -> str:
+        return os.path.join(self.models_dir, entry.model)
+
+    # Вызывается после того, как все файлы версии записаны: запись манифеста - момент переключения
+    def register(self, city: str, longitude: float, latitude: float, version: int, model_filename: str) -> ModelEntry:
+        files = {
+            "model": model_filename,
+            "params": get_params_filename(model_filename),
+            "forecast": get_forecast_filename(model_filename),
+        }
+        entry = ModelEntry(
+            city=city,
+            longitude=longitude,
+            latitude=latitude,
+            version=version,
+            checksums={kind: file_checksum(name) for kind, name in files.items() if os.path.exists(name)},
+            trained_at=datetime.now().isoformat(timespec="seconds"),
+            model=os.path.relpath(model_filename, self.models_dir),
+        )
+        with self._lock:
+            # Берём манифест с диска, а не из памяти, чтобы не потерять запись другого процесса
+            entries = {**self._load(), city: entry}
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"models": {name: e._asdict() for name, e in entries.items()}}, f,
+                          ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        self.refresh()
+        return entry
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from api_v1.core.config import settings
+
+# Помесячное секционирование energy по created_at (ENERGY_PARTITIONING=true):
+#   python -m api_v1.energy.partitions status
+#   python -m api_v1.energy.partitions maintain
+#   python -m api_v1.energy.partitions convert   # перевод существующей обычной таблицы
+# Отчёты фильтруют created_at по диапазону, поэтому Postgres читает только секции нужных месяцев.
+# Старые месяцы отсоединяются или удаляются целиком (ENERGY_RETENTION_MONTHS), роллапы при этом остаются.
+
+DEFAULT_PARTITION = "energy_default"
+LEGACY_PARTITION = "energy_legacy"
+ARCHIVE_PREFIX = "archived_"
+
+# Схема совпадает с моделью Energy, но первичный и уникальный ключи включают created_at - Postgres требует
+# ключ секционирования во всех уникальных индексах. Ключ идемпотентности уникален вместе со временем показания.
+# Имена индексов те же, что у обычной таблицы, чтобы apply_migrations их пропускал.
+CREATE_PARTITIONED = [
+    "CREATE SEQUENCE IF NOT EXISTS energy_id_seq",
+    """CREATE TABLE energy (
+        id INTEGER NOT NULL DEFAULT nextval('energy_id_seq'),
+        type INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+        idempotency_key VARCHAR(64),
+        site_id VARCHAR(64) NOT NULL DEFAULT '',
+        device_id VARCHAR(64) NOT NULL DEFAULT '',
+        CONSTRAINT energy_pkey PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)""",
+    "ALTER SEQUENCE energy_id_seq OWNED BY energy.id",
+    "CREATE UNIQUE INDEX ix_energy_device_idempotency_key ON energy (device_id, idempotency_key, created_at)",
+    "CREATE INDEX ix_energy_created_at_type ON energy (created_at, type) INCLUDE (value)",
+    "CREATE INDEX ix_energy_device_created_at ON energy (device_id, created_at) INCLUDE (type, value)",
+    "CREATE INDEX ix_energy_site_created_at ON energy (site_id, created_at) INCLUDE (type, value)",
+    # Строки вне созданных месяцев (догрузка старых показаний, сбитые часы устройства) не теряются;
+    # обслуживание переносит их в помесячные секции
+    f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF energy DEFAULT",
+]
+
+COLUMNS = "id, type, value, created_at, idempotency_key, site_id, device_id"
+
+BOUND_RE = re.compile(r"FROM \((?:'([^']*)'|MINVALUE)\) TO \((?:'([^']*)'|MAXVALUE)\)")
+
+# Результат последнего обслуживания для GET /partitions/
+maintenance_state: dict = {"last_run": None, "result": None, "error": None}
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"energy_p{month:%Y_%m}"
+
+
+def quote(conn: AsyncConnection, name: str) -> str:
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+# True - секционирована, False - обычная таблица, None - таблицы нет
+async def is_partitioned(conn: AsyncConnection) -> bool | None:
+    kind = await conn.scalar(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('energy')"))
+    return None if kind is None else kind == "p"
+
+
+# Вызывается до create_all, иначе он создаст обычную таблицу
+async def create_partitioned_energy(conn: AsyncConnection) -> None:
+    partitioned = await is_partitioned(conn)
+    if partitioned is None:
+        for statement in CREATE_PARTITIONED:
+            await conn.execute(text(statement))
+    elif not partitioned:
+        raise RuntimeError("Таблица energy уже существует и не секционирована, "
+                           "переведите её командой python -m api_v1.energy.partitions convert")
+
+
+# Секции energy: имя -> (начало, конец); None - MINVALUE/MAXVALUE. Секция по умолчанию не входит
+async def partition_bounds(conn: AsyncConnection) -> dict[str, tuple[datetime | None, datetime | None]]:
+    rows = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'energy'::regclass"
+    ))
+    bounds = {}
+    for name, expression in rows:
+        match = BOUND_RE.search(expression)
+        if match is None:
+            continue
+        start, end = match.groups()
+        bounds[name] = (datetime.fromisoformat(start) if start else None, datetime.fromisoformat(end) if end else None)
+    return bounds
+
+
+def is_covered(bounds: dict, start: datetime, end: datetime) -> bool:
+    return any((lo is None or lo < end) and (hi is None or start < hi) for lo, hi in bounds.values())
+
+
+async def create_month_partition(conn: AsyncConnection, month: datetime) -> str:
+    name, end = partition_name(month), add_months(month, 1)
+    spec = f"PARTITION OF energy FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    params = {"start": month, "end": end}
+    in_default = f"FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end"
+    if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 {in_default})"), params):
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {quote(conn, name)} {spec}"))
+        return name
+    # Postgres не создаст секцию, пока её строки лежат в секции по умолчанию: отсоединяем её, переносим строки
+    await conn.execute(text(f"ALTER TABLE energy DETACH PARTITION {DEFAULT_PARTITION}"))
+    await conn.execute(text(f"CREATE TABLE {quote(conn, name)} {spec}"))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE {in_default} RETURNING {COLUMNS}) INSERT INTO energy ({COLUMNS}) SELECT * FROM moved"
+    ), params)
+    await conn.execute(text(f"ALTER TABLE energy ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return name
+
+
+# Создаёт недостающие месячные секции, пересекающиеся с [start, end)
+async def ensure_partitions(conn: AsyncConnection, start: datetime, end: datetime) -> list[str]:
+    bounds = await partition_bounds(conn)
+    created = []
+    month = month_start(start)
+    while month < end:
+        if not is_covered(bounds, month, add_months(month, 1)):
+            created.append(await create_month_partition(conn, month))
+        month = add_months(month, 1)
+    return created
+
+
+# Отсоединяет (или удаляет) секции, целиком лежащие раньше cutoff - без удаления строк по одной
+async def apply_retention(conn: AsyncConnection, cutoff: datetime, action: str) -> list[str]:
+    retired = []
+    for name, (_, end) in sorted((await partition_bounds(conn)).items()):
+        if end is None or end > cutoff:
+            continue
+        await conn.execute(text(f"ALTER TABLE energy DETACH PARTITION {quote(conn, name)}"))
+        if action == "drop":
+            await conn.execute(text(f"DROP TABLE {quote(conn, name)}"))
+        else:
+            await conn.execute(text(f"ALTER TABLE {quote(conn, name)} RENAME TO {quote(conn, ARCHIVE_PREFIX + name)}"))
+        retired.append(name)
+    return retired
+
+
+# Граница политики хранения: показания раньше неё уходят из energy при обслуживании; None - хранить всё
+def retention_cutoff(now: datetime | None = None) -> datetime | None:
+    retention = settings.energy_retention_months
+    if not settings.energy_partitioning or retention <= 0:
+        return None
+    return add_months(month_start(now or datetime.now()), -retention)
+
+
+# Секции на текущий и ENERGY_PARTITIONS_AHEAD следующих месяцев, перенос строк из секции по умолчанию
+# и политика хранения. Advisory-блокировка не даёт нескольким процессам обслуживать одновременно
+async def maintain_partitions(conn: AsyncConnection, now: datetime | None = None) -> dict:
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('energy_partitions'))"))
+    current = month_start(now or datetime.now())
+    cutoff = retention_cutoff(current)
+
+    created = await ensure_partitions(conn, current, add_months(current, settings.energy_partitions_ahead + 1))
+    stray_months = (await conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', created_at) FROM {DEFAULT_PARTITION}"
+    ))).scalars().all()
+    # Месяцы старше срока хранения тоже получают секцию: она сразу уходит в архив (или удаляется при drop)
+    # вместе с остальными, строки по одной не удаляются
+    for month in sorted(stray_months):
+        created += await ensure_partitions(conn, month, add_months(month, 1))
+    retired = []
+    if cutoff is not None:
+        retired = await apply_retention(conn, cutoff, settings.energy_retention_action)
+    return {"created": created, "retired": retired}
+
+
+async def run_maintenance(engine: AsyncEngine) -> dict:
+    started = time.perf_counter()
+    try:
+        async with engine.begin() as conn:
+            result = await maintain_partitions(conn)
+    except Exception as e:
+        maintenance_state.update(last_run=datetime.now().isoformat(timespec="seconds"), error=repr(e))
+        raise
+    maintenance_state.update(last_run=datetime.now().isoformat(timespec="seconds"), error=None,
+                             result={**result, "seconds": round(time.perf_counter() - started, 3)})
+    return result
+
+
+# Периодическое обслуживание: следующие месяцы создаются заранее, старые уходят по политике хранения
+async def maintenance_loop(engine: AsyncEngine, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_maintenance(engine)
+        except Exception as e:
+            print(e)
+
+
+async def status(conn: AsyncConnection) -> dict:
+    if not await is_partitioned(conn):
+        return {"partitioned": False}
+    rows = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, "
+        "pg_total_relation_size(c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'energy'::regclass ORDER BY c.relname"
+    ))
+    return {
+        "partitioned": True,
+        "partitions": [
+            # reltuples - оценка после ANALYZE, -1 - секция ещё не анализировалась
+            {"name": name, "bounds": bounds, "rows_estimate": rows_estimate, "bytes": size}
+            for name, bounds, rows_estimate, size in rows
+        ],
+        "maintenance": maintenance_state,
+    }
+
+
+# Переводит обычную таблицу energy в секционированную без копирования данных: старая таблица
+# присоединяется секцией energy_legacy на всё время до начала следующего месяца
+async def convert_to_partitioned(conn: AsyncConnection) -> datetime:
+    if await is_partitioned(conn) is not False:
+        raise RuntimeError("Нет обычной таблицы energy для перевода")
+    await conn.execute(text("LOCK TABLE energy IN ACCESS EXCLUSIVE MODE"))
+    latest = await conn.scalar(text("SELECT max(created_at) FROM energy"))
+    boundary = add_months(month_start(max(latest or datetime.now(), datetime.now())), 1)
+
+    await conn.execute(text(f"ALTER TABLE energy RENAME TO {LEGACY_PARTITION}"))
+    # У секции не может быть своего первичного ключа: при присоединении она получит ключ (id, created_at)
+    # родителя, уникальность одного ключа идемпотентности заменит уникальность (ключ, время)
+    primary_key = await conn.scalar(text(
+        f"SELECT conname FROM pg_constraint WHERE conrelid = '{LEGACY_PARTITION}'::regclass AND contype = 'p'"
+    ))
+    if primary_key is not None:
+        await conn.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT {quote(conn, primary_key)}"))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_energy_idempotency_key"))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_energy_device_idempotency_key"))
+    # Индексы по времени присоединятся к индексам родителя без перестройки
+    for index in ("created_at_type", "device_created_at", "site_created_at"):
+        await conn.execute(text(f"ALTER INDEX IF EXISTS ix_energy_{index} RENAME TO ix_{LEGACY_PARTITION}_{index}"))
+    await conn.execute(text(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN created_at SET NOT NULL"))
+
+    for statement in CREATE_PARTITIONED:
+        await conn.execute(text(statement))
+    await conn.execute(text(
+        f"ALTER TABLE energy ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO ('{boundary:%Y-%m-%d}')"
+    ))
+    return boundary
+
+
+async def main(command: str) -> None:
+    from api_v1.core.DbHelper import db_helper
+
+    try:
+        async with db_helper.engine.begin() as conn:
+            if command == "convert":
+                boundary = await convert_to_partitioned(conn)
+                print(f"energy секционирована, старые строки до {boundary:%Y-%m-%d} в секции {LEGACY_PARTITION}")
+            elif command == "status":
+                print(await status(conn))
+                return
+        if command in ("convert", "maintain"):
+            print(await run_maintenance(db_helper.engine))
+    finally:
+        await db_helper.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Секции таблицы energy по месяцам")
+    parser.add_argument('command', choices=["status", "maintain", "convert"])
+    asyncio.run(main(parser.parse_args().command))
@@ -0,0 +1,107 @@
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+# Параметры обученной модели Prophet и вычисление yhat без prophet, cmdstanpy и pandas.
+# Поддерживаются модели, которые обучает ml_training: линейный тренд с точками излома
+# и аддитивные сезонности Фурье. Формула повторяет Prophet.predict для таких моделей:
+#   yhat = (k_t * t + m_t) * y_scale + floor + X_fourier @ beta * y_scale
+
+PARAMS_FORMAT_VERSION = 2
+SECONDS_PER_DAY = 3600 * 24.
+
+
+def get_params_filename(model_filename: str) -> str:
+    return model_filename.removesuffix("_prophet_model.pkl") + "_prophet_params.npz"
+
+
+def piecewise_linear(t: np.ndarray, deltas: np.ndarray, k: float, m: float, changepoints_t: np.ndarray) -> np.ndarray:
+    deltas_t = (changepoints_t[None, :] <= t[..., None]) * deltas
+    k_t = deltas_t.sum(axis=1) + k
+    m_t = (deltas_t * -changepoints_t).sum(axis=1) + m
+    return k_t * t + m_t
+
+
+class ProphetParams(NamedTuple):
+    # Начало обучающей выборки и её длина, в секундах
+    start: float
+    t_scale: float
+    y_scale: float
+    floor: float
+    k: float
+    m: float
+    deltas: np.ndarray
+    changepoints_t: np.ndarray
+    # Период (в днях) и порядок каждой сезонности
+    periods: np.ndarray
+    orders: np.ndarray
+    # Коэффициенты признаков по сезонностям подряд, внутри сезонности - sin и cos каждой гармоники
+    beta: np.ndarray
+    # Шум наблюдений в масштабе y / y_scale, нужен только для интервалов
+    sigma_obs: float
+
+    def trend(self, seconds: np.ndarray) -> np.ndarray:
+        t = (seconds - self.start) / self.t_scale
+        return piecewise_linear(t, self.deltas, self.k, self.m, self.changepoints_t) * self.y_scale + self.floor
+
+    def seasonal_features(self, seconds: np.ndarray) -> np.ndarray:
+        x_t = seconds / SECONDS_PER_DAY * np.pi * 2
+        features = np.empty((len(seconds), 2 * int(self.orders.sum())))
+        column = 0
+        for period, order in zip(self.periods, self.orders):
+            for i in range(1, int(order) + 1):
+                c = x_t * i / period
+                features[:, column] = np.sin(c)
+                features[:, column + 1] = np.cos(c)
+                column += 2
+        return features
+
+    def predict(self, days) -> np.ndarray:
+        seconds = _to_seconds(days)
+        return self.trend(seconds) + self.seasonal_features(seconds) @ self.beta * self.y_scale
+
+    # Сэмплы yhat как в Prophet.predictive_samples: за пределами истории тренд получает случайные
+    # точки излома (пуассоновский поток с плотностью как на истории, изломы по Лапласу), плюс шум наблюдений.
+    # Возвращает матрицу (дни x сэмплы).
+    def sample(self, days, n_samples: int, rng: np.random.Generator) -> np.ndarray:
+        seconds = _to_seconds(days)
+        t = (seconds - self.start) / self.t_scale
+        seasonal = self.seasonal_features(seconds) @ self.beta * self.y_scale + self.floor
+        T = t.max() if len(t) else 0.0
+        scale = np.mean(np.abs(self.deltas)) + 1e-8
+        samples = np.empty((len(t), n_samples))
+        for i in range(n_samples):
+            n_changes = rng.poisson(len(self.changepoints_t) * (T - 1)) if T > 1 else 0
+            changepoints_new = np.sort(1 + rng.random(n_changes) * (T - 1))
+            trend = piecewise_linear(
+                t,
+                np.concatenate((self.deltas, rng.laplace(0, scale, n_changes))),
+                self.k,
+                self.m,
+                np.concatenate((self.changepoints_t, changepoints_new)),
+            )
+            samples[:, i] = trend * self.y_scale + seasonal + rng.normal(0, self.sigma_obs, len(t)) * self.y_scale
+        return samples
+
+
+def _to_seconds(days) -> np.ndarray:
+    return np.asarray(days, dtype="datetime64[s]").astype(np.int64).astype(np.float64)
+
+
+def write_prophet_params(filename: str, params: ProphetParams) -> str:
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, version=PARAMS_FORMAT_VERSION, **params._asdict())
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def load_prophet_params(filename: str) -> ProphetParams:
+    with np.load(filename) as data:
+        if int(data["version"]) != PARAMS_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия параметров модели: {int(data['version'])}")
+        return ProphetParams(**{
+            field: float(data[field]) if data[field].ndim == 0 else data[field]
+            for field in ProphetParams._fields
+        })
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from api_v1.core.config import settings
+from api_v1.core.metrics import registry
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: float
+    start: datetime | None
+    end: datetime | None
+    # После этого момента запись считается устаревшей
+    expires_at: float
+
+
+# Кэш готовых ответов отчётов. Запись показаний сбрасывает ответы, в диапазон которых она попала.
+# Запись через другой воркер сюда не доходит, поэтому у каждого ответа есть TTL: короткий у ответов,
+# затрагивающих текущий период, и длинный у закончившихся периодов (их меняет только догрузка пакетом).
+class ReportCache:
+    def __init__(self, max_entries: int, open_ttl: float, closed_ttl: float):
+        # 0 - ответы не хранятся: put сразу вытесняет запись (для бенчмарков и отладки)
+        self.max_entries = max(max_entries, 0)
+        self.open_ttl = open_ttl
+        self.closed_ttl = closed_ttl
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        # Растёт при каждой записи показаний, чтобы не сохранить ответ, посчитанный до неё
+        self.generation = 0
+
+    def get(self, key: tuple) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, payload: Any, start: datetime | None, end: datetime | None,
+            generation: int | None = None) -> CacheEntry:
+        body = json.dumps(
+            jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        now = time.time()
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        is_open = end is None or end >= today
+        entry = CacheEntry(
+            body=body,
+            etag='"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+            last_modified=now,
+            start=start,
+            end=end,
+            expires_at=now + (self.open_ttl if is_open else self.closed_ttl),
+        )
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    # Сбрасывает записи, диапазон которых пересекается с [start, end]; записи без диапазона - всегда
+    def invalidate(self, start: datetime, end: datetime) -> None:
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry.start is None or entry.end is None or (entry.start <= end and start <= entry.end)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self.generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+            }
+
+    def _is_not_modified(self, request: Request, entry: CacheEntry) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return entry.etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return int(entry.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _response(self, request: Request, entry: CacheEntry) -> Response:
+        headers = {
+            "ETag": entry.etag,
+            "Last-Modified": format_datetime(datetime.fromtimestamp(int(entry.last_modified), timezone.utc), usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if self._is_not_modified(request, entry):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    async def respond(self, request: Request, key: tuple, compute: Callable[[], Awaitable[Any]],
+                      start: datetime | None = None, end: datetime | None = None) -> Response:
+        entry = self.get(key)
+        if entry is None:
+            generation = self.generation
+            entry = self.put(key, await compute(), start, end, generation)
+        return self._response(request, entry)
+
+
+report_cache = ReportCache(max_entries=settings.report_cache_size, open_ttl=settings.report_cache_open_ttl,
+                           closed_ttl=settings.report_cache_closed_ttl)
+registry.add_cache("report", report_cache.stats)
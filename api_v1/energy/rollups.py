@@ -0,0 +1,201 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import delete, exists, func, literal, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from api_v1.core.models.Energy import Energy
+from api_v1.core.models.EnergyRollup import EnergyRollup
+from api_v1.energy import partitions
+from api_v1.energy.bucketing import GRANULARITIES, Granularity, ceil
+
+# От крупного к мелкому
+ROLLUP_LEVELS = ("month", "day", "hour")
+
+
+# Срез отчёта: все показания, один объект или один счётчик (пустая строка - без фильтра)
+class Scope(NamedTuple):
+    site_id: str = ""
+    device_id: str = ""
+
+    def energy_conditions(self) -> list:
+        conditions = []
+        if self.device_id:
+            conditions.append(Energy.device_id == self.device_id)
+        if self.site_id:
+            conditions.append(Energy.site_id == self.site_id)
+        return conditions
+
+    # Строки счётчика лежат в его срезе, строки объекта и общие - в срезе с device_id = ''
+    def rollup_conditions(self) -> list:
+        conditions = [EnergyRollup.device_id == self.device_id]
+        if self.site_id or not self.device_id:
+            conditions.append(EnergyRollup.site_id == self.site_id)
+        return conditions
+
+
+ALL = Scope()
+
+
+def truncate(value: datetime, level: str) -> datetime:
+    return GRANULARITIES[level].floor(value)
+
+
+# Разбивает [start, end) на куски: максимально крупные целые бакеты роллапов в середине
+# и сырые строки (level=None) только на неполных краях
+def cover_range(start: datetime, end: datetime, levels=ROLLUP_LEVELS) -> list[tuple[str | None, datetime, datetime]]:
+    if start >= end:
+        return []
+    if not levels:
+        return [(None, start, end)]
+    level, finer = levels[0], levels[1:]
+    inner_start = ceil(start, GRANULARITIES[level])
+    inner_end = truncate(end, level)
+    if inner_start >= inner_end:
+        return cover_range(start, end, finer)
+    return cover_range(start, inner_start, finer) + [(level, inner_start, inner_end)] + cover_range(inner_end, end, finer)
+
+
+# between() в отчётах включает правую границу, у timestamp точность - микросекунда
+def inclusive_end(end: datetime) -> datetime:
+    return end + timedelta(microseconds=1)
+
+
+# Срезы, в которые попадает показание
+def row_scopes(site_id: str, device_id: str) -> list[Scope]:
+    scopes = [ALL]
+    if site_id:
+        scopes.append(Scope(site_id))
+    if device_id:
+        scopes.append(Scope(site_id, device_id))
+    return scopes
+
+
+# rows - (type, value, created_at, site_id, device_id)
+async def apply_rollups(session: AsyncSession, rows) -> None:
+    totals = defaultdict(lambda: [0, 0])
+    for energy_type, value, created_at, site_id, device_id in rows:
+        for scope in row_scopes(site_id, device_id):
+            for level in ROLLUP_LEVELS:
+                total = totals[(level, truncate(created_at, level), energy_type, scope)]
+                total[0] += value
+                total[1] += 1
+    if not totals:
+        return
+    query = pg_insert(EnergyRollup).values([
+        {"granularity": level, "bucket": bucket, "type": energy_type, "value": value, "count": count,
+         "site_id": scope.site_id, "device_id": scope.device_id}
+        for (level, bucket, energy_type, scope), (value, count) in totals.items()
+    ])
+    query = query.on_conflict_do_update(
+        index_elements=[EnergyRollup.device_id, EnergyRollup.granularity, EnergyRollup.bucket, EnergyRollup.type,
+                        EnergyRollup.site_id],
+        set_={
+            "value": EnergyRollup.value + query.excluded.value,
+            "count": EnergyRollup.count + query.excluded.count,
+        },
+    )
+    await session.execute(query)
+
+
+async def _lock_for_rebuild(conn: AsyncConnection) -> None:
+    # Запрещаем вставки на время пересчёта, иначе строки посчитаются дважды или потеряются
+    await conn.execute(text("LOCK TABLE energy IN SHARE MODE"))
+    await conn.execute(text("LOCK TABLE energy_rollup IN EXCLUSIVE MODE"))
+
+
+# since - начало пересчёта (начало месяца, поэтому бакеты всех уровней целиком до или после него);
+# роллапы более ранних бакетов остаются как есть
+async def _rebuild_locked(conn: AsyncConnection, since: datetime | None = None) -> None:
+    removed = delete(EnergyRollup)
+    if since is not None:
+        removed = removed.where(EnergyRollup.bucket >= since)
+    await conn.execute(removed)
+    for level in ROLLUP_LEVELS:
+        bucket = func.date_trunc(level, Energy.created_at)
+        # Общий срез, срезы объектов и срезы счётчиков
+        for keys, condition in (
+                ((), None),
+                ((Energy.site_id,), Energy.site_id != ""),
+                ((Energy.site_id, Energy.device_id), Energy.device_id != ""),
+        ):
+            site_id, device_id = (keys + (literal(""), literal("")))[:2]
+            source = select(
+                literal(level), bucket, Energy.type, func.sum(Energy.value), func.count(), site_id, device_id
+            ).group_by(bucket, Energy.type, *keys)
+            if condition is not None:
+                source = source.where(condition)
+            if since is not None:
+                source = source.where(Energy.created_at >= since)
+            await conn.execute(
+                EnergyRollup.__table__.insert().from_select(
+                    ["granularity", "bucket", "type", "value", "count", "site_id", "device_id"], source
+                )
+            )
+
+
+# Месяцы старше срока хранения не пересчитываются: их сырые показания ушли в архив, а роллапы остаются
+# единственной историей для отчётов
+async def rebuild_rollups(conn: AsyncConnection) -> None:
+    await _lock_for_rebuild(conn)
+    await _rebuild_locked(conn, since=partitions.retention_cutoff())
+
+
+# При первом запуске на существующей базе роллапы строятся из сырых данных
+async def ensure_rollups(conn: AsyncConnection) -> bool:
+    if await conn.scalar(select(exists().select_from(EnergyRollup))):
+        return False
+    if not await conn.scalar(select(exists().select_from(Energy))):
+        return False
+    await _lock_for_rebuild(conn)
+    if await conn.scalar(select(exists().select_from(EnergyRollup))):
+        return False
+    await _rebuild_locked(conn)
+    return True
+
+
+def _piece(level: str | None, start: datetime, end: datetime, scope: Scope, period=None):
+    if level is None:
+        column, value, energy_type = Energy.created_at, Energy.value, Energy.type
+        conditions = [Energy.created_at >= start, Energy.created_at < end, *scope.energy_conditions()]
+    else:
+        column, value, energy_type = EnergyRollup.bucket, EnergyRollup.value, EnergyRollup.type
+        conditions = [EnergyRollup.granularity == level, EnergyRollup.bucket >= start, EnergyRollup.bucket < end,
+                      *scope.rollup_conditions()]
+    columns = [energy_type.label("type"), func.sum(value).label("value")]
+    group_by = [energy_type]
+    if period is not None:
+        period_expr = period(column)
+        columns.insert(0, period_expr.label("period"))
+        group_by.insert(0, period_expr)
+    return select(*columns).where(*conditions).group_by(*group_by)
+
+
+# Суммы по типам за [start, end)
+def range_sums_query(start: datetime, end: datetime, scope: Scope = ALL):
+    pieces = [_piece(level, a, b, scope) for level, a, b in cover_range(start, end)]
+    if not pieces:
+        return None
+    parts = union_all(*pieces).subquery()
+    return select(parts.c.type, func.sum(parts.c.value)).group_by(parts.c.type)
+
+
+def total_sums_query(scope: Scope = ALL):
+    # Месячные бакеты покрывают все строки таблицы
+    return select(EnergyRollup.type, func.sum(EnergyRollup.value)).where(
+        EnergyRollup.granularity == "month", *scope.rollup_conditions()
+    ).group_by(EnergyRollup.type)
+
+
+# Суммы по бакетам гранулярности и типам за [start, end); period - начало бакета (timestamp)
+def grouped_sums_query(start: datetime, end: datetime, granularity: Granularity, scope: Scope = ALL):
+    pieces = [
+        _piece(level, a, b, scope, granularity.sql)
+        for level, a, b in cover_range(start, end, granularity.rollup_levels)
+    ]
+    if not pieces:
+        return None
+    parts = union_all(*pieces).subquery()
+    return select(parts.c.period, parts.c.type, func.sum(parts.c.value)).group_by(parts.c.period, parts.c.type)
@@ -1,12 +1,47 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Annotated, Literal
 from fastapi import Path, Query
-from pydantic import BaseModel, field_serializer, Field
+from pydantic import BaseModel, field_serializer, field_validator, Field
+
+
+# Идентификаторы объекта и счётчика: буквы, цифры, '_', '-', '.', ':'
+SCOPE_ID_PATTERN = r"^[\w.:\-]+$"
 
 
 class CreateEnergy(BaseModel):
     type: Annotated[int, Field(title='1 - Consumed, 2- Generated', ge=1, le=2, examples=[1,2])]
-    value: Annotated[int, Field(title='value', ge=0, examples=[1000])]
+    # Колонка value - integer (int4)
+    value: Annotated[int, Field(title='value', ge=0, le=2**31 - 1, examples=[1000])]
+    site_id: Annotated[str | None, Field(title='Объект (здание)', max_length=64, pattern=SCOPE_ID_PATTERN,
+                                         examples=["building-1"])] = None
+    device_id: Annotated[str | None, Field(title='Счётчик', max_length=64, pattern=SCOPE_ID_PATTERN,
+                                           examples=["meter-42"])] = None
+
+
+class CreateEnergyBatchItem(CreateEnergy):
+    created_at: Annotated[datetime | None, Field(title='Время показания на устройстве')] = None
+    seq: Annotated[int | None, Field(title='Порядковый номер показания на устройстве', ge=0)] = None
+    idempotency_key: Annotated[str | None, Field(min_length=1, max_length=64)] = None
+
+    @field_validator("created_at")
+    @classmethod
+    def to_naive_utc(cls, value: datetime | None) -> datetime | None:
+        # Колонка created_at без часового пояса
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @property
+    def key(self) -> str | None:
+        if self.idempotency_key is not None:
+            return self.idempotency_key
+        if self.seq is not None:
+            return f"seq:{self.seq}"
+        return None
+
+
+class CreateEnergyBatch(BaseModel):
+    items: Annotated[list[CreateEnergyBatchItem], Field(min_length=1, max_length=20000)]
 
 
 class EnergyResponse(BaseModel):
@@ -14,6 +49,8 @@ class EnergyResponse(BaseModel):
     type: int
     value: float
     created_at: datetime
+    site_id: str = ""
+    device_id: str = ""
 
     @field_serializer("created_at")
     def serialize_created_at(self, value: datetime, _info) -> str:
@@ -23,7 +60,26 @@ class EnergyResponse(BaseModel):
 class PredictIn(BaseModel):
     start_date: Annotated[str, Field(examples=["2025-12-31"])] = "2025-12-31"
     end_date: Annotated[str, Field(examples=["2026-10-15"])] = "2026-10-15"
-    longitude: Annotated[float, Field(examples=[37.62])] = 37.62
-    latitude: Annotated[float, Field(examples=[55.75])] = 55.75
-    group_by: Annotated[Literal["day", "month", "year"] | None, Field(title="Group periods by day/month/year" )] = None
+    longitude: Annotated[float, Field(ge=-180, le=180, examples=[37.62])] = 37.62
+    latitude: Annotated[float, Field(ge=-90, le=90, examples=[55.75])] = 55.75
+    group_by: Annotated[Literal["day", "week", "month", "year"] | None,
+                        Field(title="Group periods by day/week/month/year")] = None
+    intervals: Annotated[bool, Field(title="Добавить интервалы прогноза (bands) к прогнозным значениям")] = False
+    site_id: Annotated[str | None, Field(title="Прошедшая часть только по объекту", max_length=64,
+                                         pattern=SCOPE_ID_PATTERN)] = None
+    device_id: Annotated[str | None, Field(title="Прошедшая часть только по счётчику", max_length=64,
+                                           pattern=SCOPE_ID_PATTERN)] = None
+
+
+class PredictBatchIn(BaseModel):
+    items: Annotated[list[PredictIn], Field(min_length=1, max_length=1000)]
+
+
+class Coordinates(BaseModel):
+    longitude: Annotated[float, Field(ge=-180, le=180, examples=[37.62])]
+    latitude: Annotated[float, Field(ge=-90, le=90, examples=[55.75])]
+
 
+class TrainModelIn(Coordinates):
+    # Имя города входит в имя файла модели, поэтому только буквы, цифры, пробел и дефис
+    city: Annotated[str, Field(min_length=1, max_length=64, pattern=r"^[\w][\w \-]*$", examples=["Moscow"])]
@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+
+from api_v1.core.config import settings
+from api_v1.energy.model_registry import ModelRegistry, model_registry
+
+# Сколько завершённых заданий помнить для GET /models/jobs/
+JOBS_HISTORY = 100
+
+
+# Выполняется в отдельном процессе: prophet и cmdstanpy импортируются только там
+def train_model_version(longitude: float, latitude: float, city: str, version: int, models_dir: str) -> str:
+    from ml_training.CycleTraining import get_model_path, training
+
+    training(longitude=longitude, latitude=latitude, city=city, path=models_dir, version=version)
+    return get_model_path(longitude, latitude, city, models_dir, version)
+
+
+# Фоновое обучение новых версий моделей. Файлы версии пишутся целиком, затем версия регистрируется
+# в реестре - с этого момента новые запросы во всех процессах берут её, а начатые дорабатывают на старой.
+class TrainingJobs:
+    def __init__(self, workers: int, registry: ModelRegistry):
+        self.workers = max(workers, 1)
+        self.registry = registry
+        self._executor: Executor | None = None
+        self._ids = itertools.count(1)
+        self._jobs: dict[int, dict] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        # Город -> id задания, которое его сейчас обучает
+        self._active: dict[str, int] = {}
+
+    def submit(self, longitude: float, latitude: float, city: str) -> dict:
+        if city in self._active:
+            raise ValueError(f"Модель города {city} уже обучается (задание {self._active[city]})")
+        job_id = next(self._ids)
+        job = {
+            "id": job_id,
+            "city": city,
+            "longitude": longitude,
+            "latitude": latitude,
+            "status": "queued",
+            "version": None,
+            "submitted_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": None,
+            "error": None,
+        }
+        self._jobs[job_id] = job
+        self._active[city] = job_id
+        self._tasks[job_id] = asyncio.create_task(self._run(job))
+        self._trim()
+        return dict(job)
+
+    async def wait(self, job_id: int) -> dict:
+        # Задание берётся до ожидания: пока оно обучается, _trim может убрать его из истории
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Задание {job_id} не найдено")
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return dict(job)
+
+    async def _run(self, job: dict) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        job["status"] = "running"
+        job["version"] = self.registry.version(job["city"]) + 1
+        try:
+            model_filename = await loop.run_in_executor(
+                self._executor, train_model_version,
+                job["longitude"], job["latitude"], job["city"], job["version"], self.registry.models_dir,
+            )
+            # Контрольные суммы считаются по файлам в несколько МБ - не в event loop
+            await asyncio.to_thread(self.registry.register, job["city"], job["longitude"], job["latitude"],
+                                    job["version"], model_filename)
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = repr(e)
+        else:
+            job["status"] = "done"
+        finally:
+            job["seconds"] = round(time.perf_counter() - started, 3)
+            self._active.pop(job["city"], None)
+            self._tasks.pop(job["id"], None)
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(len(self._jobs) - JOBS_HISTORY, 0)]:
+            del self._jobs[job_id]
+
+    def list(self) -> list[dict]:
+        return [dict(job) for job in reversed(self._jobs.values())]
+
+    def shutdown(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+training_jobs = TrainingJobs(workers=settings.training_workers, registry=model_registry)
@@ -1,20 +1,93 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, Body, Query
+from fastapi import APIRouter, Depends, Body, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from api_v1.core.DbHelper import db_helper
-from api_v1.energy import crud
-from api_v1.energy.schemas import CreateEnergy, PredictIn
+from api_v1.energy import crud, export, partitions, rollups
+from api_v1.energy.forecast_pool import forecast_pool
+from api_v1.energy.ingest_buffer import ingest_buffer
+from api_v1.energy.live_totals import live_totals
+from api_v1.energy.cities import current_city_index
+from api_v1.energy.report_cache import report_cache
+from api_v1.energy.model_registry import model_registry
+from api_v1.energy.schemas import (Coordinates, CreateEnergy, CreateEnergyBatch, PredictBatchIn, PredictIn,
+                                   SCOPE_ID_PATTERN, TrainModelIn)
+from api_v1.energy.training_jobs import training_jobs
 
 from api_v1.core.config import settings
 energy_router = APIRouter()
 
 
+# Фильтр по объекту и/или счётчику; без них - все показания
+def report_scope(
+        site_id: Annotated[str | None, Query(max_length=64, pattern=SCOPE_ID_PATTERN)] = None,
+        device_id: Annotated[str | None, Query(max_length=64, pattern=SCOPE_ID_PATTERN)] = None,
+) -> rollups.Scope:
+    return rollups.Scope(site_id or "", device_id or "")
+
+
 @energy_router.get("/energy/")
-async def get_energy_list(session: AsyncSession = Depends(db_helper.session_dependency)):
-    return await crud.get_energy_list(session=session)
+async def get_energy_list(
+        response: Response,
+        limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+        cursor: str | None = None,
+        type: Annotated[int | None, Query(ge=1, le=2)] = None,
+        start_date: str | None = None,
+        end_date: str | None = None,
+        format: Literal["json", "ndjson"] = "json",
+        scope: rollups.Scope = Depends(report_scope),
+        session: AsyncSession = Depends(db_helper.session_dependency)
+):
+    try:
+        start_date = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end_date = datetime.strptime(end_date.strip("/"), "%Y-%m-%d") if end_date else None
+        if cursor is not None:
+            crud.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        return StreamingResponse(
+            crud.stream_energy_list(db_helper.session_factory, cursor=cursor, energy_type=type,
+                                    start_date=start_date, end_date=end_date, scope=scope),
+            media_type="application/x-ndjson",
+        )
+
+    items, next_cursor = await crud.get_energy_list(session=session, limit=limit, cursor=cursor, energy_type=type,
+                                                    start_date=start_date, end_date=end_date, scope=scope)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+# Объявлен раньше /energy/{energy_id}/, иначе "export" разбирался бы как energy_id
+@energy_router.get("/energy/export/")
+async def export_energy(
+        format: Literal["csv", "parquet", "arrow"] = "csv",
+        start_date: str | None = None,
+        end_date: str | None = None,
+        type: Annotated[int | None, Query(ge=1, le=2)] = None,
+        bucket: Literal["15min", "hour", "day", "week", "month", "year"] | None = None,
+        scope: rollups.Scope = Depends(report_scope),
+):
+    try:
+        export.check_format(format)
+        start_date = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end_date = datetime.strptime(end_date.strip("/"), "%Y-%m-%d") if end_date else None
+        query = export.export_query(start_date, end_date, type, bucket, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    media_type, _ = export.FORMATS[format]
+    filename = export.export_filename(format, start_date, end_date, bucket)
+    return StreamingResponse(
+        export.stream_export(db_helper.session_factory, query, format, bucket),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @energy_router.get("/energy/{energy_id}/")
@@ -24,51 +97,218 @@ async def get_energy(energy_id: int, session: AsyncSession = Depends(db_helper.s
 
 @energy_router.post("/create_energy/")
 async def create_energy(
+        response: Response,
         session: AsyncSession = Depends(db_helper.session_dependency),
         energy_data: CreateEnergy = Body(...)
 ):
+    if settings.ingest_buffer:
+        # Показание в журнале, в БД (и в отчётах) оно появится с ближайшей записью буфера
+        response.status_code = 202
+        return await ingest_buffer.append(energy_data)
     return await crud.create_energy(session=session, energy_data=energy_data)
 
 
+@energy_router.post("/create_energy/batch/")
+async def create_energy_batch(
+        session: AsyncSession = Depends(db_helper.session_dependency),
+        batch: CreateEnergyBatch = Body(...)
+):
+    try:
+        return await crud.create_energy_batch(session=session, items=batch.items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @energy_router.get("/report/")
-async def report(session: AsyncSession = Depends(db_helper.session_dependency)):
-    return await crud.report(session=session)
+async def report(request: Request, scope: rollups.Scope = Depends(report_scope),
+                 session: AsyncSession = Depends(db_helper.session_dependency)):
+    return await report_cache.respond(request, ("report", scope), lambda: crud.report(session=session, scope=scope))
+
+
+# Итоги /report/ потоком Server-Sent Events: первое событие сразу, дальше - при изменении,
+# не чаще раза в LIVE_TOTALS_INTERVAL секунд
+@energy_router.get("/report/live/")
+async def report_live(scope: rollups.Scope = Depends(report_scope)):
+    return StreamingResponse(
+        live_totals.subscribe(scope),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@energy_router.post("/rollups/rebuild/")
+async def rebuild_rollups(session: AsyncSession = Depends(db_helper.session_dependency)):
+    await crud.rebuild_rollups(session=session)
+    report_cache.clear()
+    return "OK"
 
 
 @energy_router.get("/report_by_date/")
 async def report_by_date(
+    request: Request,
     start_date: str  = "2025-02-14",
     end_date: str = "2025-03-14",
-    group_by: Annotated[Literal["day", "month", "year"] | None, Query(title="Group periods by day/month/year" )] = None,
-
+    group_by: Annotated[Literal["15min", "hour", "day", "week", "month", "year"] | None,
+                        Query(title="Group periods by 15min/hour/day/week/month/year")] = None,
+    scope: rollups.Scope = Depends(report_scope),
     session: AsyncSession = Depends(db_helper.session_dependency)
 ):
     start_date = datetime.strptime(start_date, "%Y-%m-%d")
     end_date = end_date.strip("/")
     end_date = datetime.strptime(end_date, "%Y-%m-%d")
 
-    if group_by is None:
-        return await crud.get_report_by_range(session, start_date, end_date)
-    else:
-        return await crud.get_report_by_date(session, start_date, end_date, group_by)
+    async def compute():
+        if group_by is None:
+            return await crud.get_report_by_range(session, start_date, end_date, scope)
+        try:
+            return await crud.get_report_by_date(session, start_date, end_date, group_by, scope)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Диапазон с запасом в сутки: группировка захватывает весь последний бакет
+    key = ("report_by_date", start_date, end_date, group_by, scope)
+    return await report_cache.respond(request, key, compute, start_date, end_date + timedelta(days=1))
+
+
+# Даты и число периодов проверяются до прогноза: ValueError здесь - ошибка запроса
+def parse_predict_in(predict_in: PredictIn) -> tuple[datetime, datetime]:
+    start_date = datetime.strptime(predict_in.start_date, "%Y-%m-%d")
+    end_date = datetime.strptime(predict_in.end_date.strip("/"), "%Y-%m-%d")
+    if predict_in.group_by is not None:
+        crud.generate_period_ranges(start_date, end_date, predict_in.group_by)
+    return start_date, end_date
 
 
 @energy_router.get("/predict_report/")
 async def predict_report(
         predict_in: Annotated[PredictIn, Query()],
+        request: Request,
         session: AsyncSession = Depends(db_helper.session_dependency)
 ):
-    start_date = datetime.strptime(predict_in.start_date, "%Y-%m-%d")
-    end_date = predict_in.end_date.strip("/")
-    end_date = datetime.strptime(end_date, "%Y-%m-%d")
-    if predict_in.group_by is None:
-        return await crud.predict_report_by_range(session=session, start_date=start_date, end_date=end_date,
-                                                  solar_coefficient=settings.solar_coefficient,
-                                                  average_consumption_by_months=settings.average_consumption_by_months,
-                                                  longitude=predict_in.longitude, latitude=predict_in.latitude)
-    else:
+    try:
+        start_date, end_date = parse_predict_in(predict_in)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    timings = {}
+    # Прогноз - по городу, фильтр объекта или счётчика действует на прошедшую часть
+    scope = rollups.Scope(predict_in.site_id or "", predict_in.device_id or "")
+
+    async def compute():
+        if predict_in.group_by is None:
+            return await crud.predict_report_by_range(session=session, start_date=start_date, end_date=end_date,
+                                                      solar_coefficient=settings.solar_coefficient,
+                                                      average_consumption_by_months=settings.average_consumption_by_months,
+                                                      longitude=predict_in.longitude, latitude=predict_in.latitude,
+                                                      timings=timings, intervals=predict_in.intervals, scope=scope)
         return await crud.predict_report_by_date(session=session, start_date=start_date, end_date=end_date,
                                                  group_by=predict_in.group_by,
                                                  solar_coefficient=settings.solar_coefficient,
                                                  average_consumption_by_months=settings.average_consumption_by_months,
-                                                 longitude=predict_in.longitude, latitude=predict_in.latitude)
+                                                 longitude=predict_in.longitude, latitude=predict_in.latitude,
+                                                 timings=timings, intervals=predict_in.intervals, scope=scope)
+
+    # Граница прошлого и прогноза сдвигается каждый день, а все координаты рядом с городом дают один прогноз;
+    # новая версия модели города даёт новый ключ
+    city = crud.get_nearest_city(predict_in.longitude, predict_in.latitude)
+    key = ("predict_report", date.today(), start_date, end_date, predict_in.group_by, city.name if city else None,
+           model_registry.version(city.name) if city else None, predict_in.intervals, scope)
+    response = await report_cache.respond(request, key, compute, start_date, end_date + timedelta(days=1))
+    # Время фаз (db - агрегат прошлого, forecast - прогноз) есть только у ответа, посчитанного заново
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{phase};dur={duration:.1f}" for phase, duration in timings.items()
+        )
+    return response
+
+
+@energy_router.post("/predict_report/batch/")
+async def predict_report_batch(
+        batch: PredictBatchIn,
+        response: Response,
+        session: AsyncSession = Depends(db_helper.session_dependency)
+):
+    items = []
+    for index, predict_in in enumerate(batch.items):
+        try:
+            start_date, end_date = parse_predict_in(predict_in)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"items[{index}]: {e}")
+        items.append((start_date, end_date, predict_in.group_by, predict_in.longitude, predict_in.latitude,
+                      predict_in.intervals, rollups.Scope(predict_in.site_id or "", predict_in.device_id or "")))
+
+    # Ошибки загрузки модели (crud.ModelLoadError) - 500, как у /predict_report/
+    timings = {}
+    results = await crud.predict_report_batch(session=session, items=items,
+                                              solar_coefficient=settings.solar_coefficient,
+                                              average_consumption_by_months=settings.average_consumption_by_months,
+                                              timings=timings)
+    response.headers["Server-Timing"] = ", ".join(
+        f"{phase};dur={duration:.1f}" for phase, duration in timings.items()
+    )
+    return results
+
+
+@energy_router.get("/models/")
+async def list_models():
+    return crud.list_models()
+
+
+# Обучает новую версию модели города в фоне; после регистрации она подхватывается без перезапуска
+@energy_router.post("/models/train/", status_code=202)
+async def train_model(train_in: TrainModelIn):
+    try:
+        return training_jobs.submit(train_in.longitude, train_in.latitude, train_in.city)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@energy_router.get("/models/jobs/")
+async def training_jobs_list():
+    return training_jobs.list()
+
+
+@energy_router.get("/models/cache/")
+async def model_cache_stats():
+    return crud.model_cache_stats()
+
+
+@energy_router.get("/report_cache/")
+async def report_cache_stats():
+    return report_cache.stats()
+
+
+@energy_router.get("/forecast_pool/")
+async def forecast_pool_stats():
+    return forecast_pool.stats()
+
+
+@energy_router.get("/db_pool/")
+async def db_pool_stats():
+    return db_helper.pool_stats()
+
+
+@energy_router.get("/ingest_buffer/")
+async def ingest_buffer_stats():
+    return ingest_buffer.stats()
+
+
+# Секции energy с оценкой строк и размером, итог последнего обслуживания
+@energy_router.get("/partitions/")
+async def partition_status():
+    async with db_helper.engine.connect() as conn:
+        return await partitions.status(conn)
+
+
+@energy_router.post("/nearest_cities/")
+async def nearest_cities(coordinates: list[Coordinates] = Body(...)):
+    cities = crud.get_nearest_cities([(c.longitude, c.latitude) for c in coordinates])
+    return [
+        {
+            "longitude": city.longitude,
+            "latitude": city.latitude,
+            "city": city.name,
+            "distance_km": round(current_city_index().distance_km(city, c.longitude, c.latitude), 1),
+        }
+        for c, city in zip(coordinates, cities)
+    ]
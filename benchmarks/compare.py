@@ -0,0 +1,49 @@
+import argparse
+import json
+
+# Сравнение двух запусков бенчмарка:
+#   python -m benchmarks.compare benchmark-old.json benchmark-new.json
+# Изменение в процентах: для задержек минус - быстрее, для rps плюс - быстрее.
+
+METRICS = (("throughput_rps", None), ("p50", "latency_ms"), ("p95", "latency_ms"), ("p99", "latency_ms"))
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def metric(result: dict, name: str, group: str | None):
+    return result[group][name] if group else result[name]
+
+
+def change(old, new) -> str:
+    if not old or new is None:
+        return "-"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(old: dict, new: dict) -> list[str]:
+    lines = [f"{'сценарий':<28}" + "".join(f"{name:>28}" for name, _ in METRICS)]
+    for scenario in sorted(set(old["results"]) | set(new["results"])):
+        before, after = old["results"].get(scenario), new["results"].get(scenario)
+        if before is None or after is None:
+            lines.append(f"{scenario:<28}  только в {'новом' if before is None else 'старом'} запуске")
+            continue
+        cells = []
+        for name, group in METRICS:
+            a, b = metric(before, name, group), metric(after, name, group)
+            cells.append(f"{a or 0:.1f} → {b or 0:.1f} ({change(a, b)})".rjust(28))
+        lines.append(f"{scenario:<28}" + "".join(cells))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение результатов benchmarks.run")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+    old, new = load_results(args.old), load_results(args.new)
+    print(f"{old['meta'].get('commit')} → {new['meta'].get('commit')}")
+    for line in compare(old, new):
+        print(line)
@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+import numpy as np
+import requests
+
+# Воспроизводимый бенчмарк приёма данных, отчётов и прогнозов на локальном Postgres:
+#   python -m benchmarks.run --database-url postgresql://postgres@localhost/energy_bench --rows 10000000
+#   python -m benchmarks.run --database-url ... --no-seed --scenarios report predict
+# База очищается и заполняется детерминированными показаниями, затем запускается uvicorn без кэша отчётов
+# и по HTTP измеряются пропускная способность и перцентили задержки. Результат - JSON для сравнения
+# запусков (python -m benchmarks.compare old.json new.json).
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CHUNK = 1_000_000
+LOCAL_HOSTS = (None, "", "localhost", "127.0.0.1", "::1")
+
+# Длина окна отчёта по группировке: число периодов в ответе остаётся сопоставимым
+REPORT_WINDOWS = {
+    "15min": 1,
+    "hour": 7,
+    "day": 90,
+    "week": 365,
+    "month": 3 * 365,
+    "year": 10 * 365,
+    None: 90,
+}
+SCENARIOS = ("report", "predict", "create_energy")
+
+
+class Call(NamedTuple):
+    method: str
+    path: str
+    params: dict | None = None
+    json: dict | None = None
+
+
+def to_async_url(url: str) -> str:
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return url.replace(prefix, "postgresql+asyncpg://", 1)
+    return url
+
+
+def check_local(url: str) -> None:
+    from sqlalchemy.engine import make_url
+
+    parsed = make_url(url)
+    host = parsed.host or parsed.query.get("host")
+    if host not in LOCAL_HOSTS and not str(host).startswith("/"):
+        raise SystemExit(f"Бенчмарк очищает таблицы energy, база {host} не локальная (см. --allow-remote)")
+
+
+# Показания равномерно по [start, start + years): тип чередуется, значение - детерминированный хэш номера
+SEED_SQL = """
+INSERT INTO energy (type, value, created_at)
+SELECT 1 + g % 2, ((g + :seed) * 2654435761) % 1000,
+       CAST(:start AS timestamp) + g * (CAST(:step AS double precision) * interval '1 second')
+FROM generate_series(CAST(:lo AS bigint), CAST(:hi AS bigint) - 1) AS g
+"""
+
+
+async def seed_database(rows: int, start: datetime, years: int, seed: int) -> dict:
+    from sqlalchemy import text
+
+    from api_v1.core.DbHelper import db_helper
+    from api_v1.core.config import settings
+    from api_v1.core.migrations import create_schema
+    from api_v1.core.models import Energy, EnergyRollup  # noqa: F401 - регистрация таблиц в Base.metadata
+    from api_v1.energy import rollups
+
+    step = (start.replace(year=start.year + years) - start).total_seconds() / max(rows, 1)
+    timings = {}
+    started = time.perf_counter()
+    async with db_helper.engine.begin() as conn:
+        await create_schema(conn)
+        await conn.execute(text("TRUNCATE energy, energy_rollup RESTART IDENTITY"))
+        if settings.energy_partitioning:
+            # С ENERGY_PARTITIONING=true показания сразу ложатся в месячные секции, а не в секцию по умолчанию
+            from api_v1.energy.partitions import ensure_partitions
+
+            await ensure_partitions(conn, start, start.replace(year=start.year + years))
+    for lo in range(0, rows, SEED_CHUNK):
+        hi = min(lo + SEED_CHUNK, rows)
+        async with db_helper.engine.begin() as conn:
+            await conn.execute(text(SEED_SQL), {"seed": seed, "start": start, "step": step, "lo": lo, "hi": hi})
+        print(f"  показаний: {hi}/{rows}", file=sys.stderr)
+    timings["insert"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    async with db_helper.engine.begin() as conn:
+        await rollups.rebuild_rollups(conn)
+    async with db_helper.engine.connect() as conn:
+        await conn.execute(text("ANALYZE energy"))
+        await conn.execute(text("ANALYZE energy_rollup"))
+        postgres = (await conn.execute(text("SHOW server_version"))).scalar()
+    timings["rollups"] = time.perf_counter() - started
+    await db_helper.engine.dispose()
+    return {"seconds": {phase: round(value, 3) for phase, value in timings.items()}, "postgres": postgres}
+
+
+def start_server(database_url: str, port: int, forecast_workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        # Измеряется вычисление отчётов, а не кэш ответов
+        "REPORT_CACHE_SIZE": "0",
+        "FORECAST_WORKERS": str(forecast_workers),
+        "ECHO": "false",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(base_url: str, timeout: float = 300.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Сервер {base_url} не стал готов за {timeout:.0f} с")
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    ms = np.asarray(latencies) * 1000
+    p50, p90, p95, p99 = np.percentile(ms, [50, 90, 95, 99]) if len(ms) else (None,) * 4
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(latencies) / seconds, 1) if seconds else None,
+        "latency_ms": {
+            "mean": round(float(ms.mean()), 3) if len(ms) else None,
+            "p50": round(float(p50), 3) if p50 is not None else None,
+            "p90": round(float(p90), 3) if p90 is not None else None,
+            "p95": round(float(p95), 3) if p95 is not None else None,
+            "p99": round(float(p99), 3) if p99 is not None else None,
+            "max": round(float(ms.max()), 3) if len(ms) else None,
+        },
+    }
+
+
+# Выполняет вызовы в concurrency потоках, у каждого своё keep-alive соединение
+def measure(base_url: str, calls: list[Call], concurrency: int, warmup: int = 0) -> dict:
+    latencies = [0.0] * len(calls)
+    failed = [False] * len(calls)
+    next_index = itertools.count()
+
+    def worker():
+        with requests.Session() as session:
+            while (i := next(next_index)) < len(calls):
+                call = calls[i]
+                started = time.perf_counter()
+                try:
+                    response = session.request(call.method, base_url + call.path, params=call.params,
+                                               json=call.json, timeout=120)
+                    failed[i] = response.status_code >= 400
+                except requests.RequestException:
+                    failed[i] = True
+                latencies[i] = time.perf_counter() - started
+
+    if warmup:
+        measure(base_url, calls[:warmup], concurrency)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, sum(failed), time.perf_counter() - started)
+
+
+def report_calls(rng: np.random.Generator, start: date, years: int, group_by: str | None, count: int) -> list[Call]:
+    span = (start.replace(year=start.year + years) - start).days
+    window = min(REPORT_WINDOWS[group_by], span)
+    calls = []
+    for offset in rng.integers(0, span - window + 1, size=count):
+        window_start = start + timedelta(days=int(offset))
+        params = {
+            "start_date": window_start.isoformat(),
+            "end_date": (window_start + timedelta(days=window - 1)).isoformat(),
+        }
+        if group_by is not None:
+            params["group_by"] = group_by
+        calls.append(Call("GET", "/report_by_date/", params))
+    return calls
+
+
+def predict_calls(cities: list, shift: int, intervals: bool) -> list[Call]:
+    window_start = date.today() + timedelta(days=shift)
+    return [
+        Call("GET", "/predict_report/", {
+            "start_date": window_start.isoformat(),
+            "end_date": (window_start + timedelta(days=364)).isoformat(),
+            "group_by": "month",
+            "longitude": longitude,
+            "latitude": latitude,
+            "intervals": str(intervals).lower(),
+        })
+        for longitude, latitude, _ in cities
+    ]
+
+
+def run_scenarios(base_url: str, args) -> dict:
+    from api_v1.core.config import settings
+
+    rng = np.random.default_rng(args.seed)
+    start = date.fromisoformat(args.start)
+    results = {}
+    if "report" in args.scenarios:
+        results["report_total"] = measure(base_url, [Call("GET", "/report/")] * args.requests, args.concurrency,
+                                          args.warmup)
+        for group_by in REPORT_WINDOWS:
+            calls = report_calls(rng, start, args.years, group_by, args.requests)
+            results[f"report_by_date_{group_by or 'range'}"] = measure(base_url, calls, args.concurrency, args.warmup)
+            print(f"  report_by_date {group_by or 'range'}: готово", file=sys.stderr)
+
+    if "predict" in args.scenarios:
+        cities = list(settings.cities[:args.cities])
+        # Холодный прогноз: первый запрос к городу, модель ещё не загружена в процесс пула.
+        # Тёплый: модель в кэше, окна сдвинуты, чтобы не попадать в кэш сэмплов интервалов.
+        # Оба последовательно, чтобы разница задержек не зависела от очереди пула прогнозов
+        results["predict_cold"] = measure(base_url, predict_calls(cities, 0, intervals=True), 1)
+        rounds = max(args.requests // max(len(cities), 1), 1)
+        warm = [call for shift in range(1, rounds + 1) for call in predict_calls(cities, shift, intervals=True)]
+        results["predict_warm"] = measure(base_url, warm, 1)
+        point = [call for shift in range(rounds) for call in predict_calls(cities, shift, intervals=False)]
+        results["predict_point"] = measure(base_url, point, args.concurrency, args.warmup)
+        print("  predict: готово", file=sys.stderr)
+
+    if "create_energy" in args.scenarios:
+        values = rng.integers(0, 1000, size=args.requests)
+        calls = [Call("POST", "/create_energy/", json={"type": 1 + i % 2, "value": int(value)})
+                 for i, value in enumerate(values)]
+        results["create_energy"] = measure(base_url, calls, args.concurrency, args.warmup)
+        print("  create_energy: готово", file=sys.stderr)
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк приёма данных, отчётов и прогнозов")
+    parser.add_argument('--database-url', required=True, help="Локальная база для бенчмарка, таблицы energy очищаются")
+    parser.add_argument('--allow-remote', action='store_true', help="Разрешить нелокальную базу")
+    parser.add_argument('--rows', type=float, default=1e6, help="Сколько показаний засеять (1e5 - 1e8)")
+    parser.add_argument('--no-seed', action='store_true', help="Не пересоздавать данные, использовать уже засеянные")
+    parser.add_argument('--start', default="2022-01-01", help="Начало засеянного периода")
+    parser.add_argument('--years', type=int, default=3, help="Длина засеянного периода в годах")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenarios', nargs='*', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=10, help="Запросов прогрева перед замером (не учитываются)")
+    parser.add_argument('--cities', type=int, default=10, help="Городов в сценариях прогноза")
+    parser.add_argument('--forecast-workers', type=int, default=1,
+                        help="FORECAST_WORKERS сервера; с одним процессом тёплый прогноз всегда попадает в кэш моделей")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help="Замерять уже запущенный сервер вместо запуска своего")
+    parser.add_argument('--output', help="Файл результата, по умолчанию benchmark-<время>-<коммит>.json")
+    args = parser.parse_args(argv)
+
+    if not args.allow_remote:
+        check_local(args.database_url)
+    # Настройки и движок БД читают DATABASE_URL при импорте
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, ROOT_DIR)
+    rows = int(args.rows)
+
+    meta = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": None if args.no_seed else rows,
+        "start": args.start,
+        "years": args.years,
+        "seed": args.seed,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "forecast_workers": args.forecast_workers,
+    }
+    if not args.no_seed:
+        print(f"Заполнение базы: {rows} показаний", file=sys.stderr)
+        meta["seeding"] = asyncio.run(seed_database(rows, datetime.fromisoformat(args.start), args.years, args.seed))
+
+    server = None
+    base_url = args.url.rstrip("/") if args.url else f"http://127.0.0.1:{args.port}"
+    try:
+        if args.url is None:
+            server = start_server(to_async_url(args.database_url), args.port, args.forecast_workers)
+        wait_ready(base_url)
+        results = run_scenarios(base_url, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    output = args.output or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}-{meta['commit'] or 'nogit'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f"{'сценарий':<28}{'rps':>10}{'p50, мс':>12}{'p95, мс':>12}{'p99, мс':>12}{'ошибки':>9}")
+    for name, result in results.items():
+        latency = result["latency_ms"]
+        print(f"{name:<28}{result['throughput_rps'] or 0:>10.1f}{latency['p50'] or 0:>12.2f}"
+              f"{latency['p95'] or 0:>12.2f}{latency['p99'] or 0:>12.2f}{result['errors']:>9}")
+    print(f"Результат: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,83 @@
+import asyncio
+import time
 from contextlib import asynccontextmanager
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import text
+
 from api_v1.core.DbHelper import db_helper
 from api_v1.core.config import settings
-from api_v1.core.models.Base import Base
+from api_v1.core.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from api_v1.core.migrations import create_schema
+from api_v1.core.readiness import readiness
+from api_v1.energy import crud, partitions
+from api_v1.energy.rollups import ensure_rollups
+from api_v1.energy.forecast_pool import forecast_pool, ForecastOverloadedError, ForecastTimeoutError
+from api_v1.energy.ingest_buffer import ingest_buffer, IngestOverloadedError
+from api_v1.energy.live_totals import live_totals
+from api_v1.energy.training_jobs import training_jobs
 from api_v1.energy.views import energy_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Схема и роллапы нужны приёму данных и отчётам, поэтому до начала приёма запросов
+    started = time.perf_counter()
     async with db_helper.engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await create_schema(conn)
+        await ensure_rollups(conn)
+    maintenance = None
+    if settings.energy_partitioning:
+        # Секции текущего и следующих месяцев должны быть до первой записи, дальше их досоздаёт фоновая задача
+        await partitions.run_maintenance(db_helper.engine)
+        maintenance = asyncio.create_task(
+            partitions.maintenance_loop(db_helper.engine, settings.energy_partition_interval))
+    readiness.mark_ready("db_schema", time.perf_counter() - started)
+    if settings.ingest_buffer:
+        # Показания, оставшиеся в журнале после прошлого запуска, записываются первыми
+        await ingest_buffer.start()
+    # Прогнозы прогреваются в фоне, их готовность видна в /ready
+    readiness.start("models", crud.train_missing_models())
+    forecast_pool.start()
+    readiness.start("forecast_pool", forecast_pool.wait_warm())
     yield
+    if settings.ingest_buffer:
+        await ingest_buffer.stop()
+    live_totals.stop()
+    if maintenance is not None:
+        maintenance.cancel()
+    readiness.cancel()
+    training_jobs.shutdown()
+    forecast_pool.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(energy_router)
 
 
+@app.exception_handler(ForecastOverloadedError)
+async def forecast_overloaded_handler(request: Request, exc: ForecastOverloadedError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
+@app.exception_handler(IngestOverloadedError)
+async def ingest_overloaded_handler(request: Request, exc: IngestOverloadedError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(crud.ModelLoadError)
+async def model_load_error_handler(request: Request, exc: crud.ModelLoadError):
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+
+@app.exception_handler(ForecastTimeoutError)
+async def forecast_timeout_handler(request: Request, exc: ForecastTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -27,12 +85,37 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
 
+# Liveness: процесс жив и отвечает
 @app.get("/")
 async def ping() -> str:
     return "OK"
 
 
+# Readiness: база отвечает и фоновый прогрев закончен, иначе 503
+@app.get("/ready")
+async def ready():
+    state = readiness.snapshot()
+    try:
+        async with db_helper.engine.connect() as conn:
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=2)
+        state["components"]["db"] = {"status": "ready"}
+    except Exception as e:
+        state["components"]["db"] = {"status": "failed", "error": repr(e)}
+        state["ready"] = False
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
+# Метрики в формате Prometheus: задержки по маршрутам, SQL по функциям crud, загрузка моделей и прогнозы по городам,
+# кэши и пулы. Значения кэшей и пулов читаются только в момент сбора
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host=settings.host, port=int("8000"), reload=False)
 
@@ -1,30 +1,69 @@
+import os
+import pickle
+
 import pandas as pd
 from prophet import Prophet
 
-import pickle
-
+from api_v1.energy.forecast_store import get_forecast_filename, write_forecast_store
 from ml_training.Parser import get_data_from_NASA
 
+MODELS_DIR = 'api_v1/energy/ml_models'
+# Исторический период, на котором обучаются модели
+TRAINING_START = "20110101"
+TRAINING_END = "20231231"
+PROPHET_PARAMS = {"yearly_seasonality": True, "daily_seasonality": False}
+
+
+# Сохраняет дневной yhat модели на years лет вперёд с 1 января текущего года
+def materialize_forecast(model, model_path: str, years: int = 5) -> str:
+    start = pd.Timestamp.today().normalize().replace(month=1, day=1)
+    days = pd.date_range(start=start, end=start + pd.DateOffset(years=years) - pd.Timedelta(days=1), freq='D')
+    uncertainty_samples = model.uncertainty_samples
+    # Интервалы здесь не нужны, без сэмплирования predict в разы быстрее
+    model.uncertainty_samples = 0
+    try:
+        forecast = model.predict(pd.DataFrame({'ds': days}))
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+    return write_forecast_store(get_forecast_filename(model_path), days.values, forecast['yhat'].to_numpy())
+
 
-def training(longitude, latitude, city, path = '') -> list:
-    df = get_data_from_NASA(start="20110101", end="20231231", longitude=longitude, latitude=latitude)
+# version - номер версии в реестре моделей; без него пишутся исходные файлы города
+def get_model_path(longitude, latitude, city, path='', version: int | None = None) -> str:
+    path = path.removesuffix('/') if path else MODELS_DIR
+    suffix = f'_v{version}' if version else ''
+    return f'{path}/{round(longitude, 2)}-{round(latitude, 2)}-{city}{suffix}_prophet_model.pkl'
 
+
+def fit_model(df) -> Prophet:
     df_prophet = pd.DataFrame({
         'ds': df['date'],
         'y': df['irradiance']
     })
 
-    model = Prophet(yearly_seasonality=True, daily_seasonality=False)
+    model = Prophet(**PROPHET_PARAMS)
     model.fit(df_prophet)
-    if path:
-        if path.endswith('/'):
-            path= path.removesuffix('/')
-        path += f'/{round(longitude, 2)}-{round(latitude, 2)}-{city}_prophet_model.pkl'
-    else:
-        path = f'api_v1/energy/ml_models/{round(longitude, 2)}-{round(latitude, 2)}-{city}_prophet_model.pkl'
-    with open(path, 'wb') as f:
+    return model
+
+
+# Пишет модель во временный файл и подменяет им старый: при падении на диске не остаётся обрывка pickle
+def save_model(model, path: str) -> str:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
         pickle.dump(model, f)
-        #print(f"Модель {city} готова.")
+    os.replace(tmp_path, path)
+    return path
+
+
+def training(longitude, latitude, city, path = '', forecast_years: int = 5, version: int | None = None) -> list:
+    df = get_data_from_NASA(start=TRAINING_START, end=TRAINING_END, longitude=longitude, latitude=latitude)
+    model = fit_model(df)
+    path = save_model(model, get_model_path(longitude, latitude, city, path, version))
+    from ml_training.ExportParams import export_params
+
+    export_params(model, path)
+    if forecast_years:
+        materialize_forecast(model, path, years=forecast_years)
     return [longitude,latitude,city]
 
 
@@ -79,5 +118,6 @@ if __name__ == "__main__":
         [18.0686, 59.3293, "Stockholm"],
         [10.7522, 59.9139, "Oslo"]
     ]
-    for i in cities:
-        training(longitude=i[0], latitude=i[1], city=i[2], path='ml_models')
+    from ml_training.TrainAll import train_all
+
+    train_all(cities, models_dir='ml_models')
@@ -0,0 +1,89 @@
+import argparse
+import glob
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from api_v1.energy.prophet_params import ProphetParams, get_params_filename, write_prophet_params
+from ml_training.Materialize import MODEL_FILENAME_RE
+
+# Выгружает параметры обученных моделей в *_prophet_params.npz для вычисления прогноза без Prophet:
+#   python -m ml_training.ExportParams
+#   python -m ml_training.ExportParams --cities Moscow London
+
+# Допустимое расхождение yhat с Prophet.predict
+EXPORT_TOLERANCE = 1e-6
+VERIFY_YEARS = 5
+
+
+def extract_params(model) -> ProphetParams:
+    if model.growth != 'linear':
+        raise ValueError(f"Поддерживается только линейный тренд, у модели {model.growth}")
+    if model.extra_regressors or model.holidays is not None or model.country_holidays is not None:
+        raise ValueError("Регрессоры и праздники не поддерживаются")
+    if model.logistic_floor:
+        raise ValueError("logistic_floor не поддерживается")
+    for name, props in model.seasonalities.items():
+        if props['mode'] != 'additive' or props['condition_name'] is not None:
+            raise ValueError(f"Сезонность {name} должна быть аддитивной и безусловной")
+
+    beta = np.nanmean(model.params['beta'], axis=0)
+    columns = [np.flatnonzero(model.train_component_cols[name].to_numpy()) for name in model.seasonalities]
+    return ProphetParams(
+        start=model.start.value / 1e9,
+        t_scale=model.t_scale.total_seconds(),
+        y_scale=float(model.y_scale),
+        floor=0.0,
+        k=float(np.nanmean(model.params['k'])),
+        m=float(np.nanmean(model.params['m'])),
+        deltas=np.nanmean(model.params['delta'], axis=0),
+        changepoints_t=np.asarray(model.changepoints_t, dtype=np.float64),
+        periods=np.array([props['period'] for props in model.seasonalities.values()], dtype=np.float64),
+        orders=np.array([props['fourier_order'] for props in model.seasonalities.values()], dtype=np.int64),
+        beta=np.concatenate([beta[cols] for cols in columns]) if columns else np.zeros(0),
+        sigma_obs=float(np.nanmean(model.params['sigma_obs'])),
+    )
+
+
+# Максимальное расхождение с Prophet на истории обучения и VERIFY_YEARS лет вперёд
+def verify_params(model, params: ProphetParams) -> float:
+    history = model.history['ds']
+    days = pd.date_range(history.min(), history.max() + pd.DateOffset(years=VERIFY_YEARS), freq='D')
+    uncertainty_samples = model.uncertainty_samples
+    model.uncertainty_samples = 0
+    try:
+        expected = model.predict(pd.DataFrame({'ds': days}))['yhat'].to_numpy()
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+    return float(np.max(np.abs(params.predict(days.values) - expected)))
+
+
+def export_params(model, model_path: str, tolerance: float = EXPORT_TOLERANCE) -> str:
+    params = extract_params(model)
+    error = verify_params(model, params)
+    if error > tolerance:
+        raise ValueError(f"Расхождение с Prophet {error:.3g} больше допустимого {tolerance:.3g}")
+    return write_prophet_params(get_params_filename(model_path), params)
+
+
+def export_all(models_dir: str = 'api_v1/energy/ml_models', cities: list[str] | None = None):
+    for model_path in sorted(glob.glob(os.path.join(models_dir, '*_prophet_model.pkl'))):
+        city = MODEL_FILENAME_RE.match(os.path.basename(model_path)).group(3)
+        if cities and city not in cities:
+            continue
+        started = time.perf_counter()
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+        params_path = export_params(model, model_path)
+        print(f"{city}: {params_path} ({time.perf_counter() - started:.2f} с)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка параметров моделей Prophet для вычисления на NumPy")
+    parser.add_argument('--models-dir', default='api_v1/energy/ml_models')
+    parser.add_argument('--cities', nargs='*')
+    args = parser.parse_args()
+    export_all(models_dir=args.models_dir, cities=args.cities)
@@ -0,0 +1,36 @@
+import argparse
+import glob
+import os
+import pickle
+import re
+import time
+
+from ml_training.CycleTraining import materialize_forecast
+
+# Пересчитывает материализованные прогнозы для уже обученных моделей:
+#   python -m ml_training.Materialize --years 5
+#   python -m ml_training.Materialize --cities Moscow London
+
+# Версии из реестра моделей (*_v2_prophet_model.pkl) относятся к тому же городу
+MODEL_FILENAME_RE = re.compile(r'^(-?[\d.]+)-(-?[\d.]+)-(.+?)(?:_v\d+)?_prophet_model\.pkl$')
+
+
+def materialize_all(models_dir: str = 'api_v1/energy/ml_models', years: int = 5, cities: list[str] | None = None):
+    for model_path in sorted(glob.glob(os.path.join(models_dir, '*_prophet_model.pkl'))):
+        city = MODEL_FILENAME_RE.match(os.path.basename(model_path)).group(3)
+        if cities and city not in cities:
+            continue
+        started = time.perf_counter()
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+        forecast_path = materialize_forecast(model, model_path, years=years)
+        print(f"{city}: {forecast_path} ({time.perf_counter() - started:.2f} с)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Материализация дневных прогнозов Prophet")
+    parser.add_argument('--models-dir', default='api_v1/energy/ml_models')
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--cities', nargs='*')
+    args = parser.parse_args()
+    materialize_all(models_dir=args.models_dir, years=args.years, cities=args.cities)
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from importlib.metadata import version
+
+from api_v1.core.config import settings
+from api_v1.energy.forecast_store import get_forecast_filename
+from api_v1.energy.prophet_params import get_params_filename
+from ml_training.CycleTraining import (MODELS_DIR, PROPHET_PARAMS, TRAINING_END, TRAINING_START, fit_model,
+                                       get_model_path, materialize_forecast, save_model)
+from ml_training.ExportParams import export_params
+from ml_training.Parser import get_data_from_NASA
+
+# Параллельное обучение моделей городов каталога:
+#   python -m ml_training.TrainAll --workers 8
+#   python -m ml_training.TrainAll --cities Moscow London --force
+# Прогресс пишется в training_manifest.json рядом с моделями после каждого города, поэтому после
+# падения повторный запуск пропускает города, уже обученные с теми же входами и гиперпараметрами.
+
+MANIFEST_FILENAME = 'training_manifest.json'
+PHASES = ("fetch", "fit", "save", "export", "forecast")
+
+
+# Всё, от чего зависит модель города, кроме самих данных: запрос к NASA, гиперпараметры, версия Prophet
+def training_spec(longitude, latitude, city, forecast_years: int) -> dict:
+    return {
+        "longitude": longitude,
+        "latitude": latitude,
+        "city": city,
+        "start": TRAINING_START,
+        "end": TRAINING_END,
+        "params": PROPHET_PARAMS,
+        "forecast_years": forecast_years,
+        "prophet": version("prophet"),
+    }
+
+
+def spec_hash(spec: dict) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def input_hash(spec_digest: str, df) -> str:
+    return hashlib.sha256(spec_digest.encode() + df.to_csv(index=False).encode()).hexdigest()
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"cities": {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(path: str, manifest: dict) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Выполняется в отдельном процессе. Если known_input_hash совпал с хэшем скачанных данных, модель не переобучается
+def train_city(longitude, latitude, city, models_dir: str, forecast_years: int, spec_digest: str,
+               known_input_hash: str | None = None) -> dict:
+    timings = {}
+    started = time.perf_counter()
+    df = get_data_from_NASA(start=TRAINING_START, end=TRAINING_END, longitude=longitude, latitude=latitude)
+    timings["fetch"] = time.perf_counter() - started
+    digest = input_hash(spec_digest, df)
+    model_path = get_model_path(longitude, latitude, city, models_dir)
+    result = {"city": city, "spec_hash": spec_digest, "input_hash": digest, "model": model_path, "timings": timings}
+    if digest == known_input_hash:
+        return {**result, "status": "unchanged"}
+
+    started = time.perf_counter()
+    model = fit_model(df)
+    timings["fit"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    save_model(model, model_path)
+    timings["save"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    export_params(model, model_path)
+    timings["export"] = time.perf_counter() - started
+
+    if forecast_years:
+        started = time.perf_counter()
+        materialize_forecast(model, model_path, years=forecast_years)
+        timings["forecast"] = time.perf_counter() - started
+    return {**result, "status": "trained"}
+
+
+def is_up_to_date(entry: dict | None, spec_digest: str, model_path: str, forecast_years: int) -> bool:
+    if entry is None or entry.get("spec_hash") != spec_digest or not os.path.exists(model_path):
+        return False
+    if not os.path.exists(get_params_filename(model_path)):
+        return False
+    return not forecast_years or os.path.exists(get_forecast_filename(model_path))
+
+
+def print_report(results: list[dict], wall_time: float) -> None:
+    print(f"\n{'Город':<20}{'Статус':<12}" + "".join(f"{phase:>10}" for phase in PHASES) + f"{'всего':>10}")
+    for result in sorted(results, key=lambda r: r.get("total", 0.0), reverse=True):
+        timings = result.get("timings", {})
+        print(f"{result['city']:<20}{result['status']:<12}"
+              + "".join(f"{timings[phase]:>10.1f}" if phase in timings else f"{'-':>10}" for phase in PHASES)
+              + f"{result.get('total', 0.0):>10.1f}")
+    busy = sum(result.get("total", 0.0) for result in results)
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(f"\n{counts}; сумма по городам {busy:.1f} с, реальное время {wall_time:.1f} с"
+          + (f", ускорение {busy / wall_time:.1f}x" if wall_time > 0 and busy > 0 else ""))
+
+
+def train_all(cities, models_dir: str = MODELS_DIR, workers: int | None = None, forecast_years: int = 5,
+              force: bool = False, check_data: bool = False) -> list[dict]:
+    os.makedirs(models_dir, exist_ok=True)
+    manifest_path = os.path.join(models_dir, MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+    entries = manifest.setdefault("cities", {})
+
+    results = []
+    pending = []
+    for longitude, latitude, city in cities:
+        spec_digest = spec_hash(training_spec(longitude, latitude, city, forecast_years))
+        entry = entries.get(city)
+        up_to_date = not force and is_up_to_date(entry, spec_digest, get_model_path(longitude, latitude, city, models_dir),
+                                                 forecast_years)
+        if up_to_date and not check_data:
+            results.append({"city": city, "status": "skipped"})
+            continue
+        # С check_data данные всё равно скачиваются, но модель переобучается только если они изменились
+        pending.append((longitude, latitude, city, spec_digest, entry.get("input_hash") if up_to_date else None))
+
+    started = time.perf_counter()
+    if pending:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+        print(f"Обучение {len(pending)} городов в {workers} процессах, пропущено {len(results)}")
+        # spawn: Prophet/cmdstanpy в форкнутых процессах ведёт себя ненадёжно
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(train_city, longitude, latitude, city, models_dir, forecast_years, spec_digest,
+                                known_input_hash): city
+                for longitude, latitude, city, spec_digest, known_input_hash in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                city = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"city": city, "status": "failed", "error": repr(e)}
+                    # Прошлая удачная запись остаётся: старая модель на диске по-прежнему рабочая
+                    entries[city] = {**entries.get(city, {}), "error": result["error"]}
+                else:
+                    result["total"] = sum(result["timings"].values())
+                    entries[city] = {
+                        "spec_hash": result["spec_hash"],
+                        "input_hash": result["input_hash"],
+                        "model": result["model"],
+                        "trained_at": entries.get(city, {}).get("trained_at") if result["status"] == "unchanged"
+                        else datetime.now().isoformat(timespec="seconds"),
+                        "timings": {phase: round(value, 3) for phase, value in result["timings"].items()},
+                    }
+                write_manifest(manifest_path, manifest)
+                results.append(result)
+                print(f"[{done}/{len(pending)}] {city}: {result['status']}"
+                      + (f" ({result['total']:.1f} с)" if "total" in result else f" - {result.get('error')}"))
+
+    print_report(results, time.perf_counter() - started)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельное обучение моделей Prophet для городов каталога")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="По умолчанию - число ядер")
+    parser.add_argument('--years', type=int, default=5, help="Горизонт материализованного прогноза, 0 - не строить")
+    parser.add_argument('--cities', nargs='*', help="Обучить только эти города")
+    parser.add_argument('--force', action='store_true', help="Переобучить, даже если входы не менялись")
+    parser.add_argument('--check-data', action='store_true',
+                        help="Скачать данные заново и переобучить города, у которых они изменились")
+    args = parser.parse_args()
+
+    selected = [city for city in settings.cities if not args.cities or city[2] in args.cities]
+    results = train_all(selected, models_dir=args.models_dir, workers=args.workers, forecast_years=args.years,
+                        force=args.force, check_data=args.check_data)
+    if any(result["status"] == "failed" for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import pytest
+
+# Тесты с БД идут только против отдельной базы из TEST_DATABASE_URL: DATABASE_URL по умолчанию смотрит
+# в рабочую. Подменяется до импорта api_v1, который создаёт движок при импорте
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="не задан TEST_DATABASE_URL")
+    for item in items:
+        if "database" in item.keywords:
+            item.add_marker(skip)
+
+
+# Запуск корутины теста на пустых показаниях и роллапах тестовой базы. Движок привязан к циклу событий,
+# в котором открыл соединения, поэтому после каждого asyncio.run соединения закрываются
+@pytest.fixture
+def run_db():
+    from sqlalchemy import text
+
+    from api_v1.core.DbHelper import db_helper
+    from api_v1.core.config import settings
+    from api_v1.core.migrations import create_schema
+    from api_v1.energy import partitions
+    from api_v1.energy.report_cache import report_cache
+    from api_v1.energy.rollups import ensure_rollups
+
+    async def prepare():
+        async with db_helper.engine.begin() as conn:
+            await create_schema(conn)
+            await ensure_rollups(conn)
+            await conn.execute(text("TRUNCATE energy, energy_rollup"))
+        if settings.energy_partitioning:
+            await partitions.run_maintenance(db_helper.engine)
+
+    def run(coroutine):
+        async def disposing():
+            try:
+                return await coroutine
+            finally:
+                await db_helper.engine.dispose()
+
+        return asyncio.run(disposing())
+
+    run(prepare())
+    report_cache.clear()
+    yield run
+    report_cache.clear()
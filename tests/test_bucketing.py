@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from api_v1.energy.bucketing import GRANULARITIES, MAX_BUCKETS, ceil, get_granularity, iter_buckets, label
+
+
+def buckets(start: datetime, end: datetime, name: str) -> list[tuple[datetime, datetime]]:
+    return list(iter_buckets(start, end, GRANULARITIES[name]))
+
+
+def test_range_inside_one_bucket():
+    assert buckets(datetime(2025, 3, 10, 5), datetime(2025, 3, 10, 7), "day") == [
+        (datetime(2025, 3, 10), datetime(2025, 3, 11)),
+    ]
+
+
+# Правая граница включена: бакет, начинающийся ровно в end, попадает в отчёт
+def test_end_on_bucket_boundary_is_included():
+    assert buckets(datetime(2025, 1, 1), datetime(2025, 3, 1), "month") == [
+        (datetime(2025, 1, 1), datetime(2025, 2, 1)),
+        (datetime(2025, 2, 1), datetime(2025, 3, 1)),
+        (datetime(2025, 3, 1), datetime(2025, 4, 1)),
+    ]
+
+
+def test_start_inside_bucket_is_floored():
+    assert buckets(datetime(2025, 1, 1, 0, 14), datetime(2025, 1, 1, 0, 15), "15min") == [
+        (datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 1, 0, 15)),
+        (datetime(2025, 1, 1, 0, 15), datetime(2025, 1, 1, 0, 30)),
+    ]
+
+
+def test_month_across_year_and_leap_february():
+    result = buckets(datetime(2023, 12, 31), datetime(2024, 2, 29, 23), "month")
+    assert result == [
+        (datetime(2023, 12, 1), datetime(2024, 1, 1)),
+        (datetime(2024, 1, 1), datetime(2024, 2, 1)),
+        (datetime(2024, 2, 1), datetime(2024, 3, 1)),
+    ]
+
+
+# Недели ISO начинаются с понедельника, в том числе на стыке лет
+def test_week_starts_on_monday_across_year():
+    result = buckets(datetime(2024, 12, 31), datetime(2025, 1, 6), "week")
+    assert result == [
+        (datetime(2024, 12, 30), datetime(2025, 1, 6)),
+        (datetime(2025, 1, 6), datetime(2025, 1, 13)),
+    ]
+    assert [label(bucket, GRANULARITIES["week"]) for bucket, _ in result] == ["2025-W01", "2025-W02"]
+
+
+def test_year_buckets():
+    assert buckets(datetime(2024, 6, 1), datetime(2025, 1, 1), "year") == [
+        (datetime(2024, 1, 1), datetime(2025, 1, 1)),
+        (datetime(2025, 1, 1), datetime(2026, 1, 1)),
+    ]
+
+
+def test_max_buckets():
+    granularity = GRANULARITIES["15min"]
+    start = datetime(2025, 1, 1)
+    last = start + timedelta(minutes=15 * (MAX_BUCKETS - 1))
+    assert len(list(iter_buckets(start, last, granularity))) == MAX_BUCKETS
+    with pytest.raises(ValueError):
+        list(iter_buckets(start, last + timedelta(minutes=15), granularity))
+
+
+@pytest.mark.parametrize("name", list(GRANULARITIES))
+def test_ceil(name):
+    granularity = GRANULARITIES[name]
+    bucket = granularity.floor(datetime(2025, 5, 14, 13, 37))
+    assert ceil(bucket, granularity) == bucket
+    assert ceil(bucket + timedelta(microseconds=1), granularity) == granularity.step(bucket)
+
+
+def test_unknown_granularity():
+    with pytest.raises(ValueError):
+        get_granularity("decade")
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.core.models.Energy import Energy
+from api_v1.energy import crud, partitions
+from api_v1.energy.schemas import CreateEnergyBatchItem
+
+pytestmark = pytest.mark.database
+
+CREATED_AT = datetime(2026, 3, 2, 12, 0)
+
+
+def item(value: int, **fields) -> CreateEnergyBatchItem:
+    return CreateEnergyBatchItem(type=1, value=value, created_at=CREATED_AT, **fields)
+
+
+async def write_batch(items):
+    async with db_helper.session_factory() as session:
+        return await crud.create_energy_batch(session, items)
+
+
+async def values_by_id() -> dict[int, int]:
+    async with db_helper.session_factory() as session:
+        return dict((await session.execute(select(Energy.id, Energy.value))).tuples().all())
+
+
+# Статусы и id совпадают с элементами пакета, в том числе у строк без ключа вперемешку с ключами
+def test_statuses_and_ids_match_items(run_db):
+    items = [
+        item(100),
+        item(200, idempotency_key="a"),
+        item(300, idempotency_key="a"),
+        item(400),
+        item(500, seq=7, device_id="m-1"),
+        item(600, seq=7, device_id="m-2"),
+        item(700),
+    ]
+    result = run_db(write_batch(items))
+    assert [status["status"] for status in result["items"]] == [
+        "created", "created", "duplicate", "created", "created", "created", "created",
+    ]
+    assert (result["created"], result["duplicates"]) == (6, 1)
+    stored = run_db(values_by_id())
+    assert len(stored) == 6
+    for status, batch_item in zip(result["items"], items):
+        if status["status"] == "created":
+            assert stored[status["id"]] == batch_item.value
+
+
+# Повтор пакета: строки с ключом - дубликаты, строки без ключа записываются снова
+def test_repeated_batch(run_db):
+    items = [item(1, seq=1, device_id="m-1"), item(2), item(3, idempotency_key="b")]
+    first = run_db(write_batch(items))
+    second = run_db(write_batch(items))
+    assert [status["status"] for status in second["items"]] == ["duplicate", "created", "duplicate"]
+    assert "id" not in second["items"][0]
+    assert second["items"][1]["id"] != first["items"][1]["id"]
+    stored = run_db(values_by_id())
+    assert sorted(stored.values()) == [1, 2, 2, 3]
+
+
+# Пакет с показанием старше срока хранения отклоняется целиком, ничего не записав
+def test_rejected_batch_writes_nothing(run_db, monkeypatch):
+    monkeypatch.setattr(partitions, "retention_cutoff", lambda now=None: datetime(2026, 3, 1))
+    items = [item(1), CreateEnergyBatchItem(type=1, value=2, created_at=datetime(2026, 2, 27))]
+    with pytest.raises(ValueError, match=r"items\[1\]"):
+        run_db(write_batch(items))
+    assert run_db(values_by_id()) == {}
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.core.models.Energy import Energy
+from api_v1.energy import crud
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 3, 2, 12, 30, 15, 250)
+    assert crud.decode_cursor(crud.encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "MjAyNi0wMy0wMg=="])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError, match="курсор"):
+        crud.decode_cursor(cursor)
+
+
+# Страницы по курсору покрывают все строки ровно один раз, в том числе строки с одинаковым created_at
+# на границе страницы и строки, дописанные раньше курсора во время обхода
+@pytest.mark.database
+def test_pages_cover_all_rows_once(run_db):
+    times = [datetime(2026, 3, 2, 12, minute) for minute in (0, 0, 0, 1, 1, 2, 3, 3, 3, 4)]
+
+    async def scenario():
+        async with db_helper.session_factory() as session:
+            await session.execute(insert(Energy), [{"type": 1, "value": i, "created_at": t}
+                                                   for i, t in enumerate(times)])
+            await session.commit()
+            pages, cursor = [], None
+            while True:
+                items, cursor = await crud.get_energy_list(session, limit=3, cursor=cursor, energy_type=1)
+                pages.append([item["value"] for item in items])
+                if len(pages) == 1:
+                    # Строка раньше курсора не сдвигает следующие страницы
+                    await session.execute(insert(Energy).values(type=1, value=99, created_at=datetime(2026, 3, 2, 11, 0)))
+                    await session.commit()
+                if cursor is None:
+                    return pages
+
+    pages = run_db(scenario())
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert sorted(value for page in pages for value in page) == list(range(len(times)))
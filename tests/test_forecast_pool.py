@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+import main
+from api_v1.energy import crud
+from api_v1.energy.forecast_pool import ForecastOverloadedError, ForecastPool, ForecastTimeoutError
+
+
+# Пул, запущенный лениво первым прогнозом, выполняет тот же initializer, что и запуск из lifespan
+def test_lazy_start_runs_initializer():
+    initialized = []
+    pool = ForecastPool(workers=0, queue_size=1, timeout=5)
+    pool.configure(lambda *names: initialized.append((threading.current_thread().name, names)), ("Moscow",))
+    try:
+        thread_name = asyncio.run(pool.run(lambda: threading.current_thread().name))
+    finally:
+        pool.shutdown()
+    assert initialized == [(thread_name, ("Moscow",))]
+
+
+def test_shared_pool_preloads_models():
+    assert crud.forecast_pool._initializer is crud.init_forecast_worker
+
+
+# Обработчик, которым приложение отвечает на ошибку пула
+def run_handler(exc):
+    return asyncio.run(main.app.exception_handlers[type(exc)](None, exc))
+
+
+# Задач больше, чем workers + queue_size: лишняя сразу получает отказ, а API отвечает 503 с Retry-After
+def test_overload_is_rejected_with_503():
+    release = threading.Event()
+    pool = ForecastPool(workers=0, queue_size=1, timeout=5)
+
+    async def scenario():
+        running = [asyncio.create_task(pool.run(release.wait)) for _ in range(pool.capacity)]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(ForecastOverloadedError) as overloaded:
+                await pool.run(release.wait)
+        finally:
+            release.set()
+        await asyncio.gather(*running)
+        # Слоты освободились, следующая задача принимается
+        assert await pool.run(lambda: 1) == 1
+        return overloaded.value
+
+    try:
+        error = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+    assert pool.stats()["rejected"] == 1
+    response = run_handler(error)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+# Прогноз дольше таймаута: API отвечает 504, а слот занят, пока задача действительно не закончится
+def test_timeout_maps_to_504_and_keeps_slot():
+    release = threading.Event()
+    pool = ForecastPool(workers=0, queue_size=0, timeout=0.05)
+
+    async def scenario():
+        with pytest.raises(ForecastTimeoutError) as timed_out:
+            await pool.run(release.wait)
+        with pytest.raises(ForecastOverloadedError):
+            await pool.run(lambda: 1)
+        release.set()
+        while pool.stats()["in_flight"]:
+            await asyncio.sleep(0.01)
+        assert await pool.run(lambda: 1) == 1
+        return timed_out.value
+
+    try:
+        error = asyncio.run(scenario())
+    finally:
+        release.set()
+        pool.shutdown()
+    assert pool.stats()["timed_out"] == 1
+    assert run_handler(error).status_code == 504
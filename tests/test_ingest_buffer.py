@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.energy import crud
+from api_v1.energy.ingest_buffer import DEAD_LETTER_FILENAME, IngestBuffer
+from api_v1.energy.schemas import CreateEnergy, CreateEnergyBatchItem
+
+# Значение, которое фейковая БД отвергает, как Postgres отвергает число вне диапазона колонки
+BAD_VALUE = 777
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def database(monkeypatch):
+    state = {"rows": {}, "calls": 0, "down": False}
+
+    async def create_energy_batch(session, items):
+        state["calls"] += 1
+        if state["down"]:
+            raise ConnectionRefusedError("БД недоступна")
+        if any(item.value == BAD_VALUE for item in items):
+            raise DBAPIError("INSERT INTO energy", {}, Exception("value out of range"))
+        # Повтор по ключу идемпотентности не создаёт дубликатов
+        for item in items:
+            state["rows"].setdefault(item.idempotency_key, item)
+
+    monkeypatch.setattr(crud, "create_energy_batch", create_energy_batch)
+    monkeypatch.setattr(db_helper, "session_factory", FakeSession)
+    return state
+
+
+def make_buffer(directory) -> IngestBuffer:
+    return IngestBuffer(str(directory), flush_size=1000, flush_interval=60, max_pending=1000, fsync=False)
+
+
+def write_segment(directory, name, lines) -> None:
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+def journal_line(index: int, value: int) -> str:
+    return CreateEnergyBatchItem(
+        type=1, value=value, created_at=datetime(2026, 1, 1, 0, index), idempotency_key=f"wb:{index}",
+    ).model_dump_json(exclude_none=True)
+
+
+def dead_letters(directory) -> list[dict]:
+    with open(os.path.join(directory, DEAD_LETTER_FILENAME), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+# Сегмент, оставшийся от упавшего процесса, дописывается при старте, недописанная строка откладывается
+def test_replay_of_journal_left_by_crash(tmp_path, database):
+    write_segment(tmp_path, "1-1.jsonl", [journal_line(i, 10 + i) for i in range(5)] + ['{"type": 1, "val'])
+
+    async def scenario():
+        buffer = make_buffer(tmp_path)
+        await buffer.start()
+        assert buffer.stats()["replayed"] == 5
+        await buffer.stop()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert sorted(database["rows"]) == [f"wb:{i}" for i in range(5)]
+    assert buffer.stats()["flushed"] == 5
+    assert buffer.stats()["dead_lettered"] == 1
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".jsonl")] == []
+
+
+# Показание, которое БД отвергает, уходит в dead_letter.ndjson, остальные записываются и очередь пустеет
+def test_rejected_item_does_not_block_queue(tmp_path, database):
+    values = [10, 11, BAD_VALUE, 12, 13, 14, 15]
+    write_segment(tmp_path, "1-1.jsonl", [journal_line(i, value) for i, value in enumerate(values)])
+
+    async def scenario():
+        buffer = make_buffer(tmp_path)
+        await buffer.start()
+        await buffer.flush()
+        await buffer.stop()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert sorted(database["rows"]) == [f"wb:{i}" for i, value in enumerate(values) if value != BAD_VALUE]
+    assert buffer.pending == 0
+    assert buffer.stats()["dead_lettered"] == 1
+    [record] = dead_letters(tmp_path)
+    assert json.loads(record["line"])["value"] == BAD_VALUE
+    assert "value out of range" in record["error"]
+
+    # Файл отложенных показаний не подбирается повтором журнала
+    restarted = make_buffer(tmp_path)
+    restarted._replay()
+    assert restarted.pending == 0
+
+
+# Пока БД недоступна, пакет целиком остаётся в журнале и ничего не откладывается
+def test_unavailable_database_keeps_items(tmp_path, database):
+    write_segment(tmp_path, "1-1.jsonl", [journal_line(i, 10 + i) for i in range(3)])
+    database["down"] = True
+
+    async def scenario():
+        buffer = make_buffer(tmp_path)
+        await buffer.start()
+        with pytest.raises(ConnectionRefusedError):
+            await buffer.flush()
+        assert buffer.pending == 3
+        await buffer.stop()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert database["calls"] == 2
+    assert buffer.stats()["dead_lettered"] == 0
+    assert not os.path.exists(os.path.join(tmp_path, DEAD_LETTER_FILENAME))
+
+    restarted = make_buffer(tmp_path)
+    restarted._replay()
+    assert restarted.pending == 3
+    for segment in restarted._sealed_segments:
+        segment.close(remove=False)
+
+
+# Время приёма пишется в naive UTC независимо от часового пояса сервера
+def test_append_stamps_naive_utc(tmp_path, database, monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Vladivostok")
+    time.tzset()
+
+    async def scenario():
+        buffer = make_buffer(tmp_path)
+        await buffer.start()
+        item = await buffer.append(CreateEnergy(type=1, value=5))
+        await buffer.stop()
+        return item
+
+    try:
+        item = asyncio.run(scenario())
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    utc_now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert item.created_at.tzinfo is None
+    assert abs(item.created_at - utc_now) < timedelta(minutes=1)
+    assert list(database["rows"].values()) == [item]
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.energy import rollups
+from api_v1.energy.live_totals import LiveTotals
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+# Итоги из «БД»: запрос ждёт release, чтобы тест успел записать показания во время загрузки
+@pytest.fixture
+def database(monkeypatch):
+    state = {"rows": [(1, 100), (2, 30)], "release": None, "queries": 0}
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, query):
+            state["queries"] += 1
+            if state["release"] is not None:
+                await state["release"].wait()
+            return FakeResult(state["rows"])
+
+    monkeypatch.setattr(db_helper, "session_factory", FakeSession)
+    return state
+
+
+def totals(message: bytes) -> dict:
+    data = [line for line in message.decode().splitlines() if line.startswith("data: ")][0]
+    return json.loads(data[len("data: "):])
+
+
+# Первая подписка загружает итоги из БД, записи после неё приходят следующей рассылкой
+def test_seed_then_broadcast(database):
+    live = LiveTotals(interval=0.01, resync_interval=3600)
+
+    async def scenario():
+        stream = live.subscribe(rollups.ALL)
+        first = totals(await anext(stream))
+        live.add([(1, 7, "", ""), (2, 50, "", ""), (3, 1, "", "")])
+        second = totals(await asyncio.wait_for(anext(stream), 1))
+        await stream.aclose()
+        live.stop()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == {"1": 100, "2": 30, "3": 70, "4": 0}
+    assert second == {"1": 107, "2": 80, "3": 27, "4": 0}
+    assert live.stats()["scopes"] == 0
+
+
+# Показание, записанное, пока итоги загружаются, не теряется; вторая подписка не загружает их заново
+def test_write_during_seeding_is_counted(database):
+    live = LiveTotals(interval=0.01, resync_interval=3600)
+
+    async def scenario():
+        database["release"] = asyncio.Event()
+        stream = live.subscribe(rollups.ALL)
+        first = asyncio.create_task(anext(stream))
+        while not database["queries"]:
+            await asyncio.sleep(0)
+        live.add([(1, 5, "", "")])
+        database["release"].set()
+        seeded = totals(await first)
+        other = live.subscribe(rollups.ALL)
+        joined = totals(await anext(other))
+        await other.aclose()
+        await stream.aclose()
+        live.stop()
+        return seeded, joined
+
+    seeded, joined = asyncio.run(scenario())
+    assert seeded == joined == {"1": 105, "2": 30, "3": 75, "4": 0}
+    assert database["queries"] == 1
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from api_v1.core.config import settings
+from api_v1.energy import crud, rollups
+from api_v1.energy.forecast_pool import ForecastPool
+
+# Даты за горизонтом материализованного прогноза: каждый город идёт в пул
+START = datetime(2090, 1, 1)
+
+
+class PastlessSession:
+    # Все элементы в будущем: к БД отчёты не обращаются
+    def expire_all(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    calls = []
+
+    # Значение зависит только от даты и города, как у настоящей модели
+    def yhat(city_info, days):
+        return (days.astype("datetime64[D]").astype(np.int64) % 97).astype(np.float64) + len(city_info.name)
+
+    def predict_days(city_info, days):
+        calls.append((city_info.name, days[0], days[-1]))
+        return yhat(city_info, days)
+
+    def sample_days(city_info, days, n_samples, seed):
+        return np.tile(yhat(city_info, days)[:, None], (1, n_samples))
+
+    # Пул из одного потока и одного места в очереди: ёмкость 2
+    pool = ForecastPool(workers=0, queue_size=1, timeout=30)
+    monkeypatch.setattr(crud, "forecast_pool", pool)
+    monkeypatch.setattr(crud, "predict_days", predict_days)
+    monkeypatch.setattr(crud, "sample_days", sample_days)
+    crud.band_cache.clear()
+    yield pool, calls
+    pool.shutdown()
+
+
+def item(city, start, end, group_by=None, intervals=False):
+    return (start, end, group_by, city.longitude, city.latitude, intervals, rollups.ALL)
+
+
+def run_batch(items):
+    return asyncio.run(crud.predict_report_batch(
+        PastlessSession(), items, solar_coefficient=settings.solar_coefficient,
+        average_consumption_by_months=settings.average_consumption_by_months,
+    ))
+
+
+# Городов больше, чем пул принимает задач: пакет не должен получать отказ перегрузки
+def test_more_cities_than_pool_capacity(pool):
+    forecast_pool, calls = pool
+    cities = crud.current_city_index().cities[:forecast_pool.capacity + 4]
+    assert len(cities) > forecast_pool.capacity
+    results = run_batch([item(city, START, datetime(2090, 3, 1), "month", intervals=True) for city in cities])
+    assert len(results) == len(cities)
+    assert forecast_pool.stats()["rejected"] == 0
+    assert sorted(name for name, _, _ in calls) == sorted(city.name for city in cities)
+
+
+# Элементы одного города считаются на срезах одного прогноза и совпадают с одиночными запросами
+def test_items_of_one_city_share_forecast(pool):
+    _, calls = pool
+    city = crud.current_city_index().cities[0]
+    items = [
+        item(city, START, datetime(2090, 2, 15)),
+        item(city, datetime(2090, 2, 1), datetime(2090, 6, 30), "month"),
+        item(city, datetime(2090, 4, 10), datetime(2090, 4, 20), "day"),
+    ]
+    results = run_batch(items)
+    assert calls == [(city.name, np.datetime64("2090-01-01"), np.datetime64("2090-06-30"))]
+
+    calls.clear()
+    for (start, end, group_by, longitude, latitude, intervals, scope), result in zip(items, results):
+        kwargs = dict(session=PastlessSession(), start_date=start, end_date=end,
+                      solar_coefficient=settings.solar_coefficient,
+                      average_consumption_by_months=settings.average_consumption_by_months,
+                      longitude=longitude, latitude=latitude, intervals=intervals, scope=scope)
+        if group_by is None:
+            expected = asyncio.run(crud.predict_report_by_range(**kwargs))
+        else:
+            expected = asyncio.run(crud.predict_report_by_date(group_by=group_by, **kwargs))
+        assert result == expected
@@ -0,0 +1,40 @@
+import glob
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from api_v1.energy.prophet_params import get_params_filename, load_prophet_params
+
+pytest.importorskip("prophet")
+from ml_training.ExportParams import EXPORT_TOLERANCE, extract_params, verify_params  # noqa: E402
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "api_v1", "energy", "ml_models")
+# Модель, которая лежит в репозитории вместе с выгруженными параметрами
+SHIPPED_MODEL = "*São Paulo_prophet_model.pkl"
+
+
+@pytest.fixture(scope="module")
+def shipped_model():
+    paths = glob.glob(os.path.join(MODELS_DIR, SHIPPED_MODEL))
+    if not paths:
+        pytest.skip("нет модели из репозитория")
+    with open(paths[0], "rb") as f:
+        model = pickle.load(f)
+    return model, load_prophet_params(get_params_filename(paths[0]))
+
+
+# Вычисление на NumPy совпадает с Prophet.predict на истории и VERIFY_YEARS лет вперёд
+def test_params_match_prophet_predict(shipped_model):
+    model, params = shipped_model
+    assert verify_params(model, params) <= EXPORT_TOLERANCE
+
+
+# Файл параметров в репозитории соответствует текущей выгрузке из модели
+def test_shipped_params_match_extracted(shipped_model):
+    model, params = shipped_model
+    extracted = extract_params(model)
+    for name in params._fields:
+        np.testing.assert_allclose(getattr(params, name), getattr(extracted, name), rtol=0, atol=1e-12,
+                                   err_msg=name)
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from api_v1.energy.report_cache import ReportCache
+
+CLOSED_START, CLOSED_END = datetime(2025, 1, 1), datetime(2025, 2, 1)
+
+
+# Отчёт за закончившийся период поверх кэша, как в views; counter - сколько раз он считался
+@pytest.fixture
+def app():
+    cache = ReportCache(max_entries=10, open_ttl=5, closed_ttl=900)
+    counter = {"computed": 0}
+    app = FastAPI()
+
+    @app.get("/report/")
+    async def report(request: Request):
+        async def compute():
+            counter["computed"] += 1
+            return {"1": 100 * counter["computed"]}
+
+        return await cache.respond(request, ("report",), compute, CLOSED_START, CLOSED_END)
+
+    return TestClient(app), cache, counter
+
+
+def test_etag_and_not_modified(app):
+    client, cache, counter = app
+    first = client.get("/report/")
+    assert first.status_code == 200
+    assert first.json() == {"1": 100}
+    etag = first.headers["ETag"]
+
+    cached = client.get("/report/")
+    assert cached.headers["ETag"] == etag
+    assert counter["computed"] == 1
+
+    not_modified = client.get("/report/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert client.get("/report/", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get("/report/", headers={"If-Modified-Since": first.headers["Last-Modified"]}).status_code == 304
+    assert cache.stats()["not_modified"] == 2
+
+
+# Запись в диапазон отчёта сбрасывает ответ и меняет ETag, запись вне диапазона - нет
+def test_invalidation_by_written_range(app):
+    client, cache, counter = app
+    etag = client.get("/report/").headers["ETag"]
+
+    cache.invalidate(datetime(2025, 3, 1), datetime(2025, 3, 2))
+    assert client.get("/report/", headers={"If-None-Match": etag}).status_code == 304
+    assert counter["computed"] == 1
+
+    cache.invalidate(datetime(2025, 1, 10), datetime(2025, 1, 10))
+    fresh = client.get("/report/", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.json() == {"1": 200}
+    assert fresh.headers["ETag"] != etag
+
+
+# Ответ, посчитанный до записи показаний, которая закончилась во время расчёта, не сохраняется
+def test_result_computed_before_write_is_not_stored():
+    cache = ReportCache(max_entries=10, open_ttl=5, closed_ttl=900)
+
+    async def scenario():
+        async def compute():
+            cache.invalidate(CLOSED_START, CLOSED_END)
+            return {"1": 1}
+
+        scope = {"type": "http", "method": "GET", "path": "/report/", "headers": [], "query_string": b""}
+        response = await cache.respond(Request(scope), ("report",), compute, CLOSED_START, CLOSED_END)
+        assert response.status_code == 200
+
+    asyncio.run(scenario())
+    assert cache.get(("report",)) is None
+
+
+# Открытый период живёт open_ttl, закончившийся - closed_ttl
+def test_ttl_of_open_and_closed_periods(monkeypatch):
+    cache = ReportCache(max_entries=10, open_ttl=5, closed_ttl=900)
+    now = [1_000_000.0]
+    monkeypatch.setattr("api_v1.energy.report_cache.time.time", lambda: now[0])
+    cache.put(("closed",), {}, CLOSED_START, CLOSED_END)
+    cache.put(("open",), {}, CLOSED_START, None)
+
+    now[0] += 6
+    assert cache.get(("open",)) is None
+    assert cache.get(("closed",)) is not None
+    now[0] += 900
+    assert cache.get(("closed",)) is None
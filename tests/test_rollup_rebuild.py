@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from api_v1.core.DbHelper import db_helper
+from api_v1.core.models.Energy import Energy
+from api_v1.core.models.EnergyRollup import EnergyRollup
+from api_v1.energy import crud, partitions
+from api_v1.energy.schemas import CreateEnergyBatchItem
+
+pytestmark = pytest.mark.database
+
+CUTOFF = datetime(2026, 3, 1)
+
+
+async def month_totals() -> dict[datetime, int]:
+    async with db_helper.session_factory() as session:
+        return dict((await session.execute(
+            select(EnergyRollup.bucket, EnergyRollup.value).where(
+                EnergyRollup.granularity == "month", EnergyRollup.type == 1,
+                EnergyRollup.site_id == "", EnergyRollup.device_id == "",
+            )
+        )).tuples().all())
+
+
+# Роллапы месяцев старше срока хранения переживают пересчёт, остальные пересчитываются из сырых данных
+def test_rebuild_keeps_retired_months(run_db, monkeypatch):
+    async def scenario():
+        async with db_helper.session_factory() as session:
+            await crud.create_energy_batch(session, [
+                CreateEnergyBatchItem(type=1, value=10, created_at=datetime(2026, 1, 15)),
+                CreateEnergyBatchItem(type=1, value=20, created_at=datetime(2026, 3, 15)),
+            ])
+            # Январь ушёл в архив, в март записали в обход API
+            await session.execute(delete(Energy).where(Energy.created_at < CUTOFF))
+            await session.execute(insert(Energy).values(type=1, value=5, created_at=datetime(2026, 3, 20)))
+            await session.commit()
+        monkeypatch.setattr(partitions, "retention_cutoff", lambda now=None: CUTOFF)
+        async with db_helper.session_factory() as session:
+            await crud.rebuild_rollups(session)
+        return await month_totals()
+
+    assert run_db(scenario()) == {datetime(2026, 1, 1): 10, datetime(2026, 3, 1): 25}
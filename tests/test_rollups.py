@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from api_v1.energy.bucketing import GRANULARITIES
+from api_v1.energy.rollups import ROLLUP_LEVELS, cover_range
+
+
+# Куски идут подряд без пропусков и перекрытий, бакеты роллапов выровнены по своей гранулярности
+def assert_covers(pieces, start: datetime, end: datetime) -> None:
+    assert pieces[0][1] == start
+    assert pieces[-1][2] == end
+    for (_, _, previous_end), (_, next_start, _) in zip(pieces, pieces[1:]):
+        assert previous_end == next_start
+    for level, piece_start, piece_end in pieces:
+        assert piece_start < piece_end
+        if level is not None:
+            granularity = GRANULARITIES[level]
+            assert granularity.floor(piece_start) == piece_start
+            assert granularity.floor(piece_end) == piece_end
+
+
+def test_empty_range():
+    assert cover_range(datetime(2025, 1, 2), datetime(2025, 1, 2)) == []
+    assert cover_range(datetime(2025, 1, 2), datetime(2025, 1, 1)) == []
+
+
+def test_whole_months_use_one_month_piece():
+    assert cover_range(datetime(2025, 1, 1), datetime(2025, 4, 1)) == [
+        ("month", datetime(2025, 1, 1), datetime(2025, 4, 1)),
+    ]
+
+
+def test_range_shorter_than_hour_reads_raw_rows():
+    start, end = datetime(2025, 1, 1, 10, 5), datetime(2025, 1, 1, 10, 50)
+    assert cover_range(start, end) == [(None, start, end)]
+
+
+def test_edges_around_month():
+    start, end = datetime(2025, 1, 31, 23, 30), datetime(2025, 3, 1, 0, 30)
+    assert cover_range(start, end) == [
+        (None, start, datetime(2025, 2, 1)),
+        ("month", datetime(2025, 2, 1), datetime(2025, 3, 1)),
+        (None, datetime(2025, 3, 1), end),
+    ]
+
+
+def test_edges_use_days_then_hours():
+    start, end = datetime(2025, 1, 30, 22, 15), datetime(2025, 2, 2, 3, 45)
+    assert cover_range(start, end) == [
+        (None, start, datetime(2025, 1, 30, 23)),
+        ("hour", datetime(2025, 1, 30, 23), datetime(2025, 1, 31)),
+        ("day", datetime(2025, 1, 31), datetime(2025, 2, 2)),
+        ("hour", datetime(2025, 2, 2), datetime(2025, 2, 2, 3)),
+        (None, datetime(2025, 2, 2, 3), end),
+    ]
+
+
+# inclusive_end в отчётах сдвигает конец на микросекунду: последний бакет не должен потеряться
+def test_end_one_microsecond_after_boundary():
+    start, end = datetime(2025, 1, 1), datetime(2025, 2, 1) + timedelta(microseconds=1)
+    assert cover_range(start, end) == [
+        ("month", datetime(2025, 1, 1), datetime(2025, 2, 1)),
+        (None, datetime(2025, 2, 1), end),
+    ]
+
+
+@pytest.mark.parametrize("start, end", [
+    (datetime(2024, 2, 28, 13, 7), datetime(2024, 3, 1, 0, 1)),
+    (datetime(2023, 12, 31, 23, 59, 59), datetime(2025, 1, 1, 0, 0, 1)),
+    (datetime(2025, 6, 1), datetime(2025, 6, 1, 0, 0, 0, 1)),
+    (datetime(2025, 3, 30, 1), datetime(2025, 10, 26, 4)),
+])
+def test_pieces_cover_range_exactly(start, end):
+    assert_covers(cover_range(start, end), start, end)
+
+
+# Для недель месячные роллапы не подходят: неделя может начаться внутри месяца
+def test_week_granularity_uses_only_day_and_hour_rollups():
+    levels = GRANULARITIES["week"].rollup_levels
+    start, end = datetime(2025, 1, 27, 12), datetime(2025, 3, 3)
+    pieces = cover_range(start, end, levels)
+    assert_covers(pieces, start, end)
+    assert {level for level, _, _ in pieces} <= {None, *levels}
+    assert "month" in ROLLUP_LEVELS and "month" not in levels
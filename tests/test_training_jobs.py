@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api_v1.energy import training_jobs as training_jobs_module
+from api_v1.energy.training_jobs import TrainingJobs
+
+
+class FakeRegistry:
+    models_dir = "models"
+
+    def __init__(self):
+        self.registered = []
+
+    def version(self, city: str) -> int:
+        return 0
+
+    def register(self, city, longitude, latitude, version, model_filename) -> None:
+        self.registered.append((city, version))
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    monkeypatch.setattr(training_jobs_module, "train_model_version",
+                        lambda longitude, latitude, city, version, models_dir: f"{city}_v{version}.pkl")
+    monkeypatch.setattr(training_jobs_module, "JOBS_HISTORY", 0)
+    jobs = TrainingJobs(workers=1, registry=FakeRegistry())
+    jobs._executor = ThreadPoolExecutor(max_workers=1)
+    yield jobs
+    jobs.shutdown()
+
+
+# Задание, убранное из истории, пока его ждали, всё равно возвращается ожидающему
+def test_wait_survives_trim(jobs):
+    async def scenario():
+        job = jobs.submit(37.62, 55.75, "Moscow")
+        waiter = asyncio.create_task(jobs.wait(job["id"]))
+        await asyncio.sleep(0)
+        # Следующее задание ставится сразу после завершения первого, до того как ожидающий проснётся
+        jobs._tasks[job["id"]].add_done_callback(lambda _: jobs.submit(30.31, 59.94, "Saint Petersburg"))
+        result = await waiter
+        assert job["id"] not in [listed["id"] for listed in jobs.list()]
+        return result
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "done"
+    assert result["version"] == 1
+
+
+def test_wait_unknown_job(jobs):
+    with pytest.raises(ValueError, match="не найдено"):
+        asyncio.run(jobs.wait(404))